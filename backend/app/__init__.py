@@ -4,6 +4,7 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_cors import CORS
 import os
+import multiprocessing
 from datetime import timedelta
 
 db = SQLAlchemy()
@@ -20,6 +21,67 @@ def create_app():
     app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 262144000))  # 250MB
     app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', '/app/uploads')
     
+    # Metrics settings
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    
+    # Rate limit settings
+    app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
+    app.config['RATELIMIT_STORAGE'] = os.getenv('RATELIMIT_STORAGE', 'shm')
+    app.config['RATELIMIT_SHM_PATH'] = os.getenv('RATELIMIT_SHM_PATH')
+    
+    # 按路由类别（transfer/metadata/admin）限制在途请求数，上限为0时按 worker 数推算
+    app.config['ADMISSION_ENABLED'] = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+    app.config['ADMISSION_WORKERS'] = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+    app.config['ADMISSION_TRANSFER_LIMIT'] = int(os.getenv('ADMISSION_TRANSFER_LIMIT', 0))
+    app.config['ADMISSION_METADATA_LIMIT'] = int(os.getenv('ADMISSION_METADATA_LIMIT', 0))
+    app.config['ADMISSION_ADMIN_LIMIT'] = int(os.getenv('ADMISSION_ADMIN_LIMIT', 0))
+    app.config['ADMISSION_RETRY_AFTER'] = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+    app.config['ADMISSION_SHM_PATH'] = os.getenv('ADMISSION_SHM_PATH')
+    
+    # 慢查询记录（默认关闭），超过阈值的语句按指纹去重并自动 EXPLAIN，在 /admin/slow-queries 查看
+    app.config['SLOW_QUERY_ENABLED'] = os.getenv('SLOW_QUERY_ENABLED', 'false').lower() == 'true'
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+    app.config['SLOW_QUERY_MAX_ENTRIES'] = int(os.getenv('SLOW_QUERY_MAX_ENTRIES', 200))
+    app.config['SLOW_QUERY_EXPLAIN'] = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+    app.config['SLOW_QUERY_DIR'] = os.getenv('SLOW_QUERY_DIR')
+    
+    # 按需 CPU/内存采集（默认关闭），结果写入 PROFILE_DIR，在 /admin/profile 发起
+    app.config['PROFILING_ENABLED'] = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', '/app/logs/profiles')
+    
+    # Password hashing settings
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 0))
+    app.config['PASSWORD_HASH_QUEUE'] = int(os.getenv('PASSWORD_HASH_QUEUE', 32))
+    app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))
+    app.config['PASSWORD_HASH_SHM_PATH'] = os.getenv('PASSWORD_HASH_SHM_PATH')
+    
+    # Signed download link settings
+    app.config['DOWNLOAD_LINK_SECRET'] = os.getenv('DOWNLOAD_LINK_SECRET')
+    app.config['DOWNLOAD_LINK_MAX_TTL'] = int(os.getenv('DOWNLOAD_LINK_MAX_TTL', 86400))
+    app.config['DOWNLOAD_ACCOUNTING_LOG'] = os.getenv('DOWNLOAD_ACCOUNTING_LOG')
+    
+    # Storage backend settings
+    app.config['STORAGE_BACKEND'] = os.getenv('STORAGE_BACKEND', 'local')
+    app.config['S3_BUCKET'] = os.getenv('S3_BUCKET')
+    app.config['S3_PREFIX'] = os.getenv('S3_PREFIX', '')
+    app.config['S3_ENDPOINT_URL'] = os.getenv('S3_ENDPOINT_URL')
+    app.config['S3_REGION'] = os.getenv('S3_REGION')
+    app.config['S3_PART_SIZE'] = int(os.getenv('S3_PART_SIZE', 16 * 1024 * 1024))
+    app.config['S3_CONCURRENCY'] = int(os.getenv('S3_CONCURRENCY', 4))
+    app.config['S3_PRESIGN_TTL'] = int(os.getenv('S3_PRESIGN_TTL', 300))
+    
+    # 热点小文件 mmap 缓存（每个 worker 进程），HOT_CACHE_MAX_BYTES=0 时关闭
+    app.config['HOT_CACHE_MAX_BYTES'] = int(os.getenv('HOT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    app.config['HOT_CACHE_MAX_FILE_SIZE'] = int(os.getenv('HOT_CACHE_MAX_FILE_SIZE', 1024 * 1024))
+    
+    # 文件列表分面计数的每请求时间预算（毫秒）
+    app.config['FACET_TIME_BUDGET_MS'] = int(os.getenv('FACET_TIME_BUDGET_MS', 300))
+    
+    # 热门文件排行的下载热度半衰期（小时），修改后需要运行 scripts/rebuild_trending.py
+    app.config['TRENDING_HALF_LIFE_HOURS'] = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 72))
+    
     # Security settings
     app.config['WTF_CSRF_ENABLED'] = True
     app.config['WTF_CSRF_TIME_LIMIT'] = None
@@ -31,6 +93,21 @@ def create_app():
     login_manager.init_app(app)
     CORS(app)
     
+    from app.utils.metrics import init_metrics
+    init_metrics(app)
+    
+    from app.utils.slow_queries import init_slow_queries
+    init_slow_queries(app)
+    
+    from app.utils.profiling import init_profiling
+    init_profiling(app)
+    
+    from app.utils.rate_limit import init_rate_limit
+    init_rate_limit(app)
+    
+    from app.utils.admission import init_admission
+    init_admission(app)
+    
     login_manager.login_view = 'auth.login'
     login_manager.login_message = '请先登录后再访问此页面。'
     login_manager.login_message_category = 'info'
@@ -43,10 +120,14 @@ def create_app():
     from app.routes.files import files_bp
     from app.routes.admin import admin_bp
     from app.routes.api import api_bp
+    from app.routes.links import links_bp
+    from app.routes.folders import folders_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(files_bp)
     app.register_blueprint(admin_bp)
     app.register_blueprint(api_bp)
+    app.register_blueprint(links_bp)
+    app.register_blueprint(folders_bp)
     
     return app
\ No newline at end of file
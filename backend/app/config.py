@@ -1,4 +1,5 @@
 import os
+import multiprocessing
 from datetime import timedelta
 
 class Config:
@@ -9,6 +10,56 @@ class Config:
     MAX_CONTENT_LENGTH = 262144000  # 250MB
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', '/app/uploads')
     
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
+    RATELIMIT_STORAGE = os.getenv('RATELIMIT_STORAGE', 'shm')
+    RATELIMIT_SHM_PATH = os.getenv('RATELIMIT_SHM_PATH')
+    
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+    ADMISSION_WORKERS = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+    ADMISSION_TRANSFER_LIMIT = int(os.getenv('ADMISSION_TRANSFER_LIMIT', 0))
+    ADMISSION_METADATA_LIMIT = int(os.getenv('ADMISSION_METADATA_LIMIT', 0))
+    ADMISSION_ADMIN_LIMIT = int(os.getenv('ADMISSION_ADMIN_LIMIT', 0))
+    ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+    ADMISSION_SHM_PATH = os.getenv('ADMISSION_SHM_PATH')
+    
+    SLOW_QUERY_ENABLED = os.getenv('SLOW_QUERY_ENABLED', 'false').lower() == 'true'
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+    SLOW_QUERY_MAX_ENTRIES = int(os.getenv('SLOW_QUERY_MAX_ENTRIES', 200))
+    SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+    SLOW_QUERY_DIR = os.getenv('SLOW_QUERY_DIR')
+    
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILE_DIR = os.getenv('PROFILE_DIR', '/app/logs/profiles')
+    
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 0))
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 32))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))
+    PASSWORD_HASH_SHM_PATH = os.getenv('PASSWORD_HASH_SHM_PATH')
+    
+    DOWNLOAD_LINK_SECRET = os.getenv('DOWNLOAD_LINK_SECRET')
+    DOWNLOAD_LINK_MAX_TTL = int(os.getenv('DOWNLOAD_LINK_MAX_TTL', 86400))
+    DOWNLOAD_ACCOUNTING_LOG = os.getenv('DOWNLOAD_ACCOUNTING_LOG')
+    
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+    S3_REGION = os.getenv('S3_REGION')
+    S3_PART_SIZE = int(os.getenv('S3_PART_SIZE', 16 * 1024 * 1024))
+    S3_CONCURRENCY = int(os.getenv('S3_CONCURRENCY', 4))
+    S3_PRESIGN_TTL = int(os.getenv('S3_PRESIGN_TTL', 300))
+    
+    HOT_CACHE_MAX_BYTES = int(os.getenv('HOT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    HOT_CACHE_MAX_FILE_SIZE = int(os.getenv('HOT_CACHE_MAX_FILE_SIZE', 1024 * 1024))
+    
+    FACET_TIME_BUDGET_MS = int(os.getenv('FACET_TIME_BUDGET_MS', 300))
+    
+    TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 72))
+    
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = None
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
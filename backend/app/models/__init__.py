@@ -1,5 +1,9 @@
+from app import db
 from .user import User, Role, Permission
-from .file import File, FilePermission
-from .log import AccessLog
+from .file import (File, Folder, FilePermission, FileSelection, FileChunk, FileChunkUpload, FileVersion,
+                   FileVersionChunk, FileFacetCount)
+from .log import AccessLog, AccessLogRollup, AccessEntityRollup, RollupCursor
 
-__all__ = ['User', 'Role', 'Permission', 'File', 'FilePermission', 'AccessLog']
\ No newline at end of file
+__all__ = ['db', 'User', 'Role', 'Permission', 'File', 'Folder', 'FilePermission', 'FileSelection',
+           'FileChunk', 'FileChunkUpload', 'FileVersion', 'FileVersionChunk', 'FileFacetCount', 'AccessLog', 'AccessLogRollup',
+           'AccessEntityRollup', 'RollupCursor']
@@ -1,8 +1,24 @@
+import json
 from datetime import datetime
 from sqlalchemy.sql import func
 from app import db
 
 class File(db.Model):
+    # 存储布局：FLAT 为旧的 <user_id>/<filename>，FANOUT 为 <user_id>/ab/cd/<filename>
+    LAYOUT_FLAT = 0
+    LAYOUT_FANOUT = 1
+    
+    # 列表筛选和分面统计使用的组合索引：公开文件、用户自己的文件两种范围
+    __table_args__ = (
+        db.Index('ix_file_public_type', 'is_public', 'deleted_at', 'file_type', 'file_size'),
+        db.Index('ix_file_public_date', 'is_public', 'deleted_at', 'upload_date'),
+        db.Index('ix_file_owner_type', 'uploaded_by', 'deleted_at', 'file_type', 'file_size'),
+        db.Index('ix_file_owner_date', 'uploaded_by', 'deleted_at', 'upload_date'),
+        # 热门文件排行，见 app.utils.trending
+        db.Index('ix_file_public_trend', 'is_public', 'deleted_at', 'trend_score'),
+        db.Index('ix_file_public_type_trend', 'is_public', 'deleted_at', 'file_type', 'trend_score'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     original_filename = db.Column(db.String(255), nullable=False)
     filename = db.Column(db.String(255), unique=True, nullable=False, index=True)
@@ -14,15 +30,42 @@ class File(db.Model):
     uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     is_public = db.Column(db.Boolean, default=False)
     download_count = db.Column(db.Integer, default=0)
+    # 按时间衰减的下载热度（对数形式），没有下载过为空
+    trend_score = db.Column(db.Double)
     description = db.Column(db.Text)
+    storage_layout = db.Column(db.SmallInteger, nullable=False, default=0, server_default='0')
+    # 文件内容所在的存储后端，见 app.utils.storage
+    storage_backend = db.Column(db.String(16), nullable=False, default='local', server_default='local')
+    # 已生成的压缩副本位标志（1 gzip，2 brotli），为空表示等待后台压缩任务处理
+    compressed_variants = db.Column(db.SmallInteger, index=True)
+    # 当前版本号；为空表示内容是上传时的单个文件，否则由 FileVersion 的分块组成
+    current_version = db.Column(db.Integer)
+    # 所在文件夹；folder_path 冗余保存文件夹的物化路径，子树中的文件用前缀范围查询
+    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id'), index=True)
+    folder_path = db.Column(db.String(512), index=True)
+    
+    # 软删除：设置 deleted_at 后立即从列表中消失，由后台清理任务在宽限期后删除磁盘文件和记录
+    deleted_at = db.Column(db.DateTime, index=True)
+    purge_attempts = db.Column(db.SmallInteger, nullable=False, default=0, server_default='0')
+    purge_error = db.Column(db.String(255))
     
     # Relationships
     uploader = db.relationship('User', backref='uploaded_files')
+    folder = db.relationship('Folder', backref='files')
     permissions = db.relationship('FilePermission', backref='file', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<File {self.original_filename}>'
     
+    @classmethod
+    def active(cls):
+        """未被删除的文件"""
+        return cls.query.filter(cls.deleted_at.is_(None))
+    
+    @property
+    def is_deleted(self):
+        return self.deleted_at is not None
+    
     @property
     def size_human_readable(self):
         """Return human-readable file size"""
@@ -44,9 +87,35 @@ class File(db.Model):
                          'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']
         return self.mime_type in document_types
 
+class Folder(db.Model):
+    """文件夹，path 为从根到自身的ID物化路径（如 /3/17/42/）
+
+    子树查询为 path 上的前缀范围查询；改名不影响 path，移动时只改写子树内的 path
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('folder.id'), index=True)
+    path = db.Column(db.String(512), nullable=False, default='', index=True)
+    depth = db.Column(db.SmallInteger, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    owner = db.relationship('User', backref='folders')
+    parent = db.relationship('Folder', remote_side=[id], backref='children')
+    
+    def __repr__(self):
+        return f'<Folder {self.path}>'
+    
+    @staticmethod
+    def path_ids(path):
+        """物化路径中的文件夹ID，从根到叶"""
+        return [int(part) for part in (path or '').strip('/').split('/') if part]
+
 class FilePermission(db.Model):
+    """文件或文件夹的授权；文件夹授权作用于整个子树"""
     id = db.Column(db.Integer, primary_key=True)
-    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=False)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), index=True)
+    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id'), index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     permission_type = db.Column(db.String(20), nullable=False)  # 'read', 'write', 'delete'
     granted_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -58,4 +127,85 @@ class FilePermission(db.Model):
     granted_by_user = db.relationship('User', foreign_keys=[granted_by])
     
     def __repr__(self):
-        return f'<FilePermission {self.permission_type} for {self.file_id}>'
\ No newline at end of file
+        if self.folder_id:
+            return f'<FilePermission {self.permission_type} for folder {self.folder_id}>'
+        return f'<FilePermission {self.permission_type} for {self.file_id}>'
+
+class FileSelection(db.Model):
+    """用户保存的文件选择集，用于批量下载"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)
+    file_ids = db.Column(db.Text, nullable=False)  # JSON数组
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='file_selections')
+    
+    def __repr__(self):
+        return f'<FileSelection {self.name}>'
+    
+    def get_file_ids(self):
+        return json.loads(self.file_ids)
+    
+    def set_file_ids(self, file_ids):
+        self.file_ids = json.dumps(list(file_ids))
+
+class FileChunk(db.Model):
+    """按内容切分的数据块，多个版本共享，refcount 为引用该块的版本分块数；created_by 为第一个上传者"""
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    storage_backend = db.Column(db.String(16), nullable=False, default='local', server_default='local')
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<FileChunk {self.hash[:12]}>'
+
+class FileChunkUpload(db.Model):
+    """上传过某个分块的用户；同一内容可能由多个用户分别上传，每个用户各有一行"""
+    chunk_hash = db.Column(db.String(64), db.ForeignKey('file_chunk.hash'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False, index=True)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class FileVersion(db.Model):
+    """文件的一个版本"""
+    __table_args__ = (db.UniqueConstraint('file_id', 'version', name='uq_file_version'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_count = db.Column(db.Integer, nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    comment = db.Column(db.String(255))
+    
+    def __repr__(self):
+        return f'<FileVersion {self.file_id} v{self.version}>'
+
+class FileVersionChunk(db.Model):
+    """版本内容的分块列表，offset 为分块在版本中的起始位置"""
+    version_id = db.Column(db.Integer, db.ForeignKey('file_version.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    chunk_hash = db.Column(db.String(64), db.ForeignKey('file_chunk.hash'), nullable=False, index=True)
+    offset = db.Column(db.BigInteger, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+
+class FileFacetCount(db.Model):
+    """增量维护的分面计数，见 app.utils.facets
+
+    scope 为统计范围（全部/公开/某用户的文件），filter_facet 为空时是不带筛选的计数，否则是
+    filter_facet=filter_value 筛选下其他分面的计数；同一计数分散在多个 slot 中以减少热点行的锁等待
+    """
+    scope = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    owner_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    filter_facet = db.Column(db.String(16), primary_key=True)
+    filter_value = db.Column(db.String(100), primary_key=True)
+    facet = db.Column(db.String(16), primary_key=True)
+    value = db.Column(db.String(100), primary_key=True)
+    slot = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<FileFacetCount {self.facet}={self.value}>'
@@ -40,4 +40,59 @@ class AccessLog(db.Model):
         )
         db.session.add(log_entry)
         db.session.commit()
-        return log_entry
\ No newline at end of file
+        return log_entry
+
+class AccessLogRollup(db.Model):
+    """访问日志按时间段汇总，由 scripts/rollup_access_logs.py 增量生成，不随原始日志清理"""
+    __tablename__ = 'access_log_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.String(1), nullable=False)  # 'h' 小时, 'd' 天, 'm' 月
+    bucket = db.Column(db.DateTime, nullable=False)  # 时间段起点（UTC）
+    endpoint = db.Column(db.String(255), nullable=False)
+    action = db.Column(db.String(50), nullable=False, default='')
+    status_code = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    latency_count = db.Column(db.BigInteger, nullable=False, default=0)
+    latency_sum = db.Column(db.Float, nullable=False, default=0)
+    latency_max = db.Column(db.Float)
+    latency_sketch = db.Column(db.Text)  # LatencySketch 的JSON编码，可直接合并
+
+    __table_args__ = (
+        db.UniqueConstraint('resolution', 'bucket', 'endpoint', 'action', 'status_code',
+                            name='uq_access_log_rollup_key'),
+    )
+
+    def __repr__(self):
+        return f'<AccessLogRollup {self.resolution}:{self.bucket}:{self.endpoint}:{self.status_code}>'
+
+
+class AccessEntityRollup(db.Model):
+    """按文件和用户汇总的访问次数，用于排行；只有天和月两级"""
+    __tablename__ = 'access_entity_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.String(1), nullable=False)  # 'd' 天, 'm' 月
+    bucket = db.Column(db.DateTime, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # 'file' / 'user'
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(50), nullable=False, default='')
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('resolution', 'bucket', 'kind', 'entity_id', 'action',
+                            name='uq_access_entity_rollup_key'),
+        db.Index('ix_access_entity_rollup_lookup', 'kind', 'action', 'resolution', 'bucket'),
+    )
+
+
+class RollupCursor(db.Model):
+    """增量任务的处理进度"""
+    __tablename__ = 'rollup_cursor'
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    last_created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
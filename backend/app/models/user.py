@@ -1,5 +1,4 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from app import db, login_manager
 
@@ -49,6 +48,10 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
+    # 未删除文件的总大小，上传和删除时在同一事务中更新
+    storage_used = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    # 单独设置的配额（字节），为空时按角色配额
+    storage_quota = db.Column(db.BigInteger)
     
     roles = db.relationship('Role', secondary=user_roles, backref='users')
     
@@ -56,10 +59,17 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from app.utils.passwords import PasswordHasher
+        self.password_hash = PasswordHasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """校验密码；哈希算法或参数已变更时顺带重新哈希，由调用方提交"""
+        from app.utils.passwords import PasswordHasher
+        if not PasswordHasher.verify(self.password_hash, password):
+            return False
+        if PasswordHasher.needs_rehash(self.password_hash):
+            self.password_hash = PasswordHasher.hash(password)
+        return True
     
     def has_role(self, role_name):
         return any(r.name == role_name for r in self.roles)
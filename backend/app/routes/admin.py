@@ -1,12 +1,37 @@
-from flask import Blueprint, render_template, request, jsonify, url_for
+import os
+import hmac
+import math
+from flask import (Blueprint, render_template, request, jsonify, url_for, current_app, Response,
+                   send_from_directory, abort)
 from flask_login import login_required, current_user
 from sqlalchemy import func
 from datetime import datetime, timedelta
 from app.models import User, File, AccessLog, Role, db
-from app.utils.permissions import require_permission
+from app.utils.permissions import require_permission, has_permission
+from app.utils.metrics import render_metrics
+from app.utils.slow_queries import get_slow_query_log
+from app.utils.profiling import get_profiler, sibling_workers, KINDS, MAX_SECONDS
+from app.utils.quota import QuotaManager
+from app.utils.access_rollup import AccessReports, AccessRollup
+from app.utils.listing import (USER_PROJECTION, ADMIN_FILE_PROJECTION, LOG_PROJECTION,
+                               json_list_response, wants_json)
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+# JSON 列表单页最大条数，超过 STREAM_THRESHOLD 时流式发送
+ADMIN_LIST_MAX_PER_PAGE = 1000
+
+def _json_listing(projection, key, filters, order_by, page, default_per_page=20):
+    """管理列表的JSON格式：只查询需要的列，支持 fields 和 per_page 参数"""
+    try:
+        fields = projection.parse()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    per_page = min(max(request.args.get('per_page', default_per_page, type=int), 1), ADMIN_LIST_MAX_PER_PAGE)
+    items, pagination = projection.page(fields, filters, order_by, page, per_page)
+    return json_list_response(key, items, pagination=pagination)
+
 @admin_bp.route('/')
 @login_required
 @require_permission('admin.manage_users')
@@ -14,8 +39,8 @@ def dashboard():
     """管理后台首页"""
     # 统计数据
     total_users = User.query.count()
-    total_files = File.query.count()
-    total_size = db.session.query(func.sum(File.file_size)).scalar() or 0
+    total_files = File.active().count()
+    total_size = db.session.query(func.sum(File.file_size)).filter(File.deleted_at.is_(None)).scalar() or 0
     
     # 获取最近7天的文件上传统计
     today = datetime.utcnow()
@@ -26,7 +51,8 @@ def dashboard():
         func.count(File.id).label('count'),
         func.sum(File.file_size).label('size')
     ).filter(
-        File.upload_date >= seven_days_ago
+        File.upload_date >= seven_days_ago,
+        File.deleted_at.is_(None)
     ).group_by(
         func.date(File.upload_date)
     ).all()
@@ -50,6 +76,11 @@ def users():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
+    if wants_json():
+        return _json_listing(USER_PROJECTION, 'users', [
+            User.username.contains(search) | User.email.contains(search)
+        ] if search else [], [User.created_at.desc()], page)
+    
     query = User.query
     
     if search:
@@ -70,7 +101,7 @@ def users():
 def user_detail(user_id):
     """用户详情"""
     user = User.query.get_or_404(user_id)
-    user_files = File.query.filter_by(uploaded_by=user.id).order_by(File.upload_date.desc()).all()
+    user_files = File.active().filter_by(uploaded_by=user.id).order_by(File.upload_date.desc()).all()
     
     return render_template('admin/user_detail.html', user=user, user_files=user_files)
 
@@ -112,6 +143,26 @@ def update_user_status(user_id):
     
     return jsonify({'message': '用户状态更新成功'})
 
+@admin_bp.route('/users/<int:user_id>/quota', methods=['PUT'])
+@login_required
+@require_permission('admin.manage_users')
+def update_user_quota(user_id):
+    """设置用户存储配额，quota 为空时恢复按角色配额"""
+    user = User.query.get_or_404(user_id)
+    data = request.get_json()
+    
+    if not data or 'quota' not in data:
+        return jsonify({'error': '缺少配额数据'}), 400
+    
+    quota = data['quota']
+    if quota is not None and (not isinstance(quota, int) or isinstance(quota, bool) or quota < 0):
+        return jsonify({'error': '配额必须是非负整数（字节）'}), 400
+    
+    user.storage_quota = quota
+    db.session.commit()
+    
+    return jsonify({'message': '用户配额更新成功', **QuotaManager.usage(user)})
+
 @admin_bp.route('/files')
 @login_required
 @require_permission('admin.view_logs')
@@ -120,7 +171,13 @@ def files():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
-    query = File.query
+    if wants_json():
+        filters = [File.deleted_at.is_(None)]
+        if search:
+            filters.append(File.original_filename.contains(search))
+        return _json_listing(ADMIN_FILE_PROJECTION, 'files', filters, [File.upload_date.desc()], page)
+    
+    query = File.active()
     
     if search:
         query = query.filter(
@@ -144,6 +201,10 @@ def logs():
     from datetime import datetime, timedelta
     one_month_ago = datetime.utcnow() - timedelta(days=30)
     
+    if wants_json():
+        return _json_listing(LOG_PROJECTION, 'logs', [AccessLog.created_at >= one_month_ago],
+                             [AccessLog.created_at.desc()], page, default_per_page=50)
+    
     logs = AccessLog.query.filter(
         AccessLog.created_at >= one_month_ago
     ).order_by(
@@ -152,9 +213,184 @@ def logs():
     
     return render_template('admin/logs.html', logs=logs)
 
+def _report_range():
+    """报表时间范围，默认最近30天；支持 ISO 日期或时间"""
+    end = request.args.get('end')
+    start = request.args.get('start')
+    end = datetime.fromisoformat(end) if end else datetime.utcnow()
+    start = datetime.fromisoformat(start) if start else end - timedelta(days=30)
+    if start >= end:
+        raise ValueError('start 必须早于 end')
+    return start, end
+
+@admin_bp.route('/reports')
+@login_required
+@require_permission('admin.view_logs')
+def reports():
+    """访问统计报表：按接口/动作/状态码汇总请求数、错误数、流量和响应时间分位数"""
+    group_by = request.args.get('group_by', 'endpoint')
+    if group_by not in AccessReports.GROUP_FIELDS and group_by not in AccessReports.SERIES_RESOLUTIONS:
+        return jsonify({'error': '不支持的分组方式'}), 400
+    try:
+        start, end = _report_range()
+        rows = AccessReports.summary(
+            start, end, group_by,
+            endpoint=request.args.get('endpoint'),
+            action=request.args.get('action'),
+            status=request.args.get('status'),
+            with_latency=request.args.get('latency', '1') != '0'
+        )
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    
+    limit = max(1, min(request.args.get('limit', 100, type=int), 100))
+    cursor = AccessRollup.progress()
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group_by': group_by,
+        'rolled_up_to': cursor.last_created_at.isoformat() if cursor and cursor.last_created_at else None,
+        'rows': rows[:limit],
+    })
+
+@admin_bp.route('/reports/top')
+@login_required
+@require_permission('admin.view_logs')
+def reports_top():
+    """访问最多的文件或用户"""
+    kind = request.args.get('kind', 'file')
+    if kind not in ('file', 'user'):
+        return jsonify({'error': 'kind 只能是 file 或 user'}), 400
+    try:
+        start, end = _report_range()
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    top = AccessReports.top(kind, start, end, request.args.get('action'), limit,
+                            request.args.get('order_by', 'count'))
+    
+    ids = [entity_id for entity_id, _, _ in top]
+    if kind == 'file':
+        names = dict(db.session.query(File.id, File.original_filename).filter(File.id.in_(ids)).all())
+    else:
+        names = dict(db.session.query(User.id, User.username).filter(User.id.in_(ids)).all())
+    
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'kind': kind,
+        'rows': [{'id': entity_id, 'name': names.get(entity_id), 'count': count, 'bytes': size}
+                 for entity_id, count, size in top],
+    })
+
+@admin_bp.route('/slow-queries', methods=['GET', 'DELETE'])
+@login_required
+@require_permission('admin.view_logs')
+def slow_queries():
+    """超过阈值的SQL语句，按指纹汇总所有 worker 的记录；DELETE 清空所有 worker 的记录"""
+    log = get_slow_query_log()
+    if log is None:
+        return jsonify({'error': '慢查询记录未启用（SLOW_QUERY_ENABLED）'}), 404
+    
+    if request.method == 'DELETE':
+        if not has_permission('admin.manage_users'):
+            return jsonify({'error': '权限不足'}), 403
+        log.reset()
+        return jsonify({'message': '慢查询记录已清空'})
+    
+    order_by = request.args.get('order_by', 'total_ms')
+    if order_by not in ('total_ms', 'max_ms', 'avg_ms', 'count', 'last_seen'):
+        return jsonify({'error': '不支持的排序字段'}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    
+    entries = sorted(log.collect(), key=lambda entry: entry[order_by], reverse=True)
+    return jsonify({
+        'threshold_ms': log.threshold * 1000,
+        'total': len(entries),
+        'queries': entries[:limit],
+    })
+
+@admin_bp.route('/profile', methods=['GET', 'POST'])
+@login_required
+@require_permission('admin.view_logs')
+def profile():
+    """按需采集 CPU 或内存：POST 在指定 worker（默认处理本请求的 worker）中采集 seconds 秒，
+    需要 admin.manage_users 权限；GET 返回 worker 列表、进行中的采集和已写出的结果文件"""
+    profiler = get_profiler()
+    if profiler is None:
+        return jsonify({'error': '按需采集未启用（PROFILING_ENABLED）'}), 404
+    
+    if request.method == 'GET':
+        return jsonify({
+            'pid': os.getpid(),
+            'workers': sorted(sibling_workers()),
+            'running': profiler.running(),
+            'captures': profiler.captures(),
+        })
+    
+    # 采集会拖慢所在 worker，发起采集需要比查看更高的权限
+    if not has_permission('admin.manage_users'):
+        return jsonify({'error': '权限不足'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in KINDS:
+        return jsonify({'error': f'kind 只能是 {"、".join(KINDS)}'}), 400
+    try:
+        seconds = int(data.get('seconds', 30))
+        interval = float(data.get('interval_ms', 5)) / 1000
+        pid = int(data.get('pid') or os.getpid())
+    except (TypeError, ValueError):
+        return jsonify({'error': '参数错误'}), 400
+    if not 1 <= seconds <= MAX_SECONDS:
+        return jsonify({'error': f'seconds 必须在 1 到 {MAX_SECONDS} 之间'}), 400
+    if not (math.isfinite(interval) and 0.001 <= interval <= 1):
+        return jsonify({'error': 'interval_ms 必须在 1 到 1000 之间'}), 400
+    
+    if pid != os.getpid():
+        try:
+            profiler.signal_worker(pid, kind, seconds, interval)
+        except (ValueError, OSError) as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'message': f'已通知 worker {pid} 开始采集', 'pid': pid}), 202
+    
+    capture = profiler.start(kind, seconds, interval)
+    if capture is None:
+        return jsonify({'error': '本 worker 已有同类采集在进行'}), 409
+    return jsonify(capture), 202
+
+@admin_bp.route('/profile/<name>')
+@login_required
+@require_permission('admin.view_logs')
+def profile_download(name):
+    """下载采集结果文件"""
+    profiler = get_profiler()
+    if profiler is None or not name.startswith(KINDS):
+        abort(404)
+    return send_from_directory(profiler.directory, name, as_attachment=True)
+
 @admin_bp.route('/backup')
 @login_required
 @require_permission('admin.backup')
 def backup():
     """备份管理"""
-    return render_template('admin/backup.html')
\ No newline at end of file
+    return render_template('admin/backup.html')
+
+@admin_bp.route('/metrics')
+def metrics():
+    """Prometheus指标导出，支持Bearer令牌或管理员登录访问"""
+    token = current_app.config.get('METRICS_TOKEN')
+    auth_header = request.headers.get('Authorization', '')
+    
+    authorized = False
+    if token and auth_header.startswith('Bearer '):
+        authorized = hmac.compare_digest(auth_header[7:], token)
+    if not authorized:
+        authorized = has_permission('admin.view_logs')
+    
+    if not authorized:
+        return jsonify({'error': '权限不足'}), 403
+    
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
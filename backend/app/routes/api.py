@@ -1,65 +1,151 @@
-from flask import Blueprint, request, jsonify, send_file
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, Response, current_app
 from flask_login import login_required, current_user
-from app.models import File, User
+from sqlalchemy.orm import joinedload
+from app.models import File, Folder, User, FileSelection, FileVersion, db
 from app.utils.file_utils import FileUtils
-from app.utils.permissions import require_permission, can_access_file
+from app.utils.permissions import require_permission, can_access_file, can_access_folder, evaluate_file_access
 from app.utils.security import SecurityManager
+from app.utils.rate_limit import rate_limit
+from app.utils.quota import QuotaManager, require_storage_quota, QUOTA_EXCEEDED
+from app.utils.signed_links import DownloadLinks
+from app.utils.zip_stream import ZipStream, build_members
+from app.utils.listing import FILE_PROJECTION, PUBLIC_FILE_PROJECTION, json_list_response
+from app.utils.folders import FolderManager, subtree_of
+from app.utils.facets import FacetFilters, FacetEngine, SCOPE_ALL, SCOPE_PUBLIC, SCOPE_USER
+from app.utils.trending import Trending
+from app.utils.versioning import VersionStore, chunking_params, valid_hashes, CHUNK_MAX, HASH_PATTERN
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# 单次批量操作的最大文件数
+BULK_MAX_ITEMS = 1000
+
+def _file_detail(file):
+    """文件详情字段"""
+    return {
+        'id': file.id,
+        'filename': file.original_filename,
+        'size': file.file_size,
+        'type': file.file_type,
+        'mime_type': file.mime_type,
+        'upload_date': file.upload_date.isoformat(),
+        'uploaded_by': file.uploader.username,
+        'download_count': file.download_count,
+        'description': file.description,
+        'is_public': file.is_public,
+        'version': file.current_version or 1,
+        'folder_id': file.folder_id
+    }
+
+def _parse_bulk_ids(data):
+    """解析批量请求中的文件ID列表，去重并保持顺序"""
+    if not data or not isinstance(data.get('ids'), list) or not data['ids']:
+        return None, '缺少文件ID列表'
+    
+    ids = []
+    seen = set()
+    for value in data['ids']:
+        if not isinstance(value, int) or isinstance(value, bool):
+            return None, '文件ID必须为整数'
+        if value not in seen:
+            seen.add(value)
+            ids.append(value)
+    
+    if len(ids) > BULK_MAX_ITEMS:
+        return None, f'单次最多操作{BULK_MAX_ITEMS}个文件'
+    return ids, None
+
+def _bulk_results(ids, allowed, denied, missing, failed=None):
+    """生成逐项结果"""
+    failed = failed or {}
+    results = []
+    for file_id in ids:
+        if file_id in missing:
+            results.append({'id': file_id, 'status': 'not_found', 'error': '文件不存在'})
+        elif file_id in denied:
+            results.append({'id': file_id, 'status': 'forbidden', 'error': '没有权限操作此文件'})
+        elif file_id in failed:
+            results.append({'id': file_id, 'status': 'error', 'error': failed[file_id]})
+        else:
+            results.append({'id': file_id, 'status': 'ok'})
+    
+    succeeded = sum(1 for r in results if r['status'] == 'ok')
+    return {
+        'results': results,
+        'summary': {'total': len(results), 'succeeded': succeeded, 'failed': len(results) - succeeded}
+    }
+
+def _faceted_listing(projection, filters, scope, page, per_page):
+    """按分面参数筛选并分页，facets 参数存在时附带各分面的计数
+
+    filters 为范围内的基础条件；scope 为可以使用分面计数表的统计范围，条件与该范围不一致时为None
+    """
+    fields = projection.parse()
+    facet_filters = FacetFilters.parse(request.args)
+    facets = FacetEngine.parse_facets(request.args.get('facets'))
+    
+    files, pagination = projection.page(
+        fields, filters + facet_filters.conditions(), [File.upload_date.desc()], page, per_page
+    )
+    
+    extra = {'pagination': pagination}
+    if facets:
+        extra['facets'] = FacetEngine.counts(facets, facet_filters, filters, scope)
+    return json_list_response('files', files, **extra)
+
 @api_bp.route('/files', methods=['GET'])
 @login_required
 def api_files():
-    """获取文件列表"""
+    """获取文件列表，支持按 file_type、mime_type、size、uploader、date_from/date_to 筛选"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
         search = request.args.get('search', '')
         
-        query = File.query
+        filters = [File.deleted_at.is_(None)]
+        scope = (SCOPE_ALL, 0) if current_user.is_admin else (SCOPE_USER, current_user.id)
         
-        # 普通用户只能看到自己上传的文件
-        if not current_user.is_admin:
-            query = query.filter_by(uploaded_by=current_user.id)
+        # folder_id=0 为根目录；有权访问的文件夹中列出所有人放入的文件，recursive=true 时包含子文件夹
+        folder_id = request.args.get('folder_id', type=int)
+        if folder_id is not None:
+            scope = None
+        if folder_id:
+            folder = db.session.get(Folder, folder_id)
+            if folder is None:
+                return jsonify({'error': '文件夹不存在'}), 404
+            if not can_access_folder(folder, 'read'):
+                return jsonify({'error': '没有权限访问此文件夹'}), 403
+            if request.args.get('recursive', 'false').lower() == 'true':
+                filters.append(subtree_of(File.folder_path, folder.path))
+            else:
+                filters.append(File.folder_id == folder.id)
+        else:
+            if folder_id == 0:
+                filters.append(File.folder_id.is_(None))
+            # 普通用户只能看到自己上传的文件
+            if not current_user.is_admin:
+                filters.append(File.uploaded_by == current_user.id)
         
         if search:
-            query = query.filter(
+            scope = None
+            filters.append(
                 File.original_filename.contains(search) |
                 File.description.contains(search)
             )
         
-        files = query.order_by(File.upload_date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
-        
-        result = {
-            'files': [{
-                'id': f.id,
-                'filename': f.original_filename,
-                'size': f.file_size,
-                'type': f.file_type,
-                'upload_date': f.upload_date.isoformat(),
-                'uploaded_by': f.uploader.username,
-                'is_public': f.is_public,
-                'download_url': '/api/files/' + str(f.id) + '/download',
-                'description': f.description
-            } for f in files.items],
-            'pagination': {
-                'page': files.page,
-                'per_page': files.per_page,
-                'total': files.total,
-                'pages': files.pages
-            }
-        }
-        
-        return jsonify(result)
+        return _faceted_listing(FILE_PROJECTION, filters, scope, page, per_page)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/files', methods=['POST'])
+@rate_limit('upload')
 @login_required
 @require_permission('files.upload')
+@require_storage_quota
 def api_upload():
     """上传文件"""
     try:
@@ -73,12 +159,21 @@ def api_upload():
         description = request.form.get('description', '')
         is_public = request.form.get('is_public', 'false').lower() == 'true'
         
+        folder = None
+        folder_id = request.form.get('folder_id', type=int)
+        if folder_id:
+            folder = db.session.get(Folder, folder_id)
+            if folder is None:
+                return jsonify({'error': '文件夹不存在'}), 404
+            if not can_access_folder(folder, 'write'):
+                return jsonify({'error': '没有权限上传到此文件夹'}), 403
+        
         saved_file, error = FileUtils.save_uploaded_file(
-            file, description, is_public, current_user
+            file, description, is_public, current_user, folder
         )
         
         if error:
-            return jsonify({'error': error}), 400
+            return jsonify({'error': error}), 413 if error == QUOTA_EXCEEDED else 400
         
         return jsonify({
             'message': '文件上传成功',
@@ -88,6 +183,7 @@ def api_upload():
                 'size': saved_file.file_size,
                 'type': saved_file.file_type,
                 'upload_date': saved_file.upload_date.isoformat(),
+                'folder_id': saved_file.folder_id,
                 'download_url': '/api/files/' + str(saved_file.id) + '/download'
             }
         })
@@ -96,30 +192,79 @@ def api_upload():
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/files/<int:file_id>/download', methods=['GET'])
+@rate_limit('download')
 @login_required
 def api_download(file_id):
     """下载文件"""
     if not can_access_file(file_id, 'read'):
         return jsonify({'error': '没有权限访问此文件'}), 403
     
-    file = File.query.get_or_404(file_id)
-    
-    if not os.path.exists(file.file_path):
-        return jsonify({'error': '文件不存在'}), 404
+    file = File.active().filter_by(id=file_id).first_or_404()
     
     try:
+        response = FileUtils.send_file_record(file, file.original_filename)
+        if response is None:
+            return jsonify({'error': '文件不存在'}), 404
+        
         file.download_count += 1
+        Trending.record([(file.id, None)])
         db.session.commit()
         
-        return send_file(
-            file.file_path,
-            as_attachment=True,
-            download_name=file.original_filename
-        )
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/files/<int:file_id>/links', methods=['POST'])
+@login_required
+def api_create_download_link(file_id):
+    """生成有时效的签名下载链接，下载时由Nginx直接校验并发送文件；对象存储中的文件返回预签名URL"""
+    if not can_access_file(file_id, 'read'):
+        return jsonify({'error': '没有权限访问此文件'}), 403
+    
+    file = File.active().filter_by(id=file_id).first_or_404()
+    data = request.get_json(silent=True) or {}
+    
+    max_ttl = current_app.config['DOWNLOAD_LINK_MAX_TTL']
+    try:
+        ttl = int(data.get('expires_in', 3600))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'expires_in 必须是整数（秒）'}), 400
+    if ttl <= 0 or ttl > max_ttl:
+        return jsonify({'error': f'expires_in 必须在 1 到 {max_ttl} 秒之间'}), 400
+    
+    if file.current_version:
+        return jsonify({'error': '多版本文件不支持签名下载链接，请使用下载接口'}), 400
+    
+    if file.storage_backend != 'local':
+        # 预签名URL由对象存储校验，无法绑定IP或用户
+        if data.get('bind_ip') or data.get('bind_user'):
+            return jsonify({'error': '该文件存放在对象存储中，不支持绑定IP或用户'}), 400
+        url = FileUtils.storage_for(file).presign(FileUtils.storage_key(file), ttl, file.original_filename)
+        return jsonify({
+            'url': url,
+            'expires_at': (datetime.utcnow() + timedelta(seconds=ttl)).isoformat(),
+            'bind_ip': False,
+            'bind_user': False
+        })
+    
+    if not DownloadLinks.secret():
+        return jsonify({'error': '未配置签名下载链接'}), 503
+    
+    url, expires = DownloadLinks.create(
+        file, ttl,
+        filename=file.original_filename,
+        bind_ip=SecurityManager.get_client_ip() if data.get('bind_ip') else None,
+        bind_user_id=current_user.id if data.get('bind_user') else None
+    )
+    
+    return jsonify({
+        'url': url,
+        'expires_at': datetime.utcfromtimestamp(expires).isoformat(),
+        'bind_ip': bool(data.get('bind_ip')),
+        'bind_user': bool(data.get('bind_user'))
+    })
+
 @api_bp.route('/files/<int:file_id>', methods=['DELETE'])
 @login_required
 def api_delete_file(file_id):
@@ -127,7 +272,7 @@ def api_delete_file(file_id):
     if not can_access_file(file_id, 'delete'):
         return jsonify({'error': '没有权限删除此文件'}), 403
     
-    file = File.query.get_or_404(file_id)
+    file = File.active().filter_by(id=file_id).first_or_404()
     
     try:
         success = FileUtils.cleanup_file(file)
@@ -139,6 +284,53 @@ def api_delete_file(file_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/files/trash', methods=['GET'])
+@login_required
+def api_trash():
+    """已删除且仍可恢复的文件"""
+    cutoff = FileUtils.restore_cutoff()
+    query = File.query.filter(File.deleted_at > cutoff)
+    
+    if not current_user.is_admin:
+        query = query.filter_by(uploaded_by=current_user.id)
+    
+    files = query.order_by(File.deleted_at.desc()).limit(500).all()
+    
+    return jsonify({'files': [{
+        'id': f.id,
+        'filename': f.original_filename,
+        'size': f.file_size,
+        'deleted_at': f.deleted_at.isoformat(),
+        'restore_url': '/api/files/' + str(f.id) + '/restore'
+    } for f in files]})
+
+@api_bp.route('/files/<int:file_id>/restore', methods=['POST'])
+@login_required
+def api_restore_file(file_id):
+    """撤销删除"""
+    file = File.query.filter(File.id == file_id, File.deleted_at.isnot(None)).first_or_404()
+    
+    if file.uploaded_by != current_user.id and not current_user.is_admin:
+        return jsonify({'error': '没有权限恢复此文件'}), 403
+    
+    owner = file.uploader
+    if not QuotaManager.has_room(owner, file.file_size):
+        return jsonify({'error': QUOTA_EXCEEDED, **QuotaManager.usage(owner)}), 413
+    
+    if not FileUtils.restore_files([file_id], FileUtils.restore_cutoff()):
+        return jsonify({'error': '文件已超过可恢复期限'}), 410
+    
+    SecurityManager.log_access(
+        endpoint='api.restore_file',
+        method='POST',
+        status_code=200,
+        user_id=current_user.id,
+        file_id=file_id,
+        action='restore'
+    )
+    
+    return jsonify({'message': '文件已恢复'})
+
 @api_bp.route('/files/<int:file_id>', methods=['GET'])
 @login_required
 def api_file_detail(file_id):
@@ -146,63 +338,484 @@ def api_file_detail(file_id):
     if not can_access_file(file_id, 'read'):
         return jsonify({'error': '没有权限访问此文件'}), 403
     
-    file = File.query.get_or_404(file_id)
+    file = File.active().filter_by(id=file_id).first_or_404()
+    
+    return jsonify(_file_detail(file))
+
+@api_bp.route('/files/bulk/metadata', methods=['POST'])
+@rate_limit('bulk')
+@login_required
+def api_bulk_metadata():
+    """批量获取文件详情"""
+    ids, error = _parse_bulk_ids(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    allowed, denied, missing = evaluate_file_access(ids, 'read')
+    
+    # 一次性加载上传者，避免逐条懒加载
+    files = {f.id: f for f in File.active().options(joinedload(File.uploader)).filter(File.id.in_(list(allowed)))}
+    
+    result = _bulk_results(ids, allowed, denied, missing)
+    for item in result['results']:
+        if item['status'] == 'ok':
+            item['file'] = _file_detail(files[item['id']])
+    
+    return jsonify(result)
+
+@api_bp.route('/files/bulk/delete', methods=['POST'])
+@rate_limit('bulk')
+@login_required
+def api_bulk_delete():
+    """批量删除文件：一次事务标记删除，磁盘清理由后台任务完成"""
+    ids, error = _parse_bulk_ids(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    allowed, denied, missing = evaluate_file_access(ids, 'delete')
+    
+    try:
+        FileUtils.mark_deleted(list(allowed))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    SecurityManager.log_access(
+        endpoint='api.bulk_delete',
+        method='POST',
+        status_code=200,
+        user_id=current_user.id,
+        action='bulk_delete',
+        details={'deleted': len(allowed), 'requested': len(ids)}
+    )
+    
+    return jsonify(_bulk_results(ids, allowed, denied, missing))
+
+@api_bp.route('/files/bulk/visibility', methods=['POST'])
+@rate_limit('bulk')
+@login_required
+def api_bulk_visibility():
+    """批量设置文件公开状态"""
+    data = request.get_json(silent=True)
+    ids, error = _parse_bulk_ids(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    if not isinstance(data.get('is_public'), bool):
+        return jsonify({'error': '缺少is_public参数'}), 400
+    
+    allowed, denied, missing = evaluate_file_access(ids, 'write')
+    
+    try:
+        FileUtils.bulk_set_public(list(allowed), data['is_public'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify(_bulk_results(ids, allowed, denied, missing))
+
+@api_bp.route('/files/bulk/permissions', methods=['POST'])
+@rate_limit('bulk')
+@login_required
+def api_bulk_permissions():
+    """批量授予或撤销文件权限，仅文件所有者和管理员可操作"""
+    data = request.get_json(silent=True)
+    ids, error = _parse_bulk_ids(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    action = data.get('action', 'grant')
+    permission_type = data.get('permission_type', 'read')
+    user_ids = data.get('user_ids')
+    
+    if action not in ('grant', 'revoke'):
+        return jsonify({'error': 'action必须为grant或revoke'}), 400
+    if permission_type not in ('read', 'write', 'delete'):
+        return jsonify({'error': '无效的权限类型'}), 400
+    if not isinstance(user_ids, list) or not user_ids or not all(isinstance(u, int) for u in user_ids):
+        return jsonify({'error': '缺少用户ID列表'}), 400
+    
+    expires_at = None
+    if data.get('expires_at'):
+        try:
+            expires_at = datetime.fromisoformat(data['expires_at'])
+        except (TypeError, ValueError):
+            return jsonify({'error': '过期时间格式错误'}), 400
+    
+    existing_users = {row.id for row in User.query.with_entities(User.id).filter(User.id.in_(user_ids))}
+    unknown_users = sorted(set(user_ids) - existing_users)
+    if unknown_users:
+        return jsonify({'error': '用户不存在', 'user_ids': unknown_users}), 400
+    
+    allowed, denied, missing = evaluate_file_access(ids, owner_only=True)
+    
+    try:
+        if action == 'grant':
+            changed = FileUtils.bulk_grant_permissions(
+                list(allowed), list(existing_users), permission_type, current_user.id, expires_at
+            )
+        else:
+            changed = FileUtils.bulk_revoke_permissions(list(allowed), list(existing_users), permission_type)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    result = _bulk_results(ids, allowed, denied, missing)
+    result['summary']['permissions_changed'] = changed
+    return jsonify(result)
+
+@api_bp.route('/files/bulk/move', methods=['POST'])
+@rate_limit('bulk')
+@login_required
+def api_bulk_move():
+    """批量移动文件到文件夹（folder_id 为空时移到根目录），只有上传者和管理员可以移动"""
+    data = request.get_json(silent=True)
+    ids, error = _parse_bulk_ids(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    folder = None
+    if data.get('folder_id') is not None:
+        folder = db.session.get(Folder, data['folder_id']) if isinstance(data['folder_id'], int) else None
+        if folder is None:
+            return jsonify({'error': '文件夹不存在'}), 404
+        if not can_access_folder(folder, 'write'):
+            return jsonify({'error': '没有权限移动到此文件夹'}), 403
+    
+    allowed, denied, missing = evaluate_file_access(ids, owner_only=True)
+    
+    try:
+        FolderManager.move_files(list(allowed), folder)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify(_bulk_results(ids, allowed, denied, missing))
+
+def _archive_request_ids():
+    """从请求体或查询参数中取出要打包的文件ID，支持已保存的选择集"""
+    data = request.get_json(silent=True) or {}
+    selection_id = data.get('selection_id') or request.args.get('selection', type=int)
+    
+    if selection_id:
+        selection = FileSelection.query.filter_by(id=selection_id, user_id=current_user.id).first()
+        if not selection:
+            return None, '选择集不存在'
+        return _parse_bulk_ids({'ids': selection.get_file_ids()})
+    
+    if 'ids' not in data and request.args.get('ids'):
+        try:
+            data = {'ids': [int(v) for v in request.args['ids'].split(',') if v.strip()]}
+        except ValueError:
+            return None, '文件ID必须为整数'
+    return _parse_bulk_ids(data)
+
+@api_bp.route('/files/archive', methods=['GET', 'POST'])
+@rate_limit('archive')
+@login_required
+def api_download_archive():
+    """将多个文件流式打包为ZIP下载"""
+    ids, error = _archive_request_ids()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    allowed, denied, missing = evaluate_file_access(ids, 'read')
+    if missing:
+        return jsonify({'error': '文件不存在', 'ids': sorted(missing)}), 404
+    if denied:
+        return jsonify({'error': '没有权限访问此文件', 'ids': sorted(denied)}), 403
+    
+    files = [allowed[file_id] for file_id in ids]
+    try:
+        members = build_members(files)
+    except FileNotFoundError:
+        return jsonify({'error': '文件不存在'}), 404
+    
+    File.query.filter(File.id.in_(ids)).update(
+        {File.download_count: File.download_count + 1}, synchronize_session=False
+    )
+    Trending.record([(file_id, None) for file_id in set(ids)])
+    db.session.commit()
+    
+    SecurityManager.log_access(
+        endpoint='api.download_archive',
+        method=request.method,
+        status_code=200,
+        user_id=current_user.id,
+        action='download_archive',
+        details={'file_count': len(ids)}
+    )
+    
+    stream = ZipStream(members)
+    response = Response(stream, mimetype='application/zip', direct_passthrough=True)
+    length = stream.content_length()
+    if length is not None:
+        response.content_length = length
+    archive_name = f"files_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
+    response.headers['Content-Disposition'] = f'attachment; filename="{archive_name}"'
+    return response
+
+def _version_detail(version, current):
+    return {
+        'version': version.version,
+        'size': version.size,
+        'chunk_count': version.chunk_count,
+        'created_by': version.created_by,
+        'created_at': version.created_at.isoformat(),
+        'comment': version.comment,
+        'is_current': version.version == current
+    }
+
+def _commit_response(file, version, error, missing):
+    if error == QUOTA_EXCEEDED:
+        owner = file.uploader
+        return jsonify({'error': error, **QuotaManager.usage(owner)}), 413
+    if error:
+        return jsonify({'error': error, 'missing': missing}), 409 if missing else 400
+    
+    SecurityManager.log_access(
+        endpoint='api.commit_version',
+        method='POST',
+        status_code=201,
+        user_id=current_user.id,
+        file_id=file.id,
+        action='new_version',
+        details={'version': version.version, 'size': version.size, 'chunks': version.chunk_count}
+    )
+    return jsonify(_version_detail(version, version.version)), 201
+
+@api_bp.route('/files/versions/chunking', methods=['GET'])
+def api_chunking_params():
+    """客户端分块算法与参数"""
+    return jsonify(chunking_params())
+
+@api_bp.route('/files/<int:file_id>/versions', methods=['GET'])
+@login_required
+def api_file_versions(file_id):
+    """文件的版本列表"""
+    if not can_access_file(file_id, 'read'):
+        return jsonify({'error': '没有权限访问此文件'}), 403
+    
+    file = File.active().filter_by(id=file_id).first_or_404()
+    if not file.current_version:
+        # 未上传过新版本的文件只有上传时的内容
+        return jsonify({'versions': [{
+            'version': 1,
+            'size': file.file_size,
+            'chunk_count': None,
+            'created_by': file.uploaded_by,
+            'created_at': file.upload_date.isoformat(),
+            'comment': None,
+            'is_current': True
+        }]})
+    
+    versions = FileVersion.query.filter_by(file_id=file_id).order_by(FileVersion.version.desc()).all()
+    return jsonify({'versions': [_version_detail(v, file.current_version) for v in versions]})
+
+@api_bp.route('/files/<int:file_id>/versions/<int:version>/download', methods=['GET'])
+@rate_limit('download')
+@login_required
+def api_download_version(file_id, version):
+    """下载指定版本"""
+    if not can_access_file(file_id, 'read'):
+        return jsonify({'error': '没有权限访问此文件'}), 403
+    
+    file = File.active().filter_by(id=file_id).first_or_404()
+    if not file.current_version and version == 1:
+        response = FileUtils.send_file_record(file, file.original_filename)
+        if response is None:
+            return jsonify({'error': '文件不存在'}), 404
+    else:
+        record = VersionStore.get(file_id, version)
+        if record is None:
+            return jsonify({'error': '版本不存在'}), 404
+        response = FileUtils.send_stream(VersionStore.reader(record), record.size, file.original_filename,
+                                         file.mime_type, etag=f'v{record.id}', modified=record.created_at)
+    
+    # 与普通下载相同，计入文件的下载次数和热度
+    file.download_count += 1
+    Trending.record([(file.id, None)])
+    db.session.commit()
+    return response
+
+@api_bp.route('/files/<int:file_id>/versions/check', methods=['POST'])
+@rate_limit('bulk')
+@login_required
+def api_check_chunks(file_id):
+    """上传新版本前查询服务端缺少哪些分块（{"chunks": [sha256, ...]}）"""
+    if not can_access_file(file_id, 'write'):
+        return jsonify({'error': '没有权限修改此文件'}), 403
+    
+    file = File.active().filter_by(id=file_id).first_or_404()
+    hashes = valid_hashes((request.get_json(silent=True) or {}).get('chunks'))
+    if hashes is None:
+        return jsonify({'error': 'chunks 必须是 SHA-256 十六进制字符串列表'}), 400
+    
+    try:
+        # 首次上传新版本时把原文件切分为第1版，之后可复用其中未修改的分块
+        VersionStore.ensure_base_version(file)
+    except FileNotFoundError:
+        return jsonify({'error': '文件不存在'}), 404
+    
+    known = VersionStore.known_chunks(file_id, current_user.id, hashes)
+    missing = list(dict.fromkeys(h for h in hashes if h not in known))
+    return jsonify({'missing': missing, 'known': len(set(hashes)) - len(missing)})
+
+@api_bp.route('/files/<int:file_id>/versions/chunks/<digest>', methods=['PUT'])
+@rate_limit('chunk')
+@login_required
+def api_upload_chunk(file_id, digest):
+    """上传一个分块，请求体为分块原始内容"""
+    if not can_access_file(file_id, 'write'):
+        return jsonify({'error': '没有权限修改此文件'}), 403
+    if not HASH_PATTERN.match(digest):
+        return jsonify({'error': '分块哈希格式错误'}), 400
+    if request.content_length is None or request.content_length > CHUNK_MAX:
+        return jsonify({'error': f'分块大小必须在 {CHUNK_MAX} 字节以内'}), 413
+    
+    try:
+        created = VersionStore.store_chunk(digest, request.get_data(cache=False), current_user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'hash': digest, 'created': created}), 201 if created else 200
+
+@api_bp.route('/files/<int:file_id>/versions', methods=['POST'])
+@login_required
+def api_commit_version(file_id):
+    """提交新版本（{"chunks": [sha256, ...], "comment": "..."}，分块按文件内容顺序排列）"""
+    if not can_access_file(file_id, 'write'):
+        return jsonify({'error': '没有权限修改此文件'}), 403
+    
+    file = File.active().filter_by(id=file_id).first_or_404()
+    data = request.get_json(silent=True) or {}
+    hashes = valid_hashes(data.get('chunks'))
+    if hashes is None:
+        return jsonify({'error': 'chunks 必须是 SHA-256 十六进制字符串列表'}), 400
+    
+    try:
+        version, error, missing = VersionStore.commit_version(
+            file, current_user, hashes, comment=data.get('comment'),
+            max_size=current_app.config['MAX_CONTENT_LENGTH']
+        )
+    except FileNotFoundError:
+        return jsonify({'error': '文件不存在'}), 404
+    return _commit_response(file, version, error, missing)
+
+@api_bp.route('/files/<int:file_id>/versions/<int:version>/restore', methods=['POST'])
+@login_required
+def api_restore_version(file_id, version):
+    """以指定版本的内容创建新版本，不复制数据"""
+    if not can_access_file(file_id, 'write'):
+        return jsonify({'error': '没有权限修改此文件'}), 403
+    
+    file = File.active().filter_by(id=file_id).first_or_404()
+    record = VersionStore.get(file_id, version)
+    if record is None:
+        return jsonify({'error': '版本不存在'}), 404
+    
+    version, error, missing = VersionStore.commit_version(
+        file, current_user, VersionStore.version_hashes(record.id),
+        comment=f'恢复自第{record.version}版'
+    )
+    return _commit_response(file, version, error, missing)
+
+@api_bp.route('/selections', methods=['GET'])
+@login_required
+def api_selections():
+    """获取已保存的选择集"""
+    selections = FileSelection.query.filter_by(user_id=current_user.id).order_by(
+        FileSelection.created_at.desc()
+    ).all()
+    
+    return jsonify({'selections': [{
+        'id': s.id,
+        'name': s.name,
+        'file_ids': s.get_file_ids(),
+        'created_at': s.created_at.isoformat(),
+        'download_url': '/api/files/archive?selection=' + str(s.id)
+    } for s in selections]})
+
+@api_bp.route('/selections', methods=['POST'])
+@login_required
+def api_create_selection():
+    """保存文件选择集"""
+    data = request.get_json(silent=True)
+    ids, error = _parse_bulk_ids(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    name = (data.get('name') or '').strip()
+    if not name:
+        return jsonify({'error': '缺少选择集名称'}), 400
+    
+    selection = FileSelection(user_id=current_user.id, name=name[:255])
+    selection.set_file_ids(ids)
+    db.session.add(selection)
+    db.session.commit()
     
     return jsonify({
-        'id': file.id,
-        'filename': file.original_filename,
-        'size': file.file_size,
-        'type': file.file_type,
-        'mime_type': file.mime_type,
-        'upload_date': file.upload_date.isoformat(),
-        'uploaded_by': file.uploader.username,
-        'download_count': file.download_count,
-        'description': file.description,
-        'is_public': file.is_public
+        'message': '选择集保存成功',
+        'selection': {
+            'id': selection.id,
+            'name': selection.name,
+            'file_ids': ids,
+            'download_url': '/api/files/archive?selection=' + str(selection.id)
+        }
     })
 
+@api_bp.route('/selections/<int:selection_id>', methods=['DELETE'])
+@login_required
+def api_delete_selection(selection_id):
+    """删除选择集"""
+    selection = FileSelection.query.filter_by(id=selection_id, user_id=current_user.id).first_or_404()
+    db.session.delete(selection)
+    db.session.commit()
+    
+    return jsonify({'message': '选择集删除成功'})
+
+@api_bp.route('/quota', methods=['GET'])
+@login_required
+def api_quota():
+    """当前用户的存储配额"""
+    return jsonify(QuotaManager.usage(current_user))
+
 @api_bp.route('/public/files', methods=['GET'])
 def api_public_files():
-    """获取公共文件列表"""
+    """获取公共文件列表，筛选参数同 /api/files"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
         search = request.args.get('search', '')
         
-        query = File.query.filter_by(is_public=True)
+        filters = [File.deleted_at.is_(None), File.is_public.is_(True)]
+        scope = (SCOPE_PUBLIC, 0)
         
         if search:
-            query = query.filter(
+            scope = None
+            filters.append(
                 File.original_filename.contains(search) |
                 File.description.contains(search)
             )
         
-        files = query.order_by(File.upload_date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        return _faceted_listing(PUBLIC_FILE_PROJECTION, filters, scope, page, per_page)
         
-        result = {
-            'files': [{
-                'id': f.id,
-                'filename': f.original_filename,
-                'size': f.file_size,
-                'type': f.file_type,
-                'upload_date': f.upload_date.isoformat(),
-                'uploaded_by': f.uploader.username,
-                'download_count': f.download_count,
-                'description': f.description,
-                'download_url': '/api/files/' + str(f.id) + '/download'
-            } for f in files.items],
-            'pagination': {
-                'page': files.page,
-                'per_page': files.per_page,
-                'total': files.total,
-                'pages': files.pages
-            }
-        }
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api_bp.route('/public/files/trending', methods=['GET'])
+def api_trending_files():
+    """按时间衰减的下载热度排行的公共文件，可按 file_type 筛选"""
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        file_type = request.args.get('file_type') or None
         
-        return jsonify(result)
+        fields = PUBLIC_FILE_PROJECTION.parse()
+        files, scores = Trending.top(PUBLIC_FILE_PROJECTION, fields, limit, file_type)
+        for item, score in zip(files, scores):
+            item['trend_score'] = round(score, 3)
         
+        return json_list_response('files', files, half_life_hours=current_app.config['TRENDING_HALF_LIFE_HOURS'])
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -217,13 +830,15 @@ def api_docs():
             {
                 'path': '/api/files',
                 'method': 'GET',
-                'description': '获取文件列表',
+                'description': '获取文件列表（fields 参数指定返回字段，如 fields=id,filename,size；'
+                               'folder_id 和 recursive 按文件夹筛选；file_type、mime_type、size、uploader、'
+                               'date_from、date_to 筛选，facets=true 返回各分面计数）',
                 'authentication': '需要'
             },
             {
                 'path': '/api/files',
                 'method': 'POST',
-                'description': '上传文件',
+                'description': '上传文件（可选 folder_id）',
                 'authentication': '需要'
             },
             {
@@ -238,16 +853,154 @@ def api_docs():
                 'description': '下载文件',
                 'authentication': '需要'
             },
+            {
+                'path': '/api/files/{file_id}/links',
+                'method': 'POST',
+                'description': '生成签名下载链接（expires_in、bind_ip、bind_user）',
+                'authentication': '需要'
+            },
             {
                 'path': '/api/files/{file_id}',
                 'method': 'DELETE',
                 'description': '删除文件',
                 'authentication': '需要'
             },
+            {
+                'path': '/api/files/trash',
+                'method': 'GET',
+                'description': '获取可恢复的已删除文件',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/{file_id}/restore',
+                'method': 'POST',
+                'description': '撤销删除',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/bulk/metadata',
+                'method': 'POST',
+                'description': '批量获取文件详情',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/bulk/delete',
+                'method': 'POST',
+                'description': '批量删除文件',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/bulk/visibility',
+                'method': 'POST',
+                'description': '批量设置公开状态',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/bulk/permissions',
+                'method': 'POST',
+                'description': '批量授予或撤销文件权限',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/bulk/move',
+                'method': 'POST',
+                'description': '批量移动文件到文件夹',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/folders',
+                'method': 'GET/POST',
+                'description': '获取根目录和共享给我的文件夹，或创建文件夹（name、parent_id）',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/folders/{folder_id}',
+                'method': 'GET/PATCH/DELETE',
+                'description': '文件夹详情和子文件夹、改名或移动（name、parent_id）、删除整个子树',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/folders/{folder_id}/tree',
+                'method': 'GET',
+                'description': '列出子树中的全部文件夹和文件',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/folders/{folder_id}/size',
+                'method': 'GET',
+                'description': '子树的文件数和总大小',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/folders/{folder_id}/permissions',
+                'method': 'GET/POST',
+                'description': '获取、授予或撤销文件夹权限（作用于整个子树）',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/archive',
+                'method': 'GET/POST',
+                'description': '多文件打包下载（ids或selection_id）',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/{file_id}/versions',
+                'method': 'GET/POST',
+                'description': '获取版本列表或提交新版本（分块哈希列表）',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/{file_id}/versions/check',
+                'method': 'POST',
+                'description': '查询服务端缺少的分块',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/{file_id}/versions/chunks/{sha256}',
+                'method': 'PUT',
+                'description': '上传一个分块',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/{file_id}/versions/{version}/download',
+                'method': 'GET',
+                'description': '下载指定版本',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/files/{file_id}/versions/{version}/restore',
+                'method': 'POST',
+                'description': '恢复到指定版本（创建新版本）',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/selections',
+                'method': 'GET/POST',
+                'description': '获取或保存文件选择集',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/selections/{selection_id}',
+                'method': 'DELETE',
+                'description': '删除文件选择集',
+                'authentication': '需要'
+            },
+            {
+                'path': '/api/quota',
+                'method': 'GET',
+                'description': '获取存储配额使用情况',
+                'authentication': '需要'
+            },
             {
                 'path': '/api/public/files',
                 'method': 'GET',
-                'description': '获取公共文件列表',
+                'description': '获取公共文件列表（支持 fields、分面筛选和 facets 参数）',
+                'authentication': '不需要'
+            },
+            {
+                'path': '/api/public/files/trending',
+                'method': 'GET',
+                'description': '按时间衰减的下载热度排行的公共文件（limit、file_type、fields 参数）',
                 'authentication': '不需要'
             }
         ]
@@ -3,10 +3,20 @@ from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime
 from app.models import User, Role, db
 from app.utils.security import SecurityManager
+from app.utils.rate_limit import rate_limit
+from app.utils.passwords import PasswordHashingBusy
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+def _hashing_busy():
+    """密码哈希排队超时"""
+    response = jsonify({'error': '服务繁忙，请稍后再试'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@rate_limit('login', methods=('POST',))
 def login():
     if request.method == 'GET':
         return render_template('auth/login.html')
@@ -22,7 +32,12 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password) and user.is_active:
+        try:
+            authenticated = user is not None and user.check_password(password)
+        except PasswordHashingBusy:
+            return _hashing_busy()
+        
+        if authenticated and user.is_active:
             user.last_login = datetime.utcnow()
             db.session.commit()
             login_user(user, remember=remember)
@@ -49,6 +64,7 @@ def login():
         return jsonify({'error': '用户名或密码错误'}), 401
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
+@rate_limit('register', methods=('POST',))
 def register():
     if request.method == 'GET':
         return render_template('auth/register.html')
@@ -72,7 +88,10 @@ def register():
             return jsonify({'error': '密码长度至少为6位'}), 400
         
         user = User(username=username, email=email)
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except PasswordHashingBusy:
+            return _hashing_busy()
         
         # Assign default user role
         user_role = Role.query.filter_by(name='user').first()
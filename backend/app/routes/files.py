@@ -1,12 +1,14 @@
-import os
 import mimetypes
 from datetime import datetime
-from flask import Blueprint, render_template, request, jsonify, send_file, url_for, current_app
+from flask import Blueprint, render_template, request, jsonify, url_for, current_app
 from flask_login import login_required, current_user
 from app.models import File, db
 from app.utils.file_utils import FileUtils
 from app.utils.permissions import require_permission, require_file_access, can_access_file
 from app.utils.security import SecurityManager
+from app.utils.rate_limit import rate_limit
+from app.utils.quota import require_storage_quota, QUOTA_EXCEEDED
+from app.utils.trending import Trending
 
 files_bp = Blueprint('files', __name__, url_prefix='/files')
 
@@ -17,7 +19,7 @@ def index():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
-    query = File.query
+    query = File.active()
     
     # 普通用户只能看到自己上传的文件
     if not current_user.is_admin:
@@ -36,8 +38,10 @@ def index():
     return render_template('files/index.html', files=files, search=search)
 
 @files_bp.route('/upload', methods=['GET', 'POST'])
+@rate_limit('upload', methods=('POST',))
 @login_required
 @require_permission('files.upload')
+@require_storage_quota
 def upload():
     """文件上传"""
     if request.method == 'GET':
@@ -60,7 +64,7 @@ def upload():
             )
             
             if error:
-                return jsonify({'error': error}), 400
+                return jsonify({'error': error}), 413 if error == QUOTA_EXCEEDED else 400
             
             SecurityManager.log_access(
                 endpoint='files.upload',
@@ -93,17 +97,20 @@ def upload():
             return jsonify({'error': '上传失败，请重试'}), 500
 
 @files_bp.route('/download/<int:file_id>')
+@rate_limit('download')
 @login_required
 @require_file_access('read')
 def download(file_id):
     """文件下载"""
-    file = File.query.get_or_404(file_id)
-    
-    if not os.path.exists(file.file_path):
-        return jsonify({'error': '文件不存在'}), 404
+    file = File.active().filter_by(id=file_id).first_or_404()
     
     try:
+        response = FileUtils.send_file_record(file, file.original_filename)
+        if response is None:
+            return jsonify({'error': '文件不存在'}), 404
+        
         file.download_count += 1
+        Trending.record([(file.id, None)])
         db.session.commit()
         
         SecurityManager.log_access(
@@ -116,14 +123,7 @@ def download(file_id):
             details={'filename': file.original_filename, 'size': file.file_size}
         )
         
-        # 设置正确的文件名
-        filename = file.original_filename.encode('utf-8').decode('latin-1')
-        
-        return send_file(
-            file.file_path,
-            as_attachment=True,
-            download_name=filename
-        )
+        return response
         
     except Exception as e:
         return jsonify({'error': '下载失败'}), 500
@@ -133,7 +133,7 @@ def download(file_id):
 @require_file_access('delete')
 def delete(file_id):
     """删除文件"""
-    file = File.query.get_or_404(file_id)
+    file = File.active().filter_by(id=file_id).first_or_404()
     
     if file.uploaded_by != current_user.id and not current_user.is_admin:
         return jsonify({'error': '没有权限删除此文件'}), 403
@@ -164,7 +164,7 @@ def public_files():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
-    query = File.query.filter_by(is_public=True)
+    query = File.active().filter_by(is_public=True)
     
     if search:
         query = query.filter(
@@ -182,7 +182,7 @@ def public_files():
 @login_required
 def detail(file_id):
     """文件详情"""
-    file = File.query.get_or_404(file_id)
+    file = File.active().filter_by(id=file_id).first_or_404()
     
     if file.uploaded_by != current_user.id and not file.is_public and not current_user.is_admin:
         if not any(p.user_id == current_user.id for p in file.permissions):
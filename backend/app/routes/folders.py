@@ -0,0 +1,248 @@
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from app.models import Folder, User, FilePermission, db
+from app.utils.folders import FolderManager
+from app.utils.permissions import can_access_folder
+from app.utils.rate_limit import rate_limit
+
+folders_bp = Blueprint('folders', __name__, url_prefix='/api/folders')
+
+# 子树列表单次返回的最大条数
+TREE_MAX_ITEMS = 5000
+
+def _folder_detail(folder):
+    """文件夹详情字段"""
+    return {
+        'id': folder.id,
+        'name': folder.name,
+        'parent_id': folder.parent_id,
+        'owner_id': folder.owner_id,
+        'path': folder.path,
+        'depth': folder.depth,
+        'created_at': folder.created_at.isoformat()
+    }
+
+def _get_folder(folder_id, permission_type='read'):
+    """返回 (文件夹, 错误响应)"""
+    folder = db.session.get(Folder, folder_id)
+    if folder is None:
+        return None, (jsonify({'error': '文件夹不存在'}), 404)
+    if not can_access_folder(folder, permission_type):
+        return None, (jsonify({'error': '没有权限访问此文件夹'}), 403)
+    return folder, None
+
+def _is_owner(folder):
+    return folder.owner_id == current_user.id or current_user.is_admin
+
+@folders_bp.route('', methods=['GET'])
+@login_required
+def list_folders():
+    """根目录下的文件夹和共享给当前用户的文件夹"""
+    folders = Folder.query.filter(
+        Folder.owner_id == current_user.id,
+        Folder.parent_id.is_(None)
+    ).order_by(Folder.name).all()
+
+    return jsonify({
+        'folders': [_folder_detail(f) for f in folders],
+        'shared': [{**_folder_detail(f), 'permissions': sorted(types)}
+                   for f, types in FolderManager.shared_with(current_user.id)]
+    })
+
+@folders_bp.route('', methods=['POST'])
+@login_required
+def create_folder():
+    """创建文件夹；在他人的文件夹中创建需要写权限，新文件夹归该文件夹的拥有者所有"""
+    data = request.get_json(silent=True) or {}
+
+    parent = None
+    if data.get('parent_id') is not None:
+        if not isinstance(data['parent_id'], int):
+            return jsonify({'error': 'parent_id必须为整数'}), 400
+        parent, error = _get_folder(data['parent_id'], 'write')
+        if error:
+            return error
+
+    try:
+        folder, error = FolderManager.create(parent.owner_id if parent else current_user.id,
+                                             data.get('name'), parent)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if error:
+        return jsonify({'error': error}), 400
+
+    return jsonify(_folder_detail(folder)), 201
+
+@folders_bp.route('/<int:folder_id>', methods=['GET'])
+@login_required
+def folder_detail(folder_id):
+    """文件夹详情和直接子文件夹，文件使用 /api/files?folder_id= 分页获取"""
+    folder, error = _get_folder(folder_id)
+    if error:
+        return error
+
+    children = Folder.query.filter(Folder.parent_id == folder.id).order_by(Folder.name).all()
+
+    return jsonify({
+        **_folder_detail(folder),
+        'folders': [_folder_detail(f) for f in children],
+        'files_url': '/api/files?folder_id=' + str(folder.id)
+    })
+
+@folders_bp.route('/<int:folder_id>', methods=['PATCH'])
+@login_required
+def update_folder(folder_id):
+    """改名或移动（parent_id 为 null 时移到根目录），只有拥有者和管理员可以操作"""
+    folder, error = _get_folder(folder_id)
+    if error:
+        return error
+    if not _is_owner(folder):
+        return jsonify({'error': '没有权限修改此文件夹'}), 403
+
+    data = request.get_json(silent=True) or {}
+    if 'name' not in data and 'parent_id' not in data:
+        return jsonify({'error': '缺少name或parent_id'}), 400
+
+    try:
+        if 'parent_id' in data:
+            parent = None
+            if data['parent_id'] is not None:
+                if not isinstance(data['parent_id'], int):
+                    return jsonify({'error': 'parent_id必须为整数'}), 400
+                parent = db.session.get(Folder, data['parent_id'])
+                if parent is None:
+                    return jsonify({'error': '目标文件夹不存在'}), 404
+            error = FolderManager.move(folder, parent)
+            if error:
+                return jsonify({'error': error}), 400
+            folder = db.session.get(Folder, folder_id)
+
+        if 'name' in data:
+            error = FolderManager.rename(folder, data['name'])
+            if error:
+                return jsonify({'error': error}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify(_folder_detail(folder))
+
+@folders_bp.route('/<int:folder_id>', methods=['DELETE'])
+@login_required
+def delete_folder(folder_id):
+    """删除文件夹及其子树，其中的文件进入回收站"""
+    folder, error = _get_folder(folder_id)
+    if error:
+        return error
+    if not _is_owner(folder):
+        return jsonify({'error': '没有权限删除此文件夹'}), 403
+
+    try:
+        deleted = FolderManager.delete(folder)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'message': '文件夹已删除', 'files_deleted': deleted})
+
+@folders_bp.route('/<int:folder_id>/tree', methods=['GET'])
+@rate_limit('bulk')
+@login_required
+def folder_tree(folder_id):
+    """子树中的全部文件夹和文件（各一次范围查询），客户端按 parent_id / folder_id 组装"""
+    folder, error = _get_folder(folder_id)
+    if error:
+        return error
+
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), TREE_MAX_ITEMS)
+    folders, files, truncated = FolderManager.subtree(folder, limit)
+
+    return jsonify({
+        'folder': _folder_detail(folder),
+        'folders': [_folder_detail(f) for f in folders],
+        'files': [{
+            'id': f.id,
+            'filename': f.original_filename,
+            'size': f.file_size,
+            'type': f.file_type,
+            'upload_date': f.upload_date.isoformat(),
+            'folder_id': f.folder_id,
+            'uploader_id': f.uploaded_by
+        } for f in files],
+        'truncated': truncated
+    })
+
+@folders_bp.route('/<int:folder_id>/size', methods=['GET'])
+@login_required
+def folder_size(folder_id):
+    """子树的文件夹数、文件数和总大小"""
+    folder, error = _get_folder(folder_id)
+    if error:
+        return error
+
+    return jsonify({'id': folder.id, **FolderManager.totals(folder)})
+
+@folders_bp.route('/<int:folder_id>/permissions', methods=['GET'])
+@login_required
+def folder_permissions(folder_id):
+    """文件夹上的授权（不含祖先文件夹上的授权）"""
+    folder, error = _get_folder(folder_id)
+    if error:
+        return error
+    if not _is_owner(folder):
+        return jsonify({'error': '没有权限查看此文件夹的授权'}), 403
+
+    rows = db.session.query(FilePermission, User.username).join(
+        User, User.id == FilePermission.user_id
+    ).filter(FilePermission.folder_id == folder.id).order_by(FilePermission.granted_at).all()
+
+    return jsonify({'permissions': [{
+        'user_id': p.user_id,
+        'username': username,
+        'permission_type': p.permission_type,
+        'granted_at': p.granted_at.isoformat() if p.granted_at else None,
+        'expires_at': p.expires_at.isoformat() if p.expires_at else None
+    } for p, username in rows]})
+
+@folders_bp.route('/<int:folder_id>/permissions', methods=['POST'])
+@login_required
+def update_folder_permissions(folder_id):
+    """授予或撤销文件夹权限，作用于整个子树，只有拥有者和管理员可以操作"""
+    folder, error = _get_folder(folder_id)
+    if error:
+        return error
+    if not _is_owner(folder):
+        return jsonify({'error': '没有权限共享此文件夹'}), 403
+
+    data = request.get_json(silent=True) or {}
+    action = data.get('action', 'grant')
+    permission_type = data.get('permission_type', 'read')
+    user_ids = data.get('user_ids')
+
+    if action not in ('grant', 'revoke'):
+        return jsonify({'error': 'action必须为grant或revoke'}), 400
+    if permission_type not in ('read', 'write', 'delete'):
+        return jsonify({'error': '无效的权限类型'}), 400
+    if not isinstance(user_ids, list) or not user_ids or not all(isinstance(u, int) for u in user_ids):
+        return jsonify({'error': '缺少用户ID列表'}), 400
+
+    expires_at = None
+    if data.get('expires_at'):
+        try:
+            expires_at = datetime.fromisoformat(data['expires_at'])
+        except (TypeError, ValueError):
+            return jsonify({'error': '过期时间格式错误'}), 400
+
+    existing_users = {row.id for row in User.query.with_entities(User.id).filter(User.id.in_(user_ids))}
+    unknown_users = sorted(set(user_ids) - existing_users)
+    if unknown_users:
+        return jsonify({'error': '用户不存在', 'user_ids': unknown_users}), 400
+
+    try:
+        if action == 'grant':
+            changed = FolderManager.grant(folder, list(existing_users), permission_type, current_user.id, expires_at)
+        else:
+            changed = FolderManager.revoke(folder, list(existing_users), permission_type)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'message': '权限已更新', 'permissions_changed': changed})
@@ -0,0 +1,57 @@
+import os
+from flask import Blueprint, request, jsonify, session
+from app.utils.file_utils import FileUtils
+from app.utils.security import SecurityManager
+from app.utils.signed_links import DownloadLinks
+from app.utils.rate_limit import rate_limit
+from app.utils.compression import send_negotiated
+
+# 签名链接通常由 Nginx 直接处理，这里是未部署 Nginx 时的回退实现，全程不查询数据库
+links_bp = Blueprint('links', __name__)
+
+def _session_matches(user_id):
+    return str(session.get('_user_id')) == str(user_id)
+
+def _serve(file_id, rel_path, user_id=None):
+    client_ip = SecurityManager.get_client_ip()
+    bound_ip = client_ip if request.args.get('ip') == '1' else None
+    status = DownloadLinks.verify(request.path, request.args.get('e'), request.args.get('s'), bound_ip,
+                                  request.args.get('n'))
+    if status == 'expired':
+        return jsonify({'error': '下载链接已过期'}), 410
+    if status != 'ok':
+        return jsonify({'error': '下载链接无效'}), 403
+
+    root = os.path.realpath(FileUtils.storage_root())
+    file_path = os.path.realpath(os.path.join(root, rel_path))
+    if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+        return jsonify({'error': '文件不存在'}), 404
+
+    response = send_negotiated(file_path, request.args.get('n') or os.path.basename(file_path))
+    DownloadLinks.record_download(response.status_code, file_id, user_id, client_ip,
+                                  request.headers.get('Range'), response.content_length)
+    return response
+
+@links_bp.route('/dl/<int:file_id>/<path:rel_path>')
+@rate_limit('download')
+def download(file_id, rel_path):
+    """签名链接下载"""
+    return _serve(file_id, rel_path)
+
+@links_bp.route('/dl/u/<int:user_id>/<int:file_id>/<path:rel_path>')
+@rate_limit('download')
+def user_download(user_id, file_id, rel_path):
+    """绑定用户的签名链接下载，需要该用户的登录会话"""
+    if not _session_matches(user_id):
+        return jsonify({'error': '请使用获取链接的账号登录后下载'}), 403
+    return _serve(file_id, rel_path, user_id)
+
+@links_bp.route('/links/session')
+def session_check():
+    """供 Nginx auth_request 校验绑定用户的链接，只读取会话Cookie"""
+    parsed = DownloadLinks.parse(request.headers.get('X-Original-URI', '').split('?', 1)[0])
+    if parsed is None or parsed[0] is None:
+        return '', 403
+    if not _session_matches(parsed[0]):
+        return '', 403
+    return '', 204
@@ -0,0 +1,425 @@
+import json
+import math
+from datetime import datetime, timedelta
+from app.models import File, AccessLog, AccessLogRollup, AccessEntityRollup, RollupCursor, db
+
+CURSOR_NAME = 'access_log'
+
+# 汇总粒度：范围查询时优先使用最粗的粒度，边缘部分再用细粒度补齐
+RESOLUTIONS = ('h', 'd', 'm')
+ENTITY_RESOLUTIONS = ('d', 'm')
+
+# 带字节数的动作：details 中没有 bytes 时按文件大小计
+BYTE_ACTIONS = {'upload', 'download'}
+
+
+def floor_time(t, resolution):
+    if resolution == 'h':
+        return t.replace(minute=0, second=0, microsecond=0)
+    if resolution == 'd':
+        return t.replace(hour=0, minute=0, second=0, microsecond=0)
+    return t.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_time(t, resolution):
+    """t 所在时间段的下一个时间段起点"""
+    t = floor_time(t, resolution)
+    if resolution == 'h':
+        return t + timedelta(hours=1)
+    if resolution == 'd':
+        return t + timedelta(days=1)
+    return t.replace(year=t.year + 1, month=1) if t.month == 12 else t.replace(month=t.month + 1)
+
+
+def ceil_time(t, resolution):
+    return t if floor_time(t, resolution) == t else next_time(t, resolution)
+
+
+def decompose(start, end, resolutions=RESOLUTIONS):
+    """把 [start, end) 拆成尽量少的汇总时间段，返回 [(粒度, 起点, 终点)]
+
+    两端按最细粒度向外取整；三个月的范围最多读取两端各不到一天的小时数据、
+    不到一个月的天数据和中间的月数据
+    """
+    finest = resolutions[0]
+    start, end = floor_time(start, finest), ceil_time(end, finest)
+    if start >= end:
+        return []
+
+    def split(lo, hi, level):
+        if level + 1 >= len(resolutions):
+            return [(resolutions[level], lo, hi)]
+        coarser = resolutions[level + 1]
+        inner_lo, inner_hi = ceil_time(lo, coarser), floor_time(hi, coarser)
+        if inner_lo >= inner_hi:
+            return [(resolutions[level], lo, hi)]
+        parts = split(inner_lo, inner_hi, level + 1)
+        if lo < inner_lo:
+            parts.insert(0, (resolutions[level], lo, inner_lo))
+        if inner_hi < hi:
+            parts.append((resolutions[level], inner_hi, hi))
+        return parts
+
+    return split(start, end, 0)
+
+
+class LatencySketch:
+    """对数分桶的响应时间分布（相对误差约2%），可直接相加合并，用于汇总后计算分位数"""
+
+    RELATIVE_ACCURACY = 0.02
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    MIN_VALUE = 0.01  # 毫秒，更小的值计入最低的桶
+    MAX_BINS = 512  # 超出时合并最低的桶，只影响最小的分位数
+
+    _LOG_GAMMA = math.log(GAMMA)
+
+    @staticmethod
+    def index(value):
+        return math.ceil(math.log(max(value, LatencySketch.MIN_VALUE)) / LatencySketch._LOG_GAMMA)
+
+    @staticmethod
+    def value(index):
+        return 2 * LatencySketch.GAMMA ** index / (LatencySketch.GAMMA + 1)
+
+    @staticmethod
+    def add(bins, value):
+        idx = LatencySketch.index(value)
+        bins[idx] = bins.get(idx, 0) + 1
+
+    @staticmethod
+    def merge(bins, other):
+        for idx, n in other.items():
+            bins[idx] = bins.get(idx, 0) + n
+        return bins
+
+    @staticmethod
+    def _collapse(bins):
+        if len(bins) <= LatencySketch.MAX_BINS:
+            return bins
+        keys = sorted(bins)
+        excess = keys[:len(keys) - LatencySketch.MAX_BINS + 1]
+        target = excess[-1]
+        bins[target] = sum(bins.pop(k) for k in excess[:-1]) + bins[target]
+        return bins
+
+    @staticmethod
+    def quantile(bins, q):
+        total = sum(bins.values())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for idx in sorted(bins):
+            seen += bins[idx]
+            if seen > rank:
+                return LatencySketch.value(idx)
+        return LatencySketch.value(max(bins))
+
+    @staticmethod
+    def encode(bins):
+        return json.dumps(LatencySketch._collapse(bins), separators=(',', ':')) if bins else None
+
+    @staticmethod
+    def decode(raw):
+        return {int(k): v for k, v in json.loads(raw).items()} if raw else {}
+
+
+def _record_bytes(row):
+    if row.details and '"bytes"' in row.details:
+        try:
+            value = json.loads(row.details).get('bytes')
+            if isinstance(value, int):
+                return value
+        except (ValueError, AttributeError):
+            pass
+    if row.action in BYTE_ACTIONS and row.file_size:
+        return row.file_size
+    return 0
+
+
+class AccessRollup:
+    """把新的访问日志增量累加到汇总表中
+
+    进度按 AccessLog.id 记录在 rollup_cursor 中，汇总和进度在同一个事务中提交，
+    中断后重新运行不会重复计数。只处理写入超过 settle 秒的记录，减少并发事务晚提交导致的遗漏
+    """
+
+    @staticmethod
+    def cursor(lock=False):
+        query = RollupCursor.query.filter_by(name=CURSOR_NAME)
+        cursor = query.with_for_update().first() if lock else query.first()
+        if cursor is None:
+            cursor = RollupCursor(name=CURSOR_NAME, last_id=0)
+            db.session.add(cursor)
+            db.session.flush()
+        return cursor
+
+    @staticmethod
+    def progress():
+        """当前进度，尚未运行过时返回None"""
+        return RollupCursor.query.filter_by(name=CURSOR_NAME).first()
+
+    @staticmethod
+    def rolled_up_id():
+        """已汇总的最大日志ID，清理原始日志时不能超过它"""
+        cursor = AccessRollup.progress()
+        return cursor.last_id if cursor else 0
+
+    @staticmethod
+    def _fold(rows):
+        """在内存中汇总一批日志，返回 (按接口汇总, 按文件/用户汇总)"""
+        totals = {}
+        entities = {}
+        for row in rows:
+            action = row.action or ''
+            size = _record_bytes(row)
+
+            for resolution in RESOLUTIONS:
+                key = (resolution, floor_time(row.created_at, resolution), row.endpoint, action, row.status_code)
+                agg = totals.get(key)
+                if agg is None:
+                    agg = totals[key] = {'count': 0, 'bytes': 0, 'latency_count': 0,
+                                         'latency_sum': 0.0, 'latency_max': None, 'bins': {}}
+                agg['count'] += 1
+                agg['bytes'] += size
+                if row.response_time is not None:
+                    agg['latency_count'] += 1
+                    agg['latency_sum'] += row.response_time
+                    agg['latency_max'] = max(agg['latency_max'] or 0, row.response_time)
+                    LatencySketch.add(agg['bins'], row.response_time)
+
+            for kind, entity_id in (('file', row.file_id), ('user', row.user_id)):
+                if entity_id is None:
+                    continue
+                for resolution in ENTITY_RESOLUTIONS:
+                    key = (resolution, floor_time(row.created_at, resolution), kind, entity_id, action)
+                    agg = entities.setdefault(key, {'count': 0, 'bytes': 0})
+                    agg['count'] += 1
+                    agg['bytes'] += size
+        return totals, entities
+
+    @staticmethod
+    def _existing(model, fields, keys):
+        """锁定已存在的汇总行，返回 {键: 行}"""
+        if not keys:
+            return {}
+        buckets = {k[1] for k in keys}
+        second = {k[2] for k in keys}
+        query = model.query.filter(
+            model.resolution.in_({k[0] for k in keys}),
+            model.bucket.in_(buckets),
+            getattr(model, fields[2]).in_(second)
+        ).with_for_update()
+        return {tuple(getattr(row, f) for f in fields): row for row in query}
+
+    @staticmethod
+    def _write_totals(totals):
+        fields = ('resolution', 'bucket', 'endpoint', 'action', 'status_code')
+        existing = AccessRollup._existing(AccessLogRollup, fields, list(totals))
+        inserts, updates = [], []
+        for key, agg in totals.items():
+            row = existing.get(key)
+            if row is None:
+                inserts.append({
+                    **dict(zip(fields, key)),
+                    'count': agg['count'], 'bytes': agg['bytes'],
+                    'latency_count': agg['latency_count'], 'latency_sum': agg['latency_sum'],
+                    'latency_max': agg['latency_max'],
+                    'latency_sketch': LatencySketch.encode(agg['bins']),
+                })
+            else:
+                bins = LatencySketch.merge(LatencySketch.decode(row.latency_sketch), agg['bins'])
+                latency_max = agg['latency_max'] if row.latency_max is None \
+                    else max(row.latency_max, agg['latency_max'] or 0)
+                updates.append({
+                    'id': row.id,
+                    'count': row.count + agg['count'], 'bytes': row.bytes + agg['bytes'],
+                    'latency_count': row.latency_count + agg['latency_count'],
+                    'latency_sum': row.latency_sum + agg['latency_sum'],
+                    'latency_max': latency_max,
+                    'latency_sketch': LatencySketch.encode(bins),
+                })
+        if inserts:
+            db.session.execute(db.insert(AccessLogRollup), inserts)
+        if updates:
+            db.session.execute(db.update(AccessLogRollup), updates)
+
+    @staticmethod
+    def _write_entities(entities):
+        fields = ('resolution', 'bucket', 'kind', 'entity_id', 'action')
+        existing = AccessRollup._existing(AccessEntityRollup, fields, list(entities))
+        inserts, updates = [], []
+        for key, agg in entities.items():
+            row = existing.get(key)
+            if row is None:
+                inserts.append({**dict(zip(fields, key)), **agg})
+            else:
+                updates.append({'id': row.id, 'count': row.count + agg['count'],
+                                'bytes': row.bytes + agg['bytes']})
+        if inserts:
+            db.session.execute(db.insert(AccessEntityRollup), inserts)
+        if updates:
+            db.session.execute(db.update(AccessEntityRollup), updates)
+
+    @staticmethod
+    def run_batch(batch_size=5000, settle_seconds=60):
+        """汇总一批新日志并提交，返回处理的日志数"""
+        cutoff = datetime.utcnow() - timedelta(seconds=settle_seconds)
+        try:
+            # 锁定进度行，多个汇总任务同时运行时串行执行
+            cursor = AccessRollup.cursor(lock=True)
+            rows = db.session.query(
+                AccessLog.id, AccessLog.created_at, AccessLog.endpoint, AccessLog.action,
+                AccessLog.status_code, AccessLog.response_time, AccessLog.user_id,
+                AccessLog.file_id, AccessLog.details, File.file_size
+            ).outerjoin(File, File.id == AccessLog.file_id).filter(
+                AccessLog.id > cursor.last_id
+            ).order_by(AccessLog.id).limit(batch_size).all()
+
+            # 按ID顺序处理到第一条尚未稳定的记录为止
+            ready = []
+            for row in rows:
+                if row.created_at is None or row.created_at > cutoff:
+                    break
+                ready.append(row)
+
+            if not ready:
+                db.session.rollback()
+                return 0
+
+            totals, entities = AccessRollup._fold(ready)
+            AccessRollup._write_totals(totals)
+            AccessRollup._write_entities(entities)
+
+            cursor.last_id = ready[-1].id
+            cursor.last_created_at = ready[-1].created_at
+            db.session.commit()
+            return len(ready)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def prune_hourly(before):
+        """删除早于 before 的小时汇总（天和月汇总保留），返回删除的行数"""
+        deleted = AccessLogRollup.query.filter(
+            AccessLogRollup.resolution == 'h',
+            AccessLogRollup.bucket < floor_time(before, 'd')
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+class AccessReports:
+    """基于汇总表的报表查询"""
+
+    GROUP_FIELDS = {
+        'endpoint': ('endpoint',),
+        'action': ('action',),
+        'status': ('status_code',),
+        'endpoint_status': ('endpoint', 'status_code'),
+    }
+    SERIES_RESOLUTIONS = {'hour': 'h', 'day': 'd', 'month': 'm'}
+    QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+    @staticmethod
+    def _range_filter(model, ranges):
+        return db.or_(*[
+            db.and_(model.resolution == resolution, model.bucket >= lo, model.bucket < hi)
+            for resolution, lo, hi in ranges
+        ])
+
+    @staticmethod
+    def _status_filter(query, status):
+        """status 可以是具体状态码或 2xx/4xx/5xx 这样的类别"""
+        if not status:
+            return query
+        if len(status) == 3 and status[0].isdigit() and status[1:].lower() == 'xx':
+            base = int(status[0]) * 100
+            return query.filter(AccessLogRollup.status_code >= base, AccessLogRollup.status_code < base + 100)
+        return query.filter(AccessLogRollup.status_code == int(status))
+
+    @staticmethod
+    def _summarize(key, aggs, with_latency):
+        count = sum(a.count for a in aggs)
+        errors = sum(a.count for a in aggs if a.status_code >= 400)
+        server_errors = sum(a.count for a in aggs if a.status_code >= 500)
+        result = {
+            'key': key,
+            'count': count,
+            'errors': errors,
+            'server_errors': server_errors,
+            'error_rate': round(errors / count, 4) if count else 0,
+            'bytes': sum(a.bytes for a in aggs),
+        }
+        if with_latency:
+            latency_count = sum(a.latency_count for a in aggs)
+            latency = {'count': latency_count, 'avg': None, 'max': None}
+            if latency_count:
+                bins = {}
+                for a in aggs:
+                    LatencySketch.merge(bins, LatencySketch.decode(a.latency_sketch))
+                latency['avg'] = round(sum(a.latency_sum for a in aggs) / latency_count, 2)
+                latency['max'] = max(a.latency_max for a in aggs if a.latency_max is not None)
+                for name, q in AccessReports.QUANTILES:
+                    latency[name] = round(LatencySketch.quantile(bins, q), 2)
+            result['latency'] = latency
+        return result
+
+    @staticmethod
+    def summary(start, end, group_by='endpoint', endpoint=None, action=None, status=None, with_latency=True):
+        """按接口、动作或状态码汇总 [start, end) 内的请求；group_by 为 hour/day/month 时返回时间序列"""
+        if group_by in AccessReports.SERIES_RESOLUTIONS:
+            resolution = AccessReports.SERIES_RESOLUTIONS[group_by]
+            lo, hi = floor_time(start, resolution), ceil_time(end, resolution)
+            ranges = [(resolution, lo, hi)] if lo < hi else []
+            key_of = lambda row: row.bucket.isoformat()
+        else:
+            fields = AccessReports.GROUP_FIELDS[group_by]
+            ranges = decompose(start, end)
+            key_of = lambda row: '|'.join(str(getattr(row, f)) for f in fields)
+
+        if not ranges:
+            return []
+
+        columns = [AccessLogRollup.bucket, AccessLogRollup.endpoint, AccessLogRollup.action,
+                   AccessLogRollup.status_code, AccessLogRollup.count, AccessLogRollup.bytes,
+                   AccessLogRollup.latency_count, AccessLogRollup.latency_sum, AccessLogRollup.latency_max]
+        if with_latency:
+            columns.append(AccessLogRollup.latency_sketch)
+        query = db.session.query(*columns).filter(AccessReports._range_filter(AccessLogRollup, ranges))
+        if endpoint:
+            query = query.filter(AccessLogRollup.endpoint == endpoint)
+        if action is not None:
+            query = query.filter(AccessLogRollup.action == action)
+        query = AccessReports._status_filter(query, status)
+
+        groups = {}
+        for row in query:
+            groups.setdefault(key_of(row), []).append(row)
+
+        results = [AccessReports._summarize(key, aggs, with_latency) for key, aggs in groups.items()]
+        if group_by in AccessReports.SERIES_RESOLUTIONS:
+            results.sort(key=lambda r: r['key'])
+        else:
+            results.sort(key=lambda r: r['count'], reverse=True)
+        return results
+
+    @staticmethod
+    def top(kind, start, end, action=None, limit=10, order_by='count'):
+        """访问次数（或字节数）最多的文件或用户，按天对齐，返回 [(实体ID, 次数, 字节数)]"""
+        ranges = decompose(start, end, ENTITY_RESOLUTIONS)
+        if not ranges:
+            return []
+
+        total_count = db.func.sum(AccessEntityRollup.count).label('count')
+        total_bytes = db.func.sum(AccessEntityRollup.bytes).label('bytes')
+        query = db.session.query(AccessEntityRollup.entity_id, total_count, total_bytes).filter(
+            AccessEntityRollup.kind == kind,
+            AccessReports._range_filter(AccessEntityRollup, ranges)
+        )
+        if action is not None:
+            query = query.filter(AccessEntityRollup.action == action)
+        order = total_bytes if order_by == 'bytes' else total_count
+        rows = query.group_by(AccessEntityRollup.entity_id).order_by(order.desc()).limit(limit).all()
+        return [(row.entity_id, int(row.count), int(row.bytes)) for row in rows]
@@ -0,0 +1,319 @@
+import os
+import mmap
+import math
+import time
+import socket
+import struct
+import tempfile
+import threading
+from flask import g, request, jsonify
+from werkzeug.wsgi import ClosingIterator
+from app.utils.metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTED, LISTEN_QUEUE
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境退化为进程内计数
+    fcntl = None
+
+# 路由类别：传输（上传下载）、元数据（列表、详情、登录等）、管理后台
+ROUTE_CLASSES = ('transfer', 'metadata', 'admin')
+
+# 传输类接口：占用 worker 的时间与文件大小成正比；files.upload 只有 POST 是传输
+TRANSFER_ENDPOINTS = {
+    'api.api_download': None,
+    'api.api_download_archive': None,
+    'api.api_download_version': None,
+    'api.api_upload': None,
+    'api.api_upload_chunk': None,
+    'files.download': None,
+    'files.upload': {'POST'},
+    'links.download': None,
+    'links.user_download': None,
+}
+
+# 不做准入控制：静态文件、指标采集和 Nginx auth_request 的会话校验
+EXEMPT_ENDPOINTS = {'static', 'admin.metrics', 'links.session_check'}
+
+
+def classify(endpoint, method):
+    """请求所属的路由类别，不受准入控制时返回None"""
+    if method == 'OPTIONS' or endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if endpoint in TRANSFER_ENDPOINTS:
+        methods = TRANSFER_ENDPOINTS[endpoint]
+        if methods is None or method in methods:
+            return 'transfer'
+        return 'metadata'
+    if endpoint and endpoint.startswith('admin.'):
+        return 'admin'
+    return 'metadata'
+
+
+class MemoryAdmissionStore:
+    """进程内计数，仅用于单进程开发环境"""
+
+    def __init__(self):
+        self.counts = [0] * len(ROUTE_CLASSES)
+        self.lock = threading.Lock()
+
+    def acquire(self, index, limit):
+        with self.lock:
+            if self.counts[index] >= limit:
+                return None
+            self.counts[index] += 1
+            return index
+
+    def release(self, slot):
+        with self.lock:
+            self.counts[slot] = max(0, self.counts[slot] - 1)
+
+    def release_process(self, pid):
+        pass
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * len(ROUTE_CLASSES)
+
+
+class SharedAdmissionStore:
+    """共享内存中的各类别在途请求计数，同一台机器上的所有 worker 进程共用
+
+    头部为各类别的计数，其后是占用槽位表（进程ID, 类别），整个表由一个 fcntl 字节锁保护。
+    worker 被杀死时 gunicorn 主进程释放其槽位；计数达到上限时也会检查槽位的进程是否存活，
+    不依赖主进程回调
+    """
+
+    HEADER = struct.Struct('<8i')  # 各类别的在途请求数，最多8个类别
+    SLOT = struct.Struct('<ii')  # 进程ID, 类别序号+1（0为空闲）
+    REAP_INTERVAL = 1.0
+
+    def __init__(self, path, slots=1024):
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.last_reap = 0.0
+
+        size = self.HEADER.size + slots * self.SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size != size:
+            os.ftruncate(self.fd, 0)
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+
+    def _slot_offset(self, slot):
+        return self.HEADER.size + slot * self.SLOT.size
+
+    def _locked(self, func, *args):
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, 0)
+            try:
+                return func(*args)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, 0)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _clear(self, predicate):
+        """释放满足条件的槽位并按槽位表重算计数，在持有锁时调用"""
+        counts = [0] * 8
+        for slot in range(self.slots):
+            offset = self._slot_offset(slot)
+            pid, kind = self.SLOT.unpack_from(self.map, offset)
+            if not kind:
+                continue
+            if predicate(pid):
+                self.SLOT.pack_into(self.map, offset, 0, 0)
+            else:
+                counts[kind - 1] += 1
+        self.HEADER.pack_into(self.map, 0, *counts)
+        return counts
+
+    def _acquire(self, index, limit):
+        counts = list(self.HEADER.unpack_from(self.map, 0))
+        if counts[index] >= limit:
+            now = time.monotonic()
+            if now - self.last_reap < self.REAP_INTERVAL:
+                return None
+            self.last_reap = now
+            counts = self._clear(lambda pid: not self._alive(pid))
+            if counts[index] >= limit:
+                return None
+
+        pid = os.getpid()
+        start = pid % self.slots
+        for i in range(self.slots):
+            slot = (start + i) % self.slots
+            offset = self._slot_offset(slot)
+            if self.SLOT.unpack_from(self.map, offset)[1] == 0:
+                self.SLOT.pack_into(self.map, offset, pid, index + 1)
+                counts[index] += 1
+                self.HEADER.pack_into(self.map, 0, *counts)
+                return slot
+        return None
+
+    def acquire(self, index, limit):
+        """占用一个槽位，类别已达上限时返回None"""
+        return self._locked(self._acquire, index, limit)
+
+    def _release(self, slot):
+        offset = self._slot_offset(slot)
+        pid, kind = self.SLOT.unpack_from(self.map, offset)
+        if not kind:
+            return
+        self.SLOT.pack_into(self.map, offset, 0, 0)
+        counts = list(self.HEADER.unpack_from(self.map, 0))
+        counts[kind - 1] = max(0, counts[kind - 1] - 1)
+        self.HEADER.pack_into(self.map, 0, *counts)
+
+    def release(self, slot):
+        self._locked(self._release, slot)
+
+    def release_process(self, pid):
+        """释放已退出的 worker 占用的槽位"""
+        self._locked(self._clear, lambda slot_pid: slot_pid == pid)
+
+    def reset(self):
+        self._locked(self._clear, lambda pid: True)
+
+
+_store = None
+_limits = {}
+_retry_after = 1
+
+
+def _default_shm_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'resource-sharing-admission')
+
+
+def _default_limits(workers):
+    """默认上限：传输最多占一半 worker，管理后台四分之一，元数据请求不另设上限"""
+    return {
+        'transfer': max(1, workers // 2),
+        'metadata': workers,
+        'admin': max(1, workers // 4),
+    }
+
+
+def _release(ticket):
+    route_class, slot = ticket
+    ADMISSION_IN_FLIGHT.labels(route_class).dec()
+    _store.release(slot)
+
+
+def _before_request():
+    route_class = classify(request.endpoint, request.method)
+    if route_class is None:
+        return None
+
+    slot = _store.acquire(ROUTE_CLASSES.index(route_class), _limits[route_class])
+    if slot is None:
+        ADMISSION_REJECTED.labels(route_class).inc()
+        response = jsonify({'error': '服务器繁忙，请稍后再试'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(_retry_after)
+        return response
+
+    ADMISSION_IN_FLIGHT.labels(route_class).inc()
+    g._admission = (route_class, slot)
+    return None
+
+
+def _close_with(body, callback):
+    """在响应体的 close 上挂接回调；不能挂接时包装为 ClosingIterator"""
+    close = getattr(body, 'close', None)
+
+    def closing():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+
+    try:
+        body.close = closing
+        return body
+    except AttributeError:
+        return ClosingIterator(body, callback)
+
+
+def _after_request(response):
+    # 响应体发送完成、服务器关闭它时才释放槽位，下载占用 worker 的整个过程都计入
+    ticket = g.pop('_admission', None)
+    if ticket is None:
+        return response
+
+    def release():
+        _release(ticket)
+
+    if response.direct_passthrough and request.method != 'HEAD' and response.status_code not in (204, 304):
+        # send_file 等直通响应的响应体原样交给服务器，Response.close 不会被调用；
+        # 保持 wsgi.file_wrapper 的类型不变，服务器仍可使用 sendfile
+        response.response = _close_with(response.response, release)
+    else:
+        response.call_on_close(release)
+    return response
+
+
+def _teardown_request(exc):
+    # 没有经过 after_request（如处理过程中出错）时在这里释放
+    ticket = g.pop('_admission', None)
+    if ticket is not None:
+        _release(ticket)
+
+
+def init_admission(app):
+    """按路由类别限制在途请求数；需在 init_metrics 之后调用，使被拒绝的请求也计入请求指标"""
+    global _store, _limits, _retry_after
+    if not app.config.get('ADMISSION_ENABLED', True):
+        return
+
+    _limits = _default_limits(app.config.get('ADMISSION_WORKERS') or 1)
+    for route_class in ROUTE_CLASSES:
+        configured = app.config.get(f'ADMISSION_{route_class.upper()}_LIMIT')
+        if configured:
+            _limits[route_class] = int(configured)
+    _retry_after = max(1, math.ceil(app.config.get('ADMISSION_RETRY_AFTER', 1)))
+
+    if fcntl is not None:
+        _store = SharedAdmissionStore(app.config.get('ADMISSION_SHM_PATH') or _default_shm_path())
+    else:
+        _store = MemoryAdmissionStore()
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def reset_admission():
+    """gunicorn 主进程启动时清空上次运行遗留的槽位"""
+    if _store is not None:
+        _store.reset()
+
+
+def release_worker(pid):
+    """gunicorn 主进程在 worker 退出时调用"""
+    if _store is not None:
+        _store.release_process(pid)
+
+
+def sample_listen_queue(sockets):
+    """记录监听 socket 中等待 accept 的连接数（Linux TCP_INFO 的 tcpi_unacked），在 gunicorn pre_request 中调用"""
+    if not hasattr(socket, 'TCP_INFO'):
+        return
+    depth = 0
+    for sock in sockets:
+        try:
+            info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        except (OSError, AttributeError):
+            continue
+        if len(info) >= 32:
+            depth += struct.unpack_from('<I', info, 24)[0]
+    LISTEN_QUEUE.set(depth)
@@ -0,0 +1,149 @@
+import os
+import gzip
+import shutil
+from flask import request, send_file
+from app.utils.hot_cache import send_cached
+
+try:
+    import brotli
+except ImportError:  # 未安装时只生成gzip
+    brotli = None
+
+# 文本类上传（见 SecurityManager.validate_file_upload），压缩后通常只有原大小的 10%-30%
+COMPRESSIBLE_EXTENSIONS = {'txt', 'sql', 'py', 'js', 'html', 'css', 'json', 'xml'}
+
+# 按优先级排列的 (Content-Encoding, 后缀, 位标志)
+ENCODINGS = (('br', '.br', 2), ('gzip', '.gz', 1))
+VARIANT_SUFFIXES = tuple(suffix for _, suffix, _ in ENCODINGS)
+
+MIN_SIZE = 1024
+# 压缩后不小于原大小的这个比例时不保留
+MAX_RATIO = 0.9
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def is_compressible(filename):
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return ext in COMPRESSIBLE_EXTENSIONS
+
+
+def is_variant(filename):
+    """是否为压缩副本（如 xxx.txt.gz）"""
+    for suffix in VARIANT_SUFFIXES:
+        if filename.endswith(suffix):
+            return is_compressible(filename[:-len(suffix)])
+    return False
+
+
+def accepted_encodings(header):
+    """解析 Accept-Encoding，返回 q>0 的编码集合"""
+    accepted = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+
+class CompressedVariants:
+    """压缩副本：与原文件同目录，文件名追加 .br/.gz 后缀"""
+
+    @staticmethod
+    def _write(path, suffix, compress):
+        target = path + suffix
+        tmp = target + '.tmp'
+        try:
+            compress(path, tmp)
+            if os.path.getsize(tmp) >= os.path.getsize(path) * MAX_RATIO:
+                os.remove(tmp)
+                CompressedVariants._remove(target)
+                return False
+            shutil.copystat(path, tmp)
+            os.replace(tmp, target)
+            return True
+        except Exception:
+            CompressedVariants._remove(tmp)
+            raise
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _gzip(src, dst):
+        with open(src, 'rb') as fin, open(dst, 'wb') as raw:
+            # mtime=0 使相同内容生成相同的副本
+            with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=GZIP_LEVEL, mtime=0) as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+
+    @staticmethod
+    def _brotli(src, dst):
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            for chunk in iter(lambda: fin.read(1024 * 1024), b''):
+                fout.write(compressor.process(chunk))
+            fout.write(compressor.finish())
+
+    @staticmethod
+    def build(path):
+        """生成压缩副本，返回已生成副本的位标志"""
+        if not is_compressible(path) or os.path.getsize(path) < MIN_SIZE:
+            return 0
+
+        flags = 0
+        if CompressedVariants._write(path, '.gz', CompressedVariants._gzip):
+            flags |= 1
+        if brotli is not None and CompressedVariants._write(path, '.br', CompressedVariants._brotli):
+            flags |= 2
+        return flags
+
+    @staticmethod
+    def paths(path):
+        """原文件对应的所有可能的副本路径"""
+        return [path + suffix for suffix in VARIANT_SUFFIXES]
+
+    @staticmethod
+    def negotiate(path, accept_encoding):
+        """按客户端支持的编码选择已存在的副本，返回 (路径, Content-Encoding或None)"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, suffix, _ in ENCODINGS:
+            if encoding in accepted and os.path.exists(path + suffix):
+                return path + suffix, encoding
+        return path, None
+
+
+def _send(path, download_name, mimetype):
+    """小文件优先从进程内的 mmap 缓存发送（见 app.utils.hot_cache）"""
+    response = send_cached(path, download_name, mimetype)
+    if response is None:
+        response = send_file(path, as_attachment=True, download_name=download_name, mimetype=mimetype)
+    return response
+
+
+def send_negotiated(path, download_name, mimetype=None):
+    """send_file 的包装：文本类文件按 Accept-Encoding 发送压缩副本，ETag 随副本文件不同而不同"""
+    if not is_compressible(path):
+        return _send(path, download_name, mimetype)
+
+    serve_path, encoding = CompressedVariants.negotiate(path, request.headers.get('Accept-Encoding'))
+    response = _send(serve_path, download_name, mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,385 @@
+import time
+import random
+import logging
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+from app.models import File, FileFacetCount, User, db
+from app.utils.metrics import elapsed_ms
+
+# 统计范围：(scope, owner_id)
+SCOPE_ALL = 0
+SCOPE_PUBLIC = 1
+SCOPE_USER = 2
+
+KB = 1024
+MB = 1024 * 1024
+SIZE_BUCKETS = [
+    ('tiny', 0, 100 * KB),
+    ('small', 100 * KB, MB),
+    ('medium', MB, 10 * MB),
+    ('large', 10 * MB, 100 * MB),
+    ('huge', 100 * MB, None),
+]
+SIZE_NAMES = [name for name, _, _ in SIZE_BUCKETS]
+
+FACETS = ('file_type', 'mime_type', 'size', 'uploader', 'month')
+# 按这些分面的单个取值筛选时，其他分面的计数也由计数表维护（取值少且最常用）
+COMMON_FILTERS = ('file_type', 'size')
+# 同一计数拆分的行数，并发上传时分散到不同的行上加锁
+SLOTS = 4
+# 每个分面最多返回的取值数
+TOP_VALUES = 50
+VALUE_MAX = 100
+DEFAULT_TIME_BUDGET_MS = 300
+
+# 计算分面取值需要的列
+FACET_COLUMNS = (File.id, File.uploaded_by, File.file_size, File.is_public, File.file_type, File.mime_type,
+                 File.upload_date)
+FacetRow = namedtuple('FacetRow', 'uploaded_by file_size is_public file_type mime_type upload_date')
+
+
+def size_bucket(size):
+    for name, _, upper in SIZE_BUCKETS:
+        if upper is None or (size or 0) < upper:
+            return name
+    return SIZE_NAMES[-1]
+
+
+def facet_values(row):
+    """一个文件在各分面上的取值"""
+    return {
+        'file_type': row.file_type,
+        'mime_type': (row.mime_type or '')[:VALUE_MAX],
+        'size': size_bucket(row.file_size),
+        'uploader': str(row.uploaded_by),
+        'month': (row.upload_date or datetime.utcnow()).strftime('%Y-%m'),
+    }
+
+
+def time_budget_ms():
+    """每个请求计算分面的时间预算（毫秒），从请求开始计时"""
+    if has_app_context():
+        return int(current_app.config.get('FACET_TIME_BUDGET_MS') or DEFAULT_TIME_BUDGET_MS)
+    return DEFAULT_TIME_BUDGET_MS
+
+
+def _format_month(value):
+    value = int(value)
+    return f'{value // 100:04d}-{value % 100:02d}'
+
+
+def _size_condition(name):
+    for bucket, lower, upper in SIZE_BUCKETS:
+        if bucket == name:
+            condition = File.file_size >= lower
+            return condition if upper is None else db.and_(condition, File.file_size < upper)
+    raise ValueError(f'未知的大小分组: {name}')
+
+
+def _expressions():
+    """各分面在 SQL 中的取值表达式和结果转换"""
+    size = db.case(*[(File.file_size < upper, name) for name, _, upper in SIZE_BUCKETS if upper is not None],
+                   else_=SIZE_NAMES[-1])
+    month = db.extract('year', File.upload_date) * 100 + db.extract('month', File.upload_date)
+    return {
+        'file_type': (File.file_type, str),
+        'mime_type': (File.mime_type, str),
+        'size': (size, str),
+        'uploader': (File.uploaded_by, str),
+        'month': (month, _format_month),
+    }
+
+
+def _parse_date(value, end=False):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError('日期格式错误，应为 YYYY-MM-DD 或 ISO 8601')
+    # 只有日期的结束时间包含当天
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+class FacetFilters:
+    """列表接口的筛选参数
+
+    file_type、mime_type、size、uploader 可用逗号分隔多个值，date_from / date_to 为上传日期范围
+    """
+
+    PARAMS = ('file_type', 'mime_type', 'size', 'uploader')
+
+    def __init__(self, values=None, date_from=None, date_to=None):
+        self.values = values or {}
+        self.date_from = date_from
+        self.date_to = date_to
+
+    @classmethod
+    def parse(cls, args):
+        """从查询参数解析，参数不合法时抛出 ValueError"""
+        values = {}
+        for name in cls.PARAMS:
+            raw = args.get(name)
+            if not raw:
+                continue
+            items = list(dict.fromkeys(item.strip() for item in raw.split(',') if item.strip()))
+            if not items:
+                continue
+            if name == 'size' and any(item not in SIZE_NAMES for item in items):
+                raise ValueError(f"size 只能为 {', '.join(SIZE_NAMES)}")
+            if name == 'uploader' and not all(item.isdigit() for item in items):
+                raise ValueError('uploader 必须为用户ID')
+            values[name] = items
+
+        date_from = _parse_date(args['date_from']) if args.get('date_from') else None
+        date_to = _parse_date(args['date_to'], end=True) if args.get('date_to') else None
+        return cls(values, date_from, date_to)
+
+    def conditions(self, exclude=None):
+        """筛选条件；exclude 为计数的分面，该分面自身的筛选不参与计数"""
+        conditions = []
+        for name, items in self.values.items():
+            if name == exclude:
+                continue
+            if name == 'file_type':
+                conditions.append(File.file_type.in_(items))
+            elif name == 'mime_type':
+                conditions.append(File.mime_type.in_(items))
+            elif name == 'size':
+                conditions.append(db.or_(*[_size_condition(item) for item in items]))
+            elif name == 'uploader':
+                conditions.append(File.uploaded_by.in_([int(item) for item in items]))
+        if exclude != 'month':
+            if self.date_from:
+                conditions.append(File.upload_date >= self.date_from)
+            if self.date_to:
+                conditions.append(File.upload_date < self.date_to)
+        return conditions
+
+    def table_key(self):
+        """可以由计数表回答时返回 (filter_facet, filter_value)，不带筛选为 ('', '')，否则返回None"""
+        if self.date_from or self.date_to:
+            return None
+        if not self.values:
+            return '', ''
+        if len(self.values) == 1:
+            name, items = next(iter(self.values.items()))
+            if name in COMMON_FILTERS and len(items) == 1:
+                return name, items[0]
+        return None
+
+
+def _upsert_statement():
+    """计数累加：存在时 file_count 加上新值，不存在时插入"""
+    table = FileFacetCount.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table)
+        return stmt.on_duplicate_key_update(file_count=table.c.file_count + stmt.inserted.file_count)
+    stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={'file_count': table.c.file_count + stmt.excluded.file_count}
+    )
+
+
+class FacetCounter:
+    """在修改文件的事务中增量维护分面计数表"""
+
+    KEY_FIELDS = ('scope', 'owner_id', 'filter_facet', 'filter_value', 'facet', 'value')
+
+    @staticmethod
+    def _keys(row, scopes):
+        values = facet_values(row)
+        for scope in scopes:
+            for facet, value in values.items():
+                yield (*scope, '', '', facet, value)
+            for filter_facet in COMMON_FILTERS:
+                for facet, value in values.items():
+                    if facet != filter_facet:
+                        yield (*scope, filter_facet, values[filter_facet], facet, value)
+
+    @staticmethod
+    def _scopes(row):
+        scopes = [(SCOPE_ALL, 0), (SCOPE_USER, row.uploaded_by)]
+        if row.is_public:
+            scopes.append((SCOPE_PUBLIC, 0))
+        return scopes
+
+    @staticmethod
+    def apply(rows, sign, public_only=False):
+        """按未删除的文件行（FACET_COLUMNS）在当前事务中调整计数，sign 为 1 或 -1；
+        public_only 时只调整公开范围，用于公开状态的变化"""
+        deltas = defaultdict(int)
+        for row in rows:
+            scopes = [(SCOPE_PUBLIC, 0)] if public_only else FacetCounter._scopes(row)
+            for key in FacetCounter._keys(row, scopes):
+                deltas[key] += sign
+        FacetCounter._write(deltas, random.randrange(SLOTS))
+
+    @staticmethod
+    def resize(file_record, old_size):
+        """文件大小变化（提交新版本）后调整大小分组的计数"""
+        if size_bucket(old_size) == size_bucket(file_record.file_size):
+            return
+        old = FacetRow(file_record.uploaded_by, old_size, file_record.is_public, file_record.file_type,
+                       file_record.mime_type, file_record.upload_date)
+        FacetCounter.apply([old], -1)
+        FacetCounter.apply([file_record], 1)
+
+    @staticmethod
+    def _write(deltas, slot):
+        # 按键排序，并发事务以相同顺序加锁
+        rows = [{**dict(zip(FacetCounter.KEY_FIELDS, key)), 'slot': slot, 'file_count': delta}
+                for key, delta in sorted(deltas.items()) if delta]
+        if rows:
+            db.session.execute(_upsert_statement(), rows)
+
+    @staticmethod
+    def rebuild(batch_size=5000):
+        """按当前的文件重新计算全部计数并替换原有数据，用于首次部署或修正偏差，返回统计的文件数"""
+        deltas = defaultdict(int)
+        last_id, total = 0, 0
+        while True:
+            rows = db.session.query(*FACET_COLUMNS).filter(
+                File.deleted_at.is_(None),
+                File.id > last_id
+            ).order_by(File.id).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                for key in FacetCounter._keys(row, FacetCounter._scopes(row)):
+                    deltas[key] += 1
+            last_id = rows[-1].id
+            total += len(rows)
+
+        try:
+            FileFacetCount.query.delete(synchronize_session=False)
+            items = sorted(deltas.items())
+            for i in range(0, len(items), batch_size):
+                FacetCounter._write(dict(items[i:i + batch_size]), 0)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return total
+
+
+class FacetEngine:
+    """列表接口的分面计数
+
+    不带筛选或只按 COMMON_FILTERS 中一个取值筛选时从计数表读取，其他组合按需 GROUP BY，
+    每个分面一条查询，超出请求的时间预算后其余分面不再计算
+    """
+
+    @staticmethod
+    def parse_facets(raw):
+        """facets 参数：true/all 为全部分面，也可以逗号分隔指定；未请求时返回空列表"""
+        if not raw or raw.lower() in ('0', 'false'):
+            return []
+        if raw.lower() in ('1', 'true', 'all'):
+            return list(FACETS)
+        names = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+        unknown = [name for name in names if name not in FACETS]
+        if unknown:
+            raise ValueError(f"不支持的分面: {', '.join(unknown)}")
+        return names
+
+    @staticmethod
+    def counts(facets, filters, base_filters, scope=None, budget_ms=None):
+        """facets 的计数；scope 为 (范围, owner_id)，base_filters 与该范围不一致（如带搜索条件）时传 None
+
+        返回 {'counts': {分面: [{'value', 'count'}]}, 'source': 'table'/'query', 'skipped': [超时未计算的分面]}
+        """
+        key = filters.table_key() if scope is not None else None
+        if key is not None:
+            result, skipped, source = FacetEngine._from_table(facets, scope, key), [], 'table'
+        else:
+            budget = budget_ms if budget_ms is not None else time_budget_ms()
+            spent = elapsed_ms()
+            deadline = time.perf_counter() + (budget - (spent or 0)) / 1000
+            result, skipped = FacetEngine._from_query(facets, filters, base_filters, deadline)
+            source = 'query'
+
+        FacetEngine._label_uploaders(result)
+        return {'counts': result, 'source': source, 'skipped': skipped}
+
+    @staticmethod
+    def _sorted(facet, counts):
+        if facet == 'size':
+            items = sorted(counts.items(), key=lambda item: SIZE_NAMES.index(item[0]))
+        elif facet == 'month':
+            items = sorted(counts.items(), reverse=True)
+        else:
+            items = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        return [{'value': value, 'count': count} for value, count in items[:TOP_VALUES]]
+
+    @staticmethod
+    def _from_table(facets, scope, key):
+        filter_facet, filter_value = key
+        others = [f for f in facets if f != filter_facet]
+        own = [f for f in facets if f == filter_facet]
+        # 被筛选的分面自身使用不带筛选的计数
+        conditions = []
+        if others:
+            conditions.append(db.and_(FileFacetCount.filter_facet == filter_facet,
+                                      FileFacetCount.filter_value == filter_value,
+                                      FileFacetCount.facet.in_(others)))
+        if own:
+            conditions.append(db.and_(FileFacetCount.filter_facet == '', FileFacetCount.filter_value == '',
+                                      FileFacetCount.facet.in_(own)))
+
+        total = db.func.sum(FileFacetCount.file_count)
+        rows = db.session.query(FileFacetCount.facet, FileFacetCount.value, total).filter(
+            FileFacetCount.scope == scope[0],
+            FileFacetCount.owner_id == scope[1],
+            db.or_(*conditions)
+        ).group_by(FileFacetCount.facet, FileFacetCount.value).having(total > 0).all()
+
+        counts = {facet: {} for facet in facets}
+        for facet, value, count in rows:
+            counts[facet][value] = int(count)
+        return {facet: FacetEngine._sorted(facet, values) for facet, values in counts.items()}
+
+    @staticmethod
+    def _from_query(facets, filters, base_filters, deadline):
+        expressions = _expressions()
+        result, skipped = {}, []
+        for facet in facets:
+            remaining = int((deadline - time.perf_counter()) * 1000)
+            if remaining <= 0:
+                skipped.append(facet)
+                continue
+
+            expr, convert = expressions[facet]
+            count = db.func.count()
+            # 按别名分组：表达式中的绑定参数在 SELECT 和 GROUP BY 中是不同的占位符，MySQL 会视为不同的表达式
+            stmt = db.select(expr.label('facet_value'), count).select_from(File).where(
+                *base_filters, *filters.conditions(exclude=facet)
+            ).group_by(db.literal_column('facet_value')).order_by(count.desc()).limit(TOP_VALUES)
+            # MySQL 在超过剩余预算时中止查询
+            stmt = stmt.prefix_with(f'/*+ MAX_EXECUTION_TIME({remaining}) */', dialect='mysql')
+            try:
+                rows = db.session.execute(stmt).all()
+            except OperationalError as e:
+                db.session.rollback()
+                logging.warning(f'分面计数超时 {facet}: {e}')
+                skipped.append(facet)
+                continue
+            result[facet] = FacetEngine._sorted(facet, {convert(value): count for value, count in rows
+                                                        if value is not None})
+        return result, skipped
+
+    @staticmethod
+    def _label_uploaders(result):
+        items = result.get('uploader')
+        if not items:
+            return
+        names = dict(db.session.query(User.id, User.username).filter(
+            User.id.in_([int(item['value']) for item in items])
+        ).all())
+        for item in items:
+            item['label'] = names.get(int(item['value']))
@@ -1,10 +1,21 @@
 import os
 import uuid
+import hashlib
 import mimetypes
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import Response, request, redirect
 from werkzeug.utils import secure_filename
 from PIL import Image
-from app.models import File, db
+from app.models import File, FilePermission, AccessLog, db
 from app.utils.security import SecurityManager
+from app.utils.quota import QuotaManager, QUOTA_EXCEEDED
+from app.utils.compression import CompressedVariants, send_negotiated, is_compressible, MIN_SIZE
+from app.utils.storage import get_backend, default_backend_name, presign_ttl, content_disposition
+from app.utils.versioning import VersionStore
+from app.utils.facets import FacetCounter, FacetRow, FACET_COLUMNS, size_bucket
+
+_Usage = namedtuple('_Usage', 'uploaded_by file_size')
 
 class FileUtils:
     """文件工具类"""
@@ -28,8 +39,44 @@ class FileUtils:
             return 'other'
     
     @staticmethod
-    def save_uploaded_file(file, description=None, is_public=False, user=None):
-        """保存上传的文件"""
+    def storage_root():
+        """上传根目录"""
+        return os.getenv('UPLOAD_FOLDER', '/app/uploads')
+    
+    @staticmethod
+    def fanout_key(user_id, filename):
+        """两级哈希前缀的相对路径：<user_id>/ab/cd/<filename>"""
+        digest = hashlib.sha256(filename.encode('utf-8')).hexdigest()
+        return '/'.join((str(user_id), digest[:2], digest[2:4], filename))
+    
+    @staticmethod
+    def fanout_path(user_id, filename):
+        """两级哈希前缀目录：<root>/<user_id>/ab/cd/<filename>"""
+        return os.path.join(FileUtils.storage_root(), *FileUtils.fanout_key(user_id, filename).split('/'))
+    
+    @staticmethod
+    def resolve_path(file_record):
+        """本地存储的文件在磁盘上的实际路径，所有本地读写都应通过此函数获取"""
+        if file_record.storage_layout == File.LAYOUT_FANOUT:
+            return FileUtils.fanout_path(file_record.uploaded_by, file_record.filename)
+        return file_record.file_path
+    
+    @staticmethod
+    def storage_key(file_record):
+        """文件在存储后端中的key"""
+        if file_record.storage_layout == File.LAYOUT_FANOUT:
+            return FileUtils.fanout_key(file_record.uploaded_by, file_record.filename)
+        # 旧布局只存在于本地存储，file_path 为绝对路径
+        return os.path.relpath(file_record.file_path, FileUtils.storage_root()).replace(os.sep, '/')
+    
+    @staticmethod
+    def storage_for(file_record):
+        """文件所在的存储后端"""
+        return get_backend(getattr(file_record, 'storage_backend', None) or 'local')
+    
+    @staticmethod
+    def save_uploaded_file(file, description=None, is_public=False, user=None, folder=None):
+        """保存上传的文件，folder 为目标文件夹（None 为根目录）"""
         if not file or not file.filename:
             return None, '没有选择文件'
         
@@ -42,22 +89,16 @@ class FileUtils:
         # 生成安全文件名
         safe_filename = SecurityManager.hash_filename(original_filename)
         
-        # 确保上传目录存在
-        upload_folder = os.getenv('UPLOAD_FOLDER', '/app/uploads')
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-        
-        # 创建子目录按用户ID组织
-        user_folder = os.path.join(upload_folder, str(user.id))
-        if not os.path.exists(user_folder):
-            os.makedirs(user_folder)
-        
-        file_path = os.path.join(user_folder, safe_filename)
-        file.save(file_path)
+        # 按用户ID和文件名哈希分级存放，避免单个目录条目过多
+        backend = get_backend(default_backend_name())
+        key = FileUtils.fanout_key(user.id, safe_filename)
+        file_size = backend.put_stream(key, file.stream, file.mimetype)
+        file_path = backend.local_path(key) or key
         
         # 获取文件信息
-        file_size = os.path.getsize(file_path)
         file_type = FileUtils.get_file_type(original_filename, file.mimetype)
+        # 压缩副本只为本地存储的文件生成
+        needs_variants = backend.name == 'local' and is_compressible(safe_filename) and file_size >= MIN_SIZE
         
         # 保存文件记录到数据库
         new_file = File(
@@ -67,16 +108,91 @@ class FileUtils:
             file_size=file_size,
             file_type=file_type,
             mime_type=file.mimetype,
+            upload_date=datetime.utcnow(),
             uploaded_by=user.id,
             is_public=is_public,
-            description=description
+            description=description,
+            storage_layout=File.LAYOUT_FANOUT,
+            storage_backend=backend.name,
+            folder_id=folder.id if folder else None,
+            folder_path=folder.path if folder else None,
+            # 文本类文件由后台任务生成压缩副本
+            compressed_variants=None if needs_variants else 0
         )
         
-        db.session.add(new_file)
-        db.session.commit()
+        # 用量与文件记录在同一事务中提交
+        try:
+            if not QuotaManager.reserve(user, file_size):
+                db.session.rollback()
+                backend.delete(key)
+                return None, QUOTA_EXCEEDED
+            db.session.add(new_file)
+            FacetCounter.apply([new_file], 1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
         
         return new_file, None
     
+    @staticmethod
+    def send_file_record(file_record, download_name):
+        """发送文件内容；本地文件按 Accept-Encoding 发送压缩副本，对象存储中的文件重定向到
+        预签名URL或由应用按 Range 转发，多版本文件由分块拼接，文件不存在时返回None"""
+        if file_record.current_version:
+            version = VersionStore.get(file_record.id, file_record.current_version)
+            if version is None:
+                return None
+            return FileUtils.send_stream(VersionStore.reader(version), version.size, download_name,
+                                         file_record.mime_type, etag=f'v{version.id}', modified=version.created_at)
+        
+        backend = FileUtils.storage_for(file_record)
+        key = FileUtils.storage_key(file_record)
+        
+        if backend.name == 'local':
+            path = FileUtils.resolve_path(file_record)
+            if not os.path.exists(path):
+                return None
+            return send_negotiated(path, download_name)
+        
+        info = backend.stat(key)
+        if info is None:
+            return None
+        
+        ttl = presign_ttl()
+        if ttl > 0:
+            return redirect(backend.presign(key, ttl, download_name), code=302)
+        
+        return FileUtils.send_stream(lambda start, length: backend.get_range_stream(key, start, length),
+                                     info.size, download_name, file_record.mime_type,
+                                     etag=info.etag, modified=info.modified)
+    
+    @staticmethod
+    def send_stream(read, size, download_name, mimetype, etag=None, modified=None):
+        """由应用转发 read(start, length) 读出的内容，支持单个 Range"""
+        start, length, status = 0, size, 200
+        byte_range = request.range
+        if byte_range is not None and byte_range.units == 'bytes':
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{size}'
+                return response
+            start, length, status = bounds[0], bounds[1] - bounds[0], 206
+        
+        response = Response(read(start, length), status=status,
+                            mimetype=mimetype or 'application/octet-stream', direct_passthrough=True)
+        response.content_length = length
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Content-Disposition'] = content_disposition(download_name)
+        if status == 206:
+            response.headers['Content-Range'] = f'bytes {start}-{start + length - 1}/{size}'
+        if etag:
+            response.set_etag(etag)
+        if modified:
+            response.last_modified = modified
+        return response
+    
     @staticmethod
     def generate_thumbnail(file_path, thumbnail_path, max_size=(150, 150)):
         """为图片生成缩略图"""
@@ -94,7 +210,7 @@ class FileUtils:
     @staticmethod
     def get_file_stats(user_id=None):
         """获取文件统计信息"""
-        query = db.session.query(File)
+        query = db.session.query(File).filter(File.deleted_at.is_(None))
         
         if user_id:
             query = query.filter(File.uploaded_by == user_id)
@@ -106,7 +222,7 @@ class FileUtils:
             File.file_type,
             db.func.count(File.id).label('count'),
             db.func.sum(File.file_size).label('size')
-        ).group_by(File.file_type).all()
+        ).filter(File.deleted_at.is_(None)).group_by(File.file_type).all()
         
         return {
             'total_files': total_files,
@@ -115,21 +231,227 @@ class FileUtils:
                           for stat in file_type_stats}
         }
     
+    @staticmethod
+    def get_thumbnail_path(file_path):
+        """缩略图路径"""
+        return file_path.replace('/uploads/', '/uploads/thumbnails/')
+    
     @staticmethod
     def cleanup_file(file_record):
-        """删除文件和数据库记录"""
+        """删除文件：只标记删除，磁盘文件和记录由后台清理任务在宽限期后删除"""
         try:
-            if os.path.exists(file_record.file_path):
-                os.remove(file_record.file_path)
-            
-            # 删除缩略图
-            thumbnail_path = file_record.file_path.replace('/uploads/', '/uploads/thumbnails/')
-            if os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-            
-            db.session.delete(file_record)
+            return FileUtils.mark_deleted([file_record.id]) == 1
+        except Exception:
+            return False
+    
+    @staticmethod
+    def mark_deleted(file_ids):
+        """批量标记删除，返回实际标记的数量"""
+        if not file_ids:
+            return 0
+        
+        try:
+            # 锁定待删除的记录，并发删除同一文件时不会重复扣减用量
+            rows = db.session.query(*FACET_COLUMNS).filter(
+                File.id.in_(file_ids),
+                File.deleted_at.is_(None)
+            ).with_for_update().all()
+            count = 0
+            if rows:
+                count = File.query.filter(File.id.in_([r.id for r in rows])).update(
+                    {File.deleted_at: datetime.utcnow()}, synchronize_session=False
+                )
+                QuotaManager.apply_deltas(rows, -1)
+                FacetCounter.apply(rows, -1)
             db.session.commit()
-            return True
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        db.session.expire_all()
+        return count
+    
+    @staticmethod
+    def correct_sizes(sizes):
+        """按磁盘上的实际大小修正记录（{文件ID: 大小}），在同一事务中调整用量和分面计数，返回修正的数量"""
+        if not sizes:
+            return 0
+        
+        try:
+            rows = db.session.query(*FACET_COLUMNS).filter(
+                File.id.in_(list(sizes)),
+                File.deleted_at.is_(None)
+            ).with_for_update().all()
+            changed = [r for r in rows if r.file_size != sizes[r.id]]
+            if changed:
+                table = File.__table__
+                db.session.execute(
+                    table.update().where(table.c.id == db.bindparam('b_id')).values(
+                        file_size=db.bindparam('b_size')
+                    ),
+                    [{'b_id': r.id, 'b_size': sizes[r.id]} for r in changed]
+                )
+                QuotaManager.apply_deltas([_Usage(r.uploaded_by, sizes[r.id] - (r.file_size or 0))
+                                           for r in changed], 1)
+                # 大小分组变化的文件从原分组移到新分组
+                moved = [r for r in changed if size_bucket(r.file_size) != size_bucket(sizes[r.id])]
+                if moved:
+                    FacetCounter.apply(moved, -1)
+                    FacetCounter.apply([FacetRow(r.uploaded_by, sizes[r.id], r.is_public, r.file_type,
+                                                 r.mime_type, r.upload_date) for r in moved], 1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        db.session.expire_all()
+        return len(changed)
+    
+    @staticmethod
+    def restore_files(file_ids, deleted_after):
+        """撤销删除，只恢复在 deleted_after 之后删除（尚未进入清理）的文件"""
+        if not file_ids:
+            return 0
+        
+        try:
+            rows = db.session.query(*FACET_COLUMNS).filter(
+                File.id.in_(file_ids),
+                File.deleted_at.isnot(None),
+                File.deleted_at > deleted_after
+            ).with_for_update().all()
+            count = 0
+            if rows:
+                count = File.query.filter(File.id.in_([r.id for r in rows])).update(
+                    {File.deleted_at: None, File.purge_attempts: 0, File.purge_error: None},
+                    synchronize_session=False
+                )
+                QuotaManager.apply_deltas(rows, 1)
+                FacetCounter.apply(rows, 1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        db.session.expire_all()
+        return count
+    
+    @staticmethod
+    def restore_cutoff():
+        """可恢复文件的最早删除时间，预留5分钟避免与清理任务竞争"""
+        grace_hours = float(os.getenv('DELETE_GRACE_HOURS', 24))
+        return datetime.utcnow() - timedelta(hours=grace_hours) + timedelta(minutes=5)
+    
+    @staticmethod
+    def purge_records(file_ids):
+        """在一个事务中彻底删除文件记录、授权和版本（减少分块引用数），访问日志中的引用置空"""
+        if not file_ids:
+            return 0
+        
+        try:
+            VersionStore.release_files(file_ids)
+            AccessLog.query.filter(AccessLog.file_id.in_(file_ids)).update(
+                {AccessLog.file_id: None}, synchronize_session=False
+            )
+            FilePermission.query.filter(FilePermission.file_id.in_(file_ids)).delete(synchronize_session=False)
+            count = File.query.filter(File.id.in_(file_ids)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        db.session.expire_all()
+        return count
+    
+    @staticmethod
+    def remove_file_data(file_record):
+        """删除文件在存储后端中的数据，失败时返回错误信息"""
+        if (file_record.storage_backend or 'local') == 'local':
+            return FileUtils.remove_stored_file(FileUtils.resolve_path(file_record))
+        try:
+            FileUtils.storage_for(file_record).delete(FileUtils.storage_key(file_record))
         except Exception as e:
+            return f'{FileUtils.storage_key(file_record)}: {e}'
+        return None
+    
+    @staticmethod
+    def remove_stored_file(path):
+        """删除磁盘上的文件、缩略图和压缩副本，文件已不存在视为成功，失败时返回错误信息"""
+        for target in (path, FileUtils.get_thumbnail_path(path), *CompressedVariants.paths(path)):
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                return f'{target}: {e}'
+        return None
+    
+    @staticmethod
+    def bulk_set_public(file_ids, is_public):
+        """批量设置公开状态"""
+        if not file_ids:
+            return 0
+        
+        try:
+            # 状态实际改变的未删除文件进出公开范围的分面计数
+            changed = db.session.query(*FACET_COLUMNS).filter(
+                File.id.in_(file_ids),
+                File.deleted_at.is_(None),
+                File.is_public.isnot(True) if is_public else File.is_public.is_(True)
+            ).with_for_update().all()
+            count = File.query.filter(File.id.in_(file_ids)).update(
+                {File.is_public: is_public}, synchronize_session=False
+            )
+            FacetCounter.apply(changed, 1 if is_public else -1, public_only=True)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return count
+    
+    @staticmethod
+    def bulk_grant_permissions(file_ids, user_ids, permission_type, granted_by, expires_at=None):
+        """批量授予文件权限，已存在的授权不会重复创建"""
+        if not file_ids or not user_ids:
+            return 0
+        
+        existing = set(db.session.query(FilePermission.file_id, FilePermission.user_id).filter(
+            FilePermission.file_id.in_(file_ids),
+            FilePermission.user_id.in_(user_ids),
+            FilePermission.permission_type == permission_type
+        ))
+        
+        rows = [{
+            'file_id': file_id,
+            'user_id': user_id,
+            'permission_type': permission_type,
+            'granted_by': granted_by,
+            'granted_at': datetime.utcnow(),
+            'expires_at': expires_at
+        } for file_id in file_ids for user_id in user_ids if (file_id, user_id) not in existing]
+        
+        try:
+            if rows:
+                db.session.execute(db.insert(FilePermission), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(rows)
+    
+    @staticmethod
+    def bulk_revoke_permissions(file_ids, user_ids, permission_type):
+        """批量撤销文件权限"""
+        if not file_ids or not user_ids:
+            return 0
+        
+        try:
+            count = FilePermission.query.filter(
+                FilePermission.file_id.in_(file_ids),
+                FilePermission.user_id.in_(user_ids),
+                FilePermission.permission_type == permission_type
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
             db.session.rollback()
-            return False, str(e)
\ No newline at end of file
+            raise
+        return count
\ No newline at end of file
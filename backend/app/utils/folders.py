@@ -0,0 +1,263 @@
+from datetime import datetime
+from app.models import File, Folder, FilePermission, db
+from app.utils.file_utils import FileUtils
+
+# 文件夹最大层数，路径长度不超过 Folder.path 列宽
+MAX_DEPTH = 32
+NAME_MAX = 255
+
+
+def subtree_of(column, path):
+    """column 以 path 开头（即位于该文件夹子树中）；path 只含数字和 /，无需转义，可走索引范围扫描"""
+    return column.like(path + '%')
+
+
+class FolderManager:
+    """文件夹管理：物化路径的维护、子树查询和文件夹授权"""
+
+    @staticmethod
+    def validate_name(name):
+        """返回 (名称, 错误信息)"""
+        name = (name or '').strip() if isinstance(name, str) else ''
+        if not name:
+            return None, '文件夹名称不能为空'
+        if len(name) > NAME_MAX:
+            return None, f'文件夹名称不能超过{NAME_MAX}个字符'
+        if '/' in name or '\\' in name or name in ('.', '..'):
+            return None, '文件夹名称不合法'
+        return name, None
+
+    @staticmethod
+    def _name_taken(owner_id, parent_id, name, exclude_id=None):
+        query = Folder.query.filter(Folder.owner_id == owner_id, Folder.parent_id == parent_id, Folder.name == name)
+        if exclude_id:
+            query = query.filter(Folder.id != exclude_id)
+        return db.session.query(query.exists()).scalar()
+
+    @staticmethod
+    def create(owner_id, name, parent=None):
+        """创建文件夹，返回 (文件夹, 错误信息)"""
+        name, error = FolderManager.validate_name(name)
+        if error:
+            return None, error
+        if parent is not None and parent.depth >= MAX_DEPTH:
+            return None, f'文件夹层级不能超过{MAX_DEPTH}层'
+
+        parent_id = parent.id if parent else None
+        if FolderManager._name_taken(owner_id, parent_id, name):
+            return None, '同名文件夹已存在'
+
+        folder = Folder(name=name, owner_id=owner_id, parent_id=parent_id,
+                        depth=parent.depth + 1 if parent else 1)
+        try:
+            db.session.add(folder)
+            # 路径包含自身ID，需要先取得ID
+            db.session.flush()
+            folder.path = (parent.path if parent else '/') + f'{folder.id}/'
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return folder, None
+
+    @staticmethod
+    def rename(folder, name):
+        """改名只修改 name，路径由ID组成不受影响"""
+        name, error = FolderManager.validate_name(name)
+        if error:
+            return error
+        if FolderManager._name_taken(folder.owner_id, folder.parent_id, name, exclude_id=folder.id):
+            return '同名文件夹已存在'
+        try:
+            folder.name = name
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return None
+
+    @staticmethod
+    def move(folder, parent):
+        """移动到 parent 下（None 为根目录），只改写子树内的文件夹和文件路径，失败时返回错误信息"""
+        try:
+            # 按ID顺序锁定两端，并发的反向移动会在锁释放后看到新路径并被拒绝
+            ids = sorted({folder.id} | ({parent.id} if parent else set()))
+            locked = {f.id: f for f in Folder.query.filter(Folder.id.in_(ids)).order_by(Folder.id)
+                      .with_for_update().populate_existing().all()}
+            if len(locked) != len(ids):
+                db.session.rollback()
+                return '文件夹不存在'
+            folder = locked[folder.id]
+            parent = locked[parent.id] if parent else None
+
+            if parent is not None:
+                if parent.owner_id != folder.owner_id:
+                    db.session.rollback()
+                    return '不能移动到其他用户的文件夹'
+                if parent.path.startswith(folder.path):
+                    db.session.rollback()
+                    return '不能移动到自身或其子文件夹中'
+            if folder.parent_id == (parent.id if parent else None):
+                db.session.rollback()
+                return None
+
+            if FolderManager._name_taken(folder.owner_id, parent.id if parent else None, folder.name,
+                                         exclude_id=folder.id):
+                db.session.rollback()
+                return '目标位置已有同名文件夹'
+
+            old_path = folder.path
+            new_path = (parent.path if parent else '/') + f'{folder.id}/'
+            delta = (parent.depth + 1 if parent else 1) - folder.depth
+
+            max_depth = db.session.query(db.func.max(Folder.depth)).filter(
+                subtree_of(Folder.path, old_path)
+            ).scalar() or folder.depth
+            if max_depth + delta > MAX_DEPTH:
+                db.session.rollback()
+                return f'文件夹层级不能超过{MAX_DEPTH}层'
+
+            # 子树中所有路径的前缀 old_path 替换为 new_path
+            tail = len(old_path) + 1
+            Folder.query.filter(subtree_of(Folder.path, old_path)).update({
+                Folder.path: db.literal(new_path) + db.func.substr(Folder.path, tail),
+                Folder.depth: Folder.depth + delta
+            }, synchronize_session=False)
+            File.query.filter(subtree_of(File.folder_path, old_path)).update({
+                File.folder_path: db.literal(new_path) + db.func.substr(File.folder_path, tail)
+            }, synchronize_session=False)
+            Folder.query.filter(Folder.id == folder.id).update(
+                {Folder.parent_id: parent.id if parent else None}, synchronize_session=False
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        db.session.expire_all()
+        return None
+
+    @staticmethod
+    def move_files(file_ids, folder):
+        """把文件移动到 folder（None 为根目录）"""
+        if not file_ids:
+            return 0
+        try:
+            count = File.query.filter(File.id.in_(file_ids)).update({
+                File.folder_id: folder.id if folder else None,
+                File.folder_path: folder.path if folder else None
+            }, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.expire_all()
+        return count
+
+    @staticmethod
+    def subtree(folder, limit=1000):
+        """子树中的文件夹和未删除的文件，各最多 limit 条；返回 (文件夹列表, 文件列表, 是否截断)"""
+        folders = Folder.query.filter(subtree_of(Folder.path, folder.path), Folder.id != folder.id) \
+            .order_by(Folder.path).limit(limit + 1).all()
+        files = db.session.execute(
+            db.select(File.id, File.original_filename, File.file_size, File.file_type,
+                      File.upload_date, File.folder_id, File.uploaded_by)
+            .where(subtree_of(File.folder_path, folder.path), File.deleted_at.is_(None))
+            .order_by(File.folder_path, File.id).limit(limit + 1)
+        ).all()
+        truncated = len(folders) > limit or len(files) > limit
+        return folders[:limit], files[:limit], truncated
+
+    @staticmethod
+    def totals(folder):
+        """子树中的文件夹数、文件数和文件总大小，各为一次范围查询"""
+        folders = db.session.query(db.func.count(Folder.id)).filter(
+            subtree_of(Folder.path, folder.path)
+        ).scalar()
+        files, size = db.session.query(
+            db.func.count(File.id), db.func.coalesce(db.func.sum(File.file_size), 0)
+        ).filter(
+            subtree_of(File.folder_path, folder.path),
+            File.deleted_at.is_(None)
+        ).one()
+        return {'folders': folders - 1, 'files': files, 'size': int(size)}
+
+    @staticmethod
+    def delete(folder):
+        """删除文件夹及其子树：其中的文件移到根目录并标记删除（可从回收站恢复），返回删除的文件数"""
+        path = folder.path
+        try:
+            folder_ids = [row.id for row in Folder.query.with_entities(Folder.id).filter(subtree_of(Folder.path, path))]
+            file_ids = [row.id for row in File.query.with_entities(File.id).filter(
+                subtree_of(File.folder_path, path), File.deleted_at.is_(None)
+            )]
+            File.query.filter(subtree_of(File.folder_path, path)).update(
+                {File.folder_id: None, File.folder_path: None}, synchronize_session=False
+            )
+            FilePermission.query.filter(FilePermission.folder_id.in_(folder_ids)).delete(synchronize_session=False)
+            # 先断开父子引用再一次删除整个子树
+            Folder.query.filter(Folder.id.in_(folder_ids)).update({Folder.parent_id: None}, synchronize_session=False)
+            Folder.query.filter(Folder.id.in_(folder_ids)).delete(synchronize_session=False)
+            if not file_ids:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        if not file_ids:
+            db.session.expire_all()
+            return 0
+        # 文件的删除标记和用量扣减与上面的修改在同一事务中提交
+        return FileUtils.mark_deleted(file_ids)
+
+    @staticmethod
+    def grant(folder, user_ids, permission_type, granted_by, expires_at=None):
+        """授予文件夹权限，作用于整个子树；已存在的授权不会重复创建"""
+        existing = {row.user_id for row in FilePermission.query.with_entities(FilePermission.user_id).filter(
+            FilePermission.folder_id == folder.id,
+            FilePermission.user_id.in_(user_ids),
+            FilePermission.permission_type == permission_type
+        )}
+        rows = [{
+            'folder_id': folder.id,
+            'user_id': user_id,
+            'permission_type': permission_type,
+            'granted_by': granted_by,
+            'granted_at': datetime.utcnow(),
+            'expires_at': expires_at
+        } for user_id in user_ids if user_id not in existing]
+
+        try:
+            if rows:
+                db.session.execute(db.insert(FilePermission), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(rows)
+
+    @staticmethod
+    def revoke(folder, user_ids, permission_type):
+        """撤销文件夹权限"""
+        try:
+            count = FilePermission.query.filter(
+                FilePermission.folder_id == folder.id,
+                FilePermission.user_id.in_(user_ids),
+                FilePermission.permission_type == permission_type
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return count
+
+    @staticmethod
+    def shared_with(user_id):
+        """授权给该用户的文件夹（不含其子文件夹），每个文件夹附带授予的权限类型"""
+        rows = db.session.query(Folder, FilePermission.permission_type).join(
+            FilePermission, FilePermission.folder_id == Folder.id
+        ).filter(FilePermission.user_id == user_id).order_by(Folder.path).all()
+        shared = {}
+        for folder, permission_type in rows:
+            shared.setdefault(folder.id, (folder, set()))[1].add(permission_type)
+        return list(shared.values())
@@ -0,0 +1,258 @@
+import os
+import mmap
+import time
+import threading
+import mimetypes
+from collections import OrderedDict
+from zlib import adler32
+from flask import current_app, request
+from werkzeug.wsgi import wrap_file
+from app.utils.metrics import HOT_CACHE_EVENTS, HOT_CACHE_BYTES
+from app.utils.storage import content_disposition
+
+# 每个 worker 进程映射的总字节数上限，为0时不使用缓存
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# 超过这个大小的文件不进入缓存，直接由 send_file 发送
+DEFAULT_MAX_FILE_SIZE = 1024 * 1024
+
+
+class _Entry:
+    """一个已映射的文件；signature 与磁盘上的文件不一致时视为过期"""
+    __slots__ = ('path', 'signature', 'fd', 'map', 'size', 'mtime', 'refs', 'evicted')
+
+    def __init__(self, path, signature, fd, mapped, size, mtime):
+        self.path = path
+        self.signature = signature
+        self.fd = fd
+        self.map = mapped
+        self.size = size
+        self.mtime = mtime
+        self.refs = 0
+        self.evicted = False
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+
+def _signature(st):
+    # 上传和迁移都先写临时文件再 os.replace，替换后 inode 和 mtime 都会变化
+    return st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class CachedFile:
+    """一次响应使用的只读文件对象
+
+    read 从映射中复制；fileno 供 gunicorn 的 sendfile 使用，它按显式偏移读取并在结束后把偏移
+    恢复原值，缓存从不移动文件偏移，多个响应可以共用同一个描述符。close 时归还缓存条目
+    """
+
+    def __init__(self, cache, entry):
+        self._cache = cache
+        self._entry = entry
+        self._pos = 0
+        self.closed = False
+
+    @property
+    def size(self):
+        return self._entry.size
+
+    @property
+    def mtime(self):
+        return self._entry.mtime
+
+    def fileno(self):
+        return self._entry.fd
+
+    def read(self, size=-1):
+        end = self._entry.size if size is None or size < 0 else min(self._entry.size, self._pos + size)
+        data = self._entry.map[self._pos:end]
+        self._pos = max(self._pos, end)
+        return data
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: self._entry.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._cache.release(self._entry)
+
+
+class HotFileCache:
+    """进程内的小文件 mmap LRU 缓存，按路径和文件签名（inode、mtime、大小）区分版本
+
+    命中时省去 open/read/close，并可由服务器通过 wsgi.file_wrapper 以 sendfile 发送。
+    文件被替换后签名改变，旧映射被淘汰；文件被删除时 stat 失败，同样淘汰并返回未命中。
+    被淘汰的条目在正在发送它的响应结束后才关闭
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_file_size=DEFAULT_MAX_FILE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.entries = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'eviction': 0, 'stale': 0, 'bypass': 0}
+
+    def _count(self, event):
+        self.stats[event] += 1
+        HOT_CACHE_EVENTS.labels(event).inc()
+
+    def _evict(self, entry, event='eviction'):
+        """在持有锁时移除条目"""
+        if self.entries.get(entry.path) is entry:
+            del self.entries[entry.path]
+        self.total -= entry.size
+        HOT_CACHE_BYTES.dec(entry.size)
+        entry.evicted = True
+        self._count(event)
+        if entry.refs == 0:
+            entry.close()
+
+    def acquire(self, path):
+        """返回文件的 CachedFile，文件过大、为空或不存在时返回None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry is not None:
+                    self._evict(entry, 'stale')
+            return None
+
+        if st.st_size == 0 or st.st_size > self.max_file_size:
+            self._count('bypass')
+            return None
+
+        signature = _signature(st)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                if entry.signature == signature:
+                    self.entries.move_to_end(path)
+                    entry.refs += 1
+                    self._count('hit')
+                    return CachedFile(self, entry)
+                self._evict(entry, 'stale')
+
+        entry = self._load(path)
+        if entry is None:
+            return None
+
+        with self.lock:
+            self._count('miss')
+            current = self.entries.get(path)
+            if current is not None and current.signature == entry.signature:
+                # 并发的未命中已经映射过同一版本
+                entry.close()
+                entry = current
+                self.entries.move_to_end(path)
+            else:
+                if current is not None:
+                    self._evict(current, 'stale')
+                self.entries[path] = entry
+                self.total += entry.size
+                HOT_CACHE_BYTES.inc(entry.size)
+                while self.total > self.max_bytes and self.entries:
+                    self._evict(next(iter(self.entries.values())))
+            entry.refs += 1
+            return CachedFile(self, entry)
+
+    @staticmethod
+    def _load(path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            # 以打开后的 fstat 为准，stat 与 open 之间文件被替换时不会把新内容记成旧签名
+            st = os.fstat(fd)
+            if st.st_size == 0:
+                os.close(fd)
+                return None
+            mapped = mmap.mmap(fd, st.st_size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            os.close(fd)
+            return None
+        return _Entry(path, _signature(st), fd, mapped, st.st_size, st.st_mtime)
+
+    def release(self, entry):
+        with self.lock:
+            entry.refs -= 1
+            if entry.evicted and entry.refs == 0:
+                entry.close()
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, 'entries': len(self.entries), 'bytes': self.total,
+                    'max_bytes': self.max_bytes, 'max_file_size': self.max_file_size}
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """当前 worker 进程的缓存，fork 后在子进程中重新创建；未启用时返回None"""
+    global _cache, _cache_pid
+    max_bytes = int(current_app.config.get('HOT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES) or 0)
+    if max_bytes <= 0:
+        return None
+    if _cache is None or _cache_pid != os.getpid():
+        with _cache_lock:
+            if _cache is None or _cache_pid != os.getpid():
+                max_file_size = int(current_app.config.get('HOT_CACHE_MAX_FILE_SIZE', DEFAULT_MAX_FILE_SIZE))
+                _cache = HotFileCache(max_bytes, max_file_size)
+                _cache_pid = os.getpid()
+    return _cache
+
+
+def send_cached(path, download_name, mimetype=None):
+    """与 send_file(path, as_attachment=True) 相同的响应（ETag、Last-Modified、条件请求和 Range），
+    内容来自缓存的映射；不适合缓存时返回None，由调用方使用 send_file"""
+    cache = get_cache()
+    if cache is None:
+        return None
+    # 与 Flask 的 send_file 相同，相对路径基于应用目录
+    path = os.path.join(current_app.root_path, path)
+    cached = cache.acquire(path)
+    if cached is None:
+        return None
+
+    try:
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        response = current_app.response_class(wrap_file(request.environ, cached), mimetype=mimetype,
+                                              direct_passthrough=True)
+        response.headers['Content-Disposition'] = content_disposition(download_name)
+        response.content_length = cached.size
+        response.last_modified = cached.mtime
+        response.cache_control.no_cache = True
+        max_age = current_app.get_send_file_max_age(path)
+        if max_age is not None:
+            if max_age > 0:
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            response.expires = int(time.time() + max_age)
+        # 与 werkzeug send_file 的 ETag 相同，命中与否不影响客户端缓存校验
+        response.set_etag(f'{cached.mtime}-{cached.size}-{adler32(path.encode("utf-8")) & 0xFFFFFFFF}')
+        response = response.make_conditional(request.environ, accept_ranges=True, complete_length=cached.size)
+    except Exception:
+        cached.close()
+        raise
+    if response.status_code == 304 or request.method == 'HEAD':
+        # 不发送内容时 WSGI 服务器不会关闭响应体，在这里归还条目
+        cached.close()
+        response.response = []
+    return response
@@ -0,0 +1,208 @@
+import json
+from flask import Response, request, stream_with_context
+from app.models import File, User, AccessLog, db
+
+try:
+    import orjson
+except ImportError:  # 未安装时使用标准库，结果相同但更慢
+    orjson = None
+
+# 超过这个条数的列表分块编码并流式发送
+STREAM_THRESHOLD = 200
+STREAM_CHUNK = 200
+
+
+def dumps(obj):
+    """编码为JSON字节串；datetime 输出 ISO 8601 格式"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'),
+                      default=lambda o: o.isoformat()).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+def json_list_response(key, items, **extra):
+    """{key: [...], **extra}，条数多时分块编码、边编码边发送"""
+    if len(items) <= STREAM_THRESHOLD:
+        return json_response({key: items, **extra})
+
+    def generate():
+        yield b'{' + dumps(key) + b':['
+        for i in range(0, len(items), STREAM_CHUNK):
+            chunk = dumps(items[i:i + STREAM_CHUNK])[1:-1]
+            yield (b',' + chunk) if i else chunk
+        yield b']'
+        if extra:
+            yield b',' + dumps(extra)[1:-1]
+        yield b'}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def wants_json():
+    """页面路由是否应返回JSON（?format=json 或 Accept 首选 application/json）"""
+    if request.args.get('format') == 'json':
+        return True
+    return request.accept_mimetypes.best == 'application/json'
+
+
+class Field:
+    """列表接口的一个输出字段：对应的列、需要的关联表和可选的转换"""
+    __slots__ = ('column', 'join', 'transform')
+
+    def __init__(self, column, join=None, transform=None):
+        self.column = column
+        self.join = join
+        self.transform = transform
+
+
+class Projection:
+    """只查询需要的列，结果为元组而不是ORM对象，不进入identity map
+
+    ?fields=a,b,c 选择输出字段，同时缩小 SELECT 的列和关联表
+    """
+
+    def __init__(self, model, fields, default):
+        self.model = model
+        self.fields = {name: f if isinstance(f, Field) else Field(f) for name, f in fields.items()}
+        self.default = list(default)
+
+    def parse(self, raw=None):
+        """解析 fields 参数，返回字段名列表；有未知字段时抛出 ValueError"""
+        if raw is None:
+            raw = request.args.get('fields')
+        if not raw:
+            return self.default
+        names = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError(f"不支持的字段: {', '.join(unknown)}")
+        return names or self.default
+
+    def statement(self, names, filters=(), order_by=()):
+        columns = []
+        positions = {}
+        joins = []
+        for name in names:
+            field = self.fields[name]
+            key = id(field.column)
+            if key not in positions:
+                positions[key] = len(columns)
+                columns.append(field.column)
+            if field.join is not None and not any(j is field.join for j in joins):
+                joins.append(field.join)
+
+        stmt = db.select(*columns).select_from(self.model)
+        for target, condition in joins:
+            stmt = stmt.outerjoin(target, condition)
+        stmt = stmt.where(*filters).order_by(*order_by)
+
+        layout = [(name, positions[id(self.fields[name].column)], self.fields[name].transform) for name in names]
+        return stmt, layout
+
+    @staticmethod
+    def _to_dicts(rows, layout):
+        if all(transform is None for _, _, transform in layout) and \
+                [pos for _, pos, _ in layout] == list(range(len(layout))):
+            names = [name for name, _, _ in layout]
+            return [dict(zip(names, row)) for row in rows]
+        return [
+            {name: (transform(row[pos]) if transform else row[pos]) for name, pos, transform in layout}
+            for row in rows
+        ]
+
+    def fetch(self, names, filters=(), order_by=(), limit=None, extra=()):
+        """不分页的查询，返回 (字典列表, 原始行)；extra 中的列附加在每行末尾，不进入字典"""
+        stmt, layout = self.statement(names, filters, order_by)
+        if extra:
+            stmt = stmt.add_columns(*extra)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        rows = db.session.execute(stmt).all()
+        return self._to_dicts(rows, layout), rows
+
+    def page(self, names, filters=(), order_by=(), page=1, per_page=20):
+        """分页查询，返回 (字典列表, 分页信息)"""
+        # 负的 LIMIT 在 SQLite 中表示不限制，在 MySQL 中是语法错误
+        page = max(page, 1)
+        per_page = max(per_page, 1)
+        # 计数只查询主表，不带关联
+        total = db.session.execute(
+            db.select(db.func.count()).select_from(self.model).where(*filters)
+        ).scalar()
+        stmt, layout = self.statement(names, filters, order_by)
+        rows = db.session.execute(stmt.limit(per_page).offset((page - 1) * per_page)).all()
+        return self._to_dicts(rows, layout), {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': (total + per_page - 1) // per_page if per_page else 0
+        }
+
+
+def _download_url(file_id):
+    return '/api/files/' + str(file_id) + '/download'
+
+
+_UPLOADER = (User, User.id == File.uploaded_by)
+
+FILE_FIELDS = {
+    'id': File.id,
+    'filename': File.original_filename,
+    'size': File.file_size,
+    'type': File.file_type,
+    'mime_type': File.mime_type,
+    'upload_date': File.upload_date,
+    'uploaded_by': Field(User.username, join=_UPLOADER),
+    'uploader_id': File.uploaded_by,
+    'is_public': File.is_public,
+    'download_count': File.download_count,
+    'description': File.description,
+    'folder_id': File.folder_id,
+    'download_url': Field(File.id, transform=_download_url),
+}
+
+# /api/files 和 /api/public/files 原有的输出字段
+FILE_PROJECTION = Projection(File, FILE_FIELDS, [
+    'id', 'filename', 'size', 'type', 'upload_date', 'uploaded_by', 'is_public', 'download_url', 'description'
+])
+PUBLIC_FILE_PROJECTION = Projection(File, FILE_FIELDS, [
+    'id', 'filename', 'size', 'type', 'upload_date', 'uploaded_by', 'download_count', 'description', 'download_url'
+])
+ADMIN_FILE_PROJECTION = Projection(File, FILE_FIELDS, [
+    'id', 'filename', 'size', 'type', 'upload_date', 'uploaded_by', 'uploader_id', 'is_public', 'download_count'
+])
+
+USER_PROJECTION = Projection(User, {
+    'id': User.id,
+    'username': User.username,
+    'email': User.email,
+    'first_name': User.first_name,
+    'last_name': User.last_name,
+    'is_active': User.is_active,
+    'is_admin': User.is_admin,
+    'created_at': User.created_at,
+    'last_login': User.last_login,
+    'storage_used': User.storage_used,
+    'storage_quota': User.storage_quota,
+}, ['id', 'username', 'email', 'is_active', 'is_admin', 'created_at', 'last_login', 'storage_used'])
+
+LOG_PROJECTION = Projection(AccessLog, {
+    'id': AccessLog.id,
+    'created_at': AccessLog.created_at,
+    'user_id': AccessLog.user_id,
+    'username': Field(User.username, join=(User, User.id == AccessLog.user_id)),
+    'ip_address': AccessLog.ip_address,
+    'user_agent': AccessLog.user_agent,
+    'endpoint': AccessLog.endpoint,
+    'method': AccessLog.method,
+    'status_code': AccessLog.status_code,
+    'response_time': AccessLog.response_time,
+    'file_id': AccessLog.file_id,
+    'action': AccessLog.action,
+    'details': AccessLog.details,
+}, ['id', 'created_at', 'user_id', 'ip_address', 'endpoint', 'method', 'status_code', 'response_time', 'action',
+    'file_id'])
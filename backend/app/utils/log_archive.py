@@ -0,0 +1,166 @@
+import os
+import glob
+import logging
+from collections import OrderedDict
+from app.models import AccessLog, db
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 查询工具和归档都需要 pyarrow，未安装时 log_cleanup 只删除不归档
+    pa = pq = None
+
+# 归档目录结构：<根目录>/access_log/date=YYYY-MM-DD/part-<本批第一条ID>.parquet
+TABLE_DIR = 'access_log'
+PENDING_SUFFIX = '.pending'
+
+COLUMNS = ('id', 'created_at', 'user_id', 'file_id', 'ip_address', 'user_agent', 'endpoint',
+           'method', 'status_code', 'response_time', 'action', 'details')
+
+# 取值重复度高的列使用字典编码，其余列由 Parquet 自行决定
+DICTIONARY_COLUMNS = ['endpoint', 'method', 'action', 'ip_address', 'user_agent']
+
+COMPRESSION = 'zstd'
+
+
+def archive_schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('created_at', pa.timestamp('ms')),
+        ('user_id', pa.int32()),
+        ('file_id', pa.int32()),
+        ('ip_address', pa.string()),
+        ('user_agent', pa.string()),
+        ('endpoint', pa.string()),
+        ('method', pa.string()),
+        ('status_code', pa.int16()),
+        ('response_time', pa.float64()),
+        ('action', pa.string()),
+        ('details', pa.string()),
+    ])
+
+
+def table_path(root):
+    return os.path.join(root, TABLE_DIR)
+
+
+class LogArchiver:
+    """把过期的访问日志按主键分批写入按日期分区的 Parquet 文件后再删除
+
+    每个分片（chunk_size 条）先写成 .pending 文件，数据库删除提交后再改名；
+    中断后重新运行时根据分片第一条记录是否还在数据库中判断提交结果，不会丢失也不会重复。
+    内存占用由 batch_size 和同时打开的分区文件数决定，与过期记录总数无关
+    """
+
+    MAX_OPEN_WRITERS = 8
+
+    def __init__(self, root, batch_size=5000, chunk_size=100000):
+        self.root = root
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.schema = archive_schema()
+
+    def _pending_files(self):
+        return glob.glob(os.path.join(table_path(self.root), 'date=*', '*' + PENDING_SUFFIX))
+
+    def recover(self):
+        """处理上次中断时留下的 .pending 文件"""
+        for path in self._pending_files():
+            try:
+                first_id = int(pq.read_schema(path).metadata[b'first_id'])
+            except Exception:
+                # 写到一半中断的文件，对应的删除一定没有提交
+                first_id = None
+            committed = first_id is not None and db.session.get(AccessLog, first_id) is None
+            if committed:
+                os.replace(path, path[:-len(PENDING_SUFFIX)])
+                logging.info(f"已恢复归档文件: {path[:-len(PENDING_SUFFIX)]}")
+            else:
+                os.remove(path)
+        db.session.rollback()
+
+    def _writer(self, writers, paths, day, first_id):
+        writer = writers.get(day)
+        if writer is not None:
+            writers.move_to_end(day)
+            return writer
+
+        if len(writers) >= self.MAX_OPEN_WRITERS:
+            # 关闭最久未写入的分区，之后再有该日期的数据时写入新文件
+            _, oldest = writers.popitem(last=False)
+            oldest.close()
+
+        directory = os.path.join(table_path(self.root), f'date={day}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'part-{first_id}-{len(paths)}.parquet{PENDING_SUFFIX}')
+        schema = self.schema.with_metadata({'first_id': str(first_id)})
+        writer = pq.ParquetWriter(path, schema, compression=COMPRESSION,
+                                  use_dictionary=DICTIONARY_COLUMNS)
+        writers[day] = writer
+        paths.append(path)
+        return writer
+
+    def _write_batch(self, rows, writers, paths, first_id):
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row.created_at.date().isoformat(), []).append(row)
+        for day, day_rows in by_day.items():
+            columns = {name: [getattr(r, name) for r in day_rows] for name in COLUMNS}
+            batch = pa.RecordBatch.from_pydict(columns, schema=self.schema)
+            self._writer(writers, paths, day, first_id).write_batch(batch)
+
+    def archive_chunk(self, cutoff, max_id, after_id):
+        """归档并删除一个分片，返回 (条数, 最后一条ID)"""
+        writers, paths, ids = OrderedDict(), [], []
+        last_id = after_id
+        try:
+            while len(ids) < self.chunk_size:
+                rows = AccessLog.query.with_entities(*[getattr(AccessLog, c) for c in COLUMNS]).filter(
+                    AccessLog.id > last_id,
+                    AccessLog.id <= max_id,
+                    AccessLog.created_at < cutoff
+                ).order_by(AccessLog.id).limit(min(self.batch_size, self.chunk_size - len(ids))).all()
+                if not rows:
+                    break
+                self._write_batch(rows, writers, paths, ids[0] if ids else rows[0].id)
+                ids.extend(row.id for row in rows)
+                last_id = rows[-1].id
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        if not ids:
+            return 0, last_id
+
+        for path in paths:
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+
+        try:
+            for i in range(0, len(ids), self.batch_size):
+                AccessLog.query.filter(AccessLog.id.in_(ids[i:i + self.batch_size])).delete(
+                    synchronize_session=False
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for path in paths:
+                os.remove(path)
+            raise
+
+        for path in paths:
+            os.replace(path, path[:-len(PENDING_SUFFIX)])
+        return len(ids), last_id
+
+    def archive(self, cutoff, max_id):
+        """归档 created_at < cutoff 且 id <= max_id 的全部日志，返回条数"""
+        os.makedirs(table_path(self.root), exist_ok=True)
+        self.recover()
+
+        total, last_id = 0, 0
+        while True:
+            count, last_id = self.archive_chunk(cutoff, max_id, last_id)
+            if not count:
+                return total
+            total += count
+            logging.info(f"已归档 {total} 条访问日志（ID ≤ {last_id}）")
@@ -0,0 +1,165 @@
+import os
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import (
+    CollectorRegistry, Histogram, Counter, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+)
+from prometheus_client import multiprocess
+
+# 直方图分桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SQL_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                 16777216, 67108864, 268435456)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', '请求处理耗时',
+    ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+REQUEST_SQL_COUNT = Histogram(
+    'http_request_sql_statements', '每个请求执行的SQL语句数',
+    ['endpoint'], buckets=SQL_COUNT_BUCKETS
+)
+REQUEST_SQL_TIME = Histogram(
+    'http_request_sql_seconds', '每个请求的SQL总耗时',
+    ['endpoint'], buckets=SQL_TIME_BUCKETS
+)
+RESPONSE_BYTES = Histogram(
+    'http_response_bytes', '响应体字节数',
+    ['endpoint'], buckets=BYTES_BUCKETS
+)
+REQUEST_EXCEPTIONS = Counter(
+    'http_request_exceptions_total', '未处理异常次数',
+    ['endpoint']
+)
+RATE_LIMITED = Counter(
+    'http_rate_limited_total', '被限流拒绝的请求数',
+    ['rule', 'scope']
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'http_admission_in_flight', '各路由类别正在处理的请求数（所有worker之和）',
+    ['route_class'], multiprocess_mode='livesum'
+)
+ADMISSION_REJECTED = Counter(
+    'http_admission_rejected_total', '超过路由类别并发上限被拒绝（503）的请求数',
+    ['route_class']
+)
+LISTEN_QUEUE = Gauge(
+    'http_listen_queue_depth', '监听队列中等待 worker 接受的连接数',
+    multiprocess_mode='livemax'
+)
+HOT_CACHE_EVENTS = Counter(
+    'hot_file_cache_events_total', '热点小文件缓存事件（hit/miss/eviction/stale/bypass）',
+    ['event']
+)
+HOT_CACHE_BYTES = Gauge(
+    'hot_file_cache_bytes', '热点小文件缓存中映射的字节数（所有worker之和）',
+    multiprocess_mode='livesum'
+)
+
+
+def _endpoint_label():
+    # 未匹配路由统一归类，避免标签基数无限增长
+    return request.endpoint or '<unmatched>'
+
+
+def elapsed_ms():
+    """当前请求已耗时（毫秒），不在请求上下文中时返回None"""
+    if not has_request_context():
+        return None
+    start = g.get('_metrics_start')
+    if start is None:
+        return None
+    return (time.perf_counter() - start) * 1000
+
+
+class _CountingIterable:
+    """包装流式响应，在关闭时记录实际发送的字节数"""
+
+    def __init__(self, iterable, endpoint):
+        self.iterable = iterable
+        self.endpoint = endpoint
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+        RESPONSE_BYTES.labels(self.endpoint).observe(self.sent)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g._metrics_sql_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    start = g.pop('_metrics_sql_start', None)
+    if start is None:
+        return
+    g._metrics_sql_count = g.get('_metrics_sql_count', 0) + 1
+    g._metrics_sql_time = g.get('_metrics_sql_time', 0.0) + (time.perf_counter() - start)
+
+
+def _before_request():
+    g._metrics_start = time.perf_counter()
+    g._metrics_sql_count = 0
+    g._metrics_sql_time = 0.0
+
+
+def _after_request(response):
+    start = g.get('_metrics_start')
+    if start is None:
+        return response
+
+    endpoint = _endpoint_label()
+    REQUEST_LATENCY.labels(endpoint, request.method, str(response.status_code)).observe(
+        time.perf_counter() - start
+    )
+    REQUEST_SQL_COUNT.labels(endpoint).observe(g.get('_metrics_sql_count', 0))
+    REQUEST_SQL_TIME.labels(endpoint).observe(g.get('_metrics_sql_time', 0.0))
+
+    if response.content_length is not None:
+        RESPONSE_BYTES.labels(endpoint).observe(response.content_length)
+    elif response.is_streamed:
+        response.response = _CountingIterable(response.response, endpoint)
+
+    return response
+
+
+def _teardown_request(exc):
+    if exc is not None and g.get('_metrics_start') is not None:
+        REQUEST_EXCEPTIONS.labels(_endpoint_label()).inc()
+
+
+def init_metrics(app):
+    """注册请求性能采集钩子"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def render_metrics():
+    """生成Prometheus文本格式的指标，多进程模式下汇总所有worker"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
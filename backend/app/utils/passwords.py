@@ -0,0 +1,195 @@
+import os
+import time
+import hmac
+import hashlib
+import tempfile
+import threading
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.utils.admission import SharedAdmissionStore, MemoryAdmissionStore, fcntl
+
+# Werkzeug 方法字符串：scrypt:N:r:p 或 pbkdf2:sha256:迭代次数
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+_ITOA64 = './0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+# 共享槽位表中的两个类别：正在计算的哈希、等待计算的请求
+HASHING, WAITING = 0, 1
+
+# SHA-crypt 输出时的字节重排顺序
+_SHA512_ORDER = [(0, 21, 42), (22, 43, 1), (44, 2, 23), (3, 24, 45), (25, 46, 4), (47, 5, 26),
+                 (6, 27, 48), (28, 49, 7), (50, 8, 29), (9, 30, 51), (31, 52, 10), (53, 11, 32),
+                 (12, 33, 54), (34, 55, 13), (56, 14, 35), (15, 36, 57), (37, 58, 16), (59, 17, 38),
+                 (18, 39, 60), (40, 61, 19), (62, 20, 41)]
+_SHA256_ORDER = [(0, 10, 20), (21, 1, 11), (12, 22, 2), (3, 13, 23), (24, 4, 14), (15, 25, 5),
+                 (6, 16, 26), (27, 7, 17), (18, 28, 8), (9, 19, 29)]
+
+
+class PasswordHashingBusy(Exception):
+    """哈希任务排队超时"""
+
+
+def _b64_from_24bit(b2, b1, b0, n):
+    w = (b2 << 16) | (b1 << 8) | b0
+    out = []
+    for _ in range(n):
+        out.append(_ITOA64[w & 0x3f])
+        w >>= 6
+    return ''.join(out)
+
+
+def _repeat(data, length):
+    return (data * (length // len(data) + 1))[:length]
+
+
+def sha_crypt(password, setting):
+    """glibc SHA-crypt（$5$ / $6$），用于校验旧系统遗留的哈希"""
+    prefix = setting[:3]
+    digest = {'$5$': hashlib.sha256, '$6$': hashlib.sha512}[prefix]
+
+    parts = setting[3:].split('$')
+    rounds, custom_rounds = 5000, False
+    if parts[0].startswith('rounds='):
+        rounds = max(1000, min(999999999, int(parts[0][7:])))
+        custom_rounds = True
+        parts = parts[1:]
+    salt = parts[0][:16].encode('utf-8')
+    key = password.encode('utf-8')
+
+    b = digest(key + salt + key).digest()
+    hlen = len(b)
+    ctx = digest(key + salt + _repeat(b, len(key)))
+    length = len(key)
+    while length:
+        ctx.update(b if length & 1 else key)
+        length >>= 1
+    a = ctx.digest()
+
+    p_bytes = _repeat(digest(key * len(key)).digest(), len(key))
+    s_bytes = _repeat(digest(salt * (16 + a[0])).digest(), len(salt))
+
+    c = a
+    for i in range(rounds):
+        ctx = digest(p_bytes if i & 1 else c)
+        if i % 3:
+            ctx.update(s_bytes)
+        if i % 7:
+            ctx.update(p_bytes)
+        ctx.update(c if i & 1 else p_bytes)
+        c = ctx.digest()
+
+    if hlen == 64:
+        encoded = ''.join(_b64_from_24bit(c[x], c[y], c[z], 4) for x, y, z in _SHA512_ORDER)
+        encoded += _b64_from_24bit(0, 0, c[63], 2)
+    else:
+        encoded = ''.join(_b64_from_24bit(c[x], c[y], c[z], 4) for x, y, z in _SHA256_ORDER)
+        encoded += _b64_from_24bit(0, c[31], c[30], 3)
+
+    rounds_part = f'rounds={rounds}$' if custom_rounds else ''
+    return f"{prefix}{rounds_part}{salt.decode('utf-8')}${encoded}"
+
+
+def _setting(name, default):
+    if has_app_context():
+        value = current_app.config.get(name)
+        if value is not None:
+            return value
+    return os.getenv(name, default)
+
+
+def _default_shm_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'resource-sharing-pwhash')
+
+
+class PasswordHasher:
+    """密码哈希服务：同一台机器上所有 worker 共用并发上限，排队超出上限或等待超时时快速失败"""
+
+    _lock = threading.Lock()
+    _store = None
+    _normalized = {}
+
+    @staticmethod
+    def method():
+        return _setting('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+    @classmethod
+    def store(cls):
+        """跨 worker 的槽位表，复用准入控制的共享内存实现"""
+        if cls._store is None:
+            with cls._lock:
+                if cls._store is None:
+                    if fcntl is not None:
+                        path = _setting('PASSWORD_HASH_SHM_PATH', None) or _default_shm_path()
+                        cls._store = SharedAdmissionStore(path)
+                    else:
+                        cls._store = MemoryAdmissionStore()
+        return cls._store
+
+    @classmethod
+    def _run(cls, fn, *args):
+        store = cls.store()
+        limit = int(_setting('PASSWORD_HASH_WORKERS', 0)) or os.cpu_count() or 2
+        queue = int(_setting('PASSWORD_HASH_QUEUE', 32))
+        deadline = time.monotonic() + float(_setting('PASSWORD_HASH_TIMEOUT', 5))
+
+        slot = store.acquire(HASHING, limit)
+        if slot is None:
+            waiting = store.acquire(WAITING, queue)
+            if waiting is None:
+                raise PasswordHashingBusy()
+            try:
+                delay = 0.005
+                while slot is None:
+                    if time.monotonic() >= deadline:
+                        raise PasswordHashingBusy()
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+                    slot = store.acquire(HASHING, limit)
+            finally:
+                store.release(waiting)
+
+        try:
+            return fn(*args)
+        finally:
+            store.release(slot)
+
+    @classmethod
+    def reset(cls):
+        """gunicorn 主进程启动时清空上次运行遗留的槽位"""
+        cls.store().reset()
+
+    @classmethod
+    def release_worker(cls, pid):
+        """gunicorn 主进程在 worker 退出时调用"""
+        cls.store().release_process(pid)
+
+    @classmethod
+    def hash(cls, password):
+        """按当前配置生成哈希"""
+        return cls._run(generate_password_hash, password, cls.method())
+
+    @classmethod
+    def verify(cls, stored_hash, password):
+        """校验密码，支持 Werkzeug 格式和旧系统的 $5$/$6$ crypt 哈希"""
+        if not stored_hash or password is None:
+            return False
+        if stored_hash.startswith(('$5$', '$6$')):
+            try:
+                computed = cls._run(sha_crypt, password, stored_hash)
+            except (ValueError, KeyError, IndexError):
+                return False
+            return hmac.compare_digest(computed, stored_hash)
+        return cls._run(check_password_hash, stored_hash, password)
+
+    @classmethod
+    def needs_rehash(cls, stored_hash):
+        """哈希算法或参数与当前配置不同时需要重新哈希"""
+        if stored_hash.startswith('$'):
+            return True
+
+        method = cls.method()
+        if method not in cls._normalized:
+            # 省略参数的方法名（如 pbkdf2）按 Werkzeug 补全后的默认参数比较
+            cls._normalized[method] = generate_password_hash('', method).split('$', 1)[0]
+        return stored_hash.split('$', 1)[0] != cls._normalized[method]
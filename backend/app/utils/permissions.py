@@ -1,7 +1,7 @@
 from functools import wraps
 from flask import jsonify, request
 from flask_login import current_user
-from app.models import File
+from app.models import File, Folder, FilePermission
 
 def has_permission(permission_name):
     """Check if current user has a specific permission"""
@@ -14,7 +14,7 @@ def can_access_file(file_id, permission_type='read'):
     if not current_user.is_authenticated:
         return False
     
-    file = File.query.get(file_id)
+    file = File.active().filter_by(id=file_id).first()
     if not file:
         return False
     
@@ -31,12 +31,83 @@ def can_access_file(file_id, permission_type='read'):
         if permission.user_id == current_user.id and permission.permission_type == permission_type:
             return True
     
+    # 所在文件夹及其祖先上的授权
+    if file.folder_path and _folder_grants([file.folder_path], permission_type):
+        return True
+    
     # Public files can be read by anyone
     if permission_type == 'read' and file.is_public:
         return True
     
     return False
 
+def _folder_grants(folder_paths, permission_type):
+    """路径上的祖先文件夹中，当前用户拥有或被授予 permission_type 的文件夹ID"""
+    ancestors = {folder_id for path in folder_paths for folder_id in Folder.path_ids(path)}
+    if not ancestors:
+        return set()
+    
+    granted = {row.folder_id for row in FilePermission.query.with_entities(FilePermission.folder_id).filter(
+        FilePermission.folder_id.in_(ancestors),
+        FilePermission.user_id == current_user.id,
+        FilePermission.permission_type == permission_type
+    )}
+    owned = {row.id for row in Folder.query.with_entities(Folder.id).filter(
+        Folder.id.in_(ancestors),
+        Folder.owner_id == current_user.id
+    )}
+    return granted | owned
+
+def can_access_folder(folder, permission_type='read'):
+    """文件夹的访问权限：拥有者、管理员，或在该文件夹或其祖先上被授权"""
+    if not current_user.is_authenticated or folder is None:
+        return False
+    if folder.owner_id == current_user.id or current_user.is_admin:
+        return True
+    return bool(_folder_grants([folder.path], permission_type))
+
+def evaluate_file_access(file_ids, permission_type='read', owner_only=False):
+    """Check access for a batch of files with one query per table.
+    
+    Returns (allowed, denied_ids, missing_ids) where allowed maps id -> File.
+    owner_only restricts access to the uploader and admins (used for sharing).
+    """
+    allowed, denied, missing = {}, set(), set()
+    if not file_ids:
+        return allowed, denied, missing
+    
+    files = {f.id: f for f in File.active().filter(File.id.in_(file_ids)).all()}
+    missing = set(file_ids) - set(files)
+    
+    if not current_user.is_authenticated:
+        return allowed, set(files), missing
+    
+    granted = set()
+    if not current_user.is_admin and not owner_only:
+        candidates = [fid for fid, f in files.items() if f.uploaded_by != current_user.id]
+        if candidates:
+            granted = {row.file_id for row in FilePermission.query.with_entities(FilePermission.file_id).filter(
+                FilePermission.file_id.in_(candidates),
+                FilePermission.user_id == current_user.id,
+                FilePermission.permission_type == permission_type
+            )}
+            # 文件夹授权：所有候选文件的祖先文件夹合并为一次查询
+            folder_paths = {files[fid].folder_path for fid in candidates
+                            if fid not in granted and files[fid].folder_path}
+            folders = _folder_grants(folder_paths, permission_type)
+            if folders:
+                granted.update(fid for fid in candidates
+                               if any(f in folders for f in Folder.path_ids(files[fid].folder_path)))
+    
+    for fid, file in files.items():
+        if (current_user.is_admin or file.uploaded_by == current_user.id or fid in granted
+                or (not owner_only and permission_type == 'read' and file.is_public)):
+            allowed[fid] = file
+        else:
+            denied.add(fid)
+    
+    return allowed, denied, missing
+
 def require_permission(permission_name):
     """Decorator to require a specific permission"""
     def decorator(f):
@@ -86,6 +157,15 @@ class PermissionManager:
         'viewer': ['files.download']
     }
     
+    # 各角色的存储配额（字节），None 表示不限；用户可单独设置 storage_quota 覆盖
+    GB = 1024 ** 3
+    ROLE_QUOTAS = {
+        'admin': None,
+        'editor': 50 * GB,
+        'user': 10 * GB,
+        'viewer': 0
+    }
+    
     @staticmethod
     def init_permissions():
         """初始化权限和角色数据"""
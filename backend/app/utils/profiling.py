@@ -0,0 +1,361 @@
+import os
+import sys
+import json
+import math
+import time
+import signal
+import inspect
+import tempfile
+import linecache
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+# 单次采集的最长时间（秒）
+MAX_SECONDS = 300
+# CPU 采样间隔（秒）
+DEFAULT_INTERVAL = 0.005
+# tracemalloc 每次分配记录的调用帧数，需要足够深才能包含视图函数所在的帧
+TRACEMALLOC_FRAMES = 50
+# 内存报告列出的分配位置数
+REPORT_LIMIT = 50
+
+KINDS = ('cpu', 'memory')
+
+# 让其他 worker 开始采集的信号；gunicorn 不使用实时信号
+PROFILE_SIGNAL = getattr(signal, 'SIGRTMIN', None)
+if PROFILE_SIGNAL is not None:
+    PROFILE_SIGNAL += 3
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SITE_ROOTS = tuple(sorted({p for p in sys.path if p.endswith('-packages')} | {os.path.dirname(os.__file__)},
+                           key=len, reverse=True))
+
+
+def _short_path(filename):
+    """应用代码显示相对 app 目录的路径，库代码显示相对 site-packages 的路径"""
+    if filename.startswith(_APP_ROOT):
+        return 'app/' + os.path.relpath(filename, _APP_ROOT)
+    for root in _SITE_ROOTS:
+        if filename.startswith(root + os.sep):
+            return os.path.relpath(filename, root)
+    return filename
+
+
+def _request_label(environ):
+    if 'REQUEST_METHOD' not in environ:
+        return '<gunicorn>'  # 还在解析请求
+    request = environ.get('werkzeug.request')
+    rule = getattr(request, 'url_rule', None)
+    endpoint = rule.endpoint if rule is not None else '<unmatched>'
+    return f"{environ['REQUEST_METHOD']} {endpoint}"
+
+
+def _frame_route(frame):
+    """从调用栈中找到 WSGI 处理函数的 environ，返回正在处理的路由；没有请求时返回 <idle>
+
+    只读取 wsgi_app 和 gunicorn handle_request 这几帧的局部变量，发送响应体的阶段（下载）同样能归属到路由
+    """
+    while frame is not None:
+        if frame.f_code.co_name in ('wsgi_app', 'handle_request'):
+            environ = frame.f_locals.get('environ')
+            if isinstance(environ, dict):
+                return _request_label(environ)
+        frame = frame.f_back
+    return '<idle>'
+
+
+class ViewIndex:
+    """按源码行号查找视图函数，把内存分配的调用栈归属到路由"""
+
+    def __init__(self, app):
+        self.ranges = {}
+        for endpoint, view in app.view_functions.items():
+            func = inspect.unwrap(view)
+            code = getattr(func, '__code__', None)
+            if code is None:
+                continue
+            lines = [line for _, _, line in code.co_lines() if line is not None]
+            if lines:
+                self.ranges.setdefault(code.co_filename, []).append(
+                    (code.co_firstlineno, max(lines), endpoint))
+
+    def route(self, traceback):
+        """调用栈中最外层的视图函数对应的端点，不在请求中分配的返回 <no route>"""
+        for frame in traceback:  # tracemalloc 的帧从最外层开始排列（most_recent_first=False）
+            for start, end, endpoint in self.ranges.get(frame.filename, ()):
+                if start <= frame.lineno <= end:
+                    return endpoint
+        return '<no route>'
+
+
+class _Capture:
+    kind = None
+
+    def __init__(self, directory, seconds):
+        self.directory = directory
+        self.seconds = seconds
+        self.started = datetime.utcnow()
+        self.prefix = os.path.join(directory, f'{self.kind}-{os.getpid()}-{self.started.strftime("%Y%m%dT%H%M%S")}')
+        self.done = threading.Event()
+        self.files = []
+
+    def info(self):
+        return {
+            'kind': self.kind,
+            'pid': os.getpid(),
+            'seconds': self.seconds,
+            'started_at': self.started.isoformat(),
+            'files': [os.path.basename(path) for path in self.files] or [
+                os.path.basename(self.prefix + suffix) for suffix in self.SUFFIXES],
+        }
+
+    def _write(self, suffix, text):
+        path = self.prefix + suffix
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+        self.files.append(path)
+
+
+class CpuCapture(_Capture):
+    """采样式 CPU 分析：后台线程按固定间隔读取各线程的调用栈
+
+    输出折叠栈格式（<路由>;<帧>;...;<帧> <次数>），可用 flamegraph.pl 或 speedscope 查看；
+    每个栈以处理中的路由为根，空闲的 worker 归入 <idle>
+    """
+
+    kind = 'cpu'
+    SUFFIXES = ('.folded', '.txt')
+
+    def __init__(self, directory, seconds, interval=DEFAULT_INTERVAL):
+        super().__init__(directory, seconds)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+
+    def run(self):
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self.done.wait(self.interval) and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                route = _frame_route(frame)
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f'{code.co_name} ({_short_path(code.co_filename)})')
+                    frame = frame.f_back
+                names.append(route)
+                self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+        self.finish()
+
+    def finish(self):
+        self._write('.folded', ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common()))
+
+        routes = Counter()
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            routes[frames[0]] += count
+            if frames[0] != '<idle>':
+                leaves[frames[-1]] += count
+        total = sum(routes.values()) or 1
+        lines = [f'CPU 采样 pid={os.getpid()} 开始于 {self.started.isoformat()} 时长 {self.seconds}s '
+                 f'间隔 {self.interval * 1000:g}ms 采样 {self.samples} 次', '', '按路由：']
+        lines += [f'  {count / total:7.2%}  {count:8d}  {route}' for route, count in routes.most_common()]
+        lines += ['', '处理请求时占用最多的函数（自身）：']
+        lines += [f'  {count / total:7.2%}  {count:8d}  {leaf}' for leaf, count in leaves.most_common(REPORT_LIMIT)]
+        self._write('.txt', '\n'.join(lines) + '\n')
+
+
+class MemoryCapture(_Capture):
+    """tracemalloc 快照对比：采集开始时启动跟踪，结束时仍未释放的分配按调用位置和路由汇总
+
+    结束快照保存为 .tracemalloc，可用 tracemalloc.Snapshot.load 离线分析
+    """
+
+    kind = 'memory'
+    SUFFIXES = ('.tracemalloc', '.txt')
+
+    def __init__(self, directory, seconds, views):
+        super().__init__(directory, seconds)
+        self.views = views
+        self.was_tracing = tracemalloc.is_tracing()
+
+    def run(self):
+        if not self.was_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            before = tracemalloc.take_snapshot()
+            self.done.wait(self.seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if not self.was_tracing:
+                tracemalloc.stop()
+        self.finish(before, after)
+
+    def finish(self, before, after):
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ]
+        before = before.filter_traces(filters)
+        after = after.filter_traces(filters)
+        after.dump(self.prefix + '.tracemalloc')
+        self.files.append(self.prefix + '.tracemalloc')
+
+        diffs = [d for d in after.compare_to(before, 'traceback') if d.size_diff > 0]
+        routes = Counter()
+        for diff in diffs:
+            routes[self.views.route(diff.traceback)] += diff.size_diff
+
+        lines = [f'内存增长 pid={os.getpid()} 开始于 {self.started.isoformat()} 时长 {self.seconds}s',
+                 f'跟踪到的内存 {sum(s.size for s in before.statistics("filename")) / 1024:.1f} KiB -> '
+                 f'{sum(s.size for s in after.statistics("filename")) / 1024:.1f} KiB', '', '按路由：']
+        lines += [f'  {size / 1024:12.1f} KiB  {route}' for route, size in routes.most_common()]
+        lines += ['', f'增长最多的 {REPORT_LIMIT} 个分配位置（调用栈从外到内）：']
+        for diff in diffs[:REPORT_LIMIT]:
+            lines.append('')
+            lines.append(f'+{diff.size_diff / 1024:.1f} KiB  +{diff.count_diff} 块  路由 {self.views.route(diff.traceback)}')
+            for frame in diff.traceback:
+                lines.append(f'    {_short_path(frame.filename)}:{frame.lineno}  '
+                             f'{linecache.getline(frame.filename, frame.lineno).strip()}')
+        self._write('.txt', '\n'.join(lines) + '\n')
+
+
+class Profiler:
+    """本进程的按需采集，每种类型同一时间只有一个；未采集时不注册任何钩子，没有额外开销"""
+
+    def __init__(self, app, directory):
+        self.app = app
+        self.views = None
+        self.directory = directory
+        self.active = {}
+        # 信号处理函数在主线程中调用 start，可能打断正持有锁的同一线程
+        self.lock = threading.RLock()
+
+    def start(self, kind, seconds, interval=DEFAULT_INTERVAL):
+        """在后台线程中开始采集，已有同类采集在进行时返回None"""
+        seconds = max(1, min(int(seconds), MAX_SECONDS))
+        with self.lock:
+            current = self.active.get(kind)
+            if current is not None and not current.done.is_set():
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            if self.views is None:
+                # 创建应用时蓝图还没有注册，第一次采集时再建立索引
+                self.views = ViewIndex(self.app)
+            if kind == 'cpu':
+                interval = float(interval)
+                interval = min(max(interval, 0.001), 1.0) if math.isfinite(interval) else DEFAULT_INTERVAL
+                capture = CpuCapture(self.directory, seconds, interval)
+            else:
+                capture = MemoryCapture(self.directory, seconds, self.views)
+            self.active[kind] = capture
+
+        def run():
+            try:
+                capture.run()
+            finally:
+                capture.done.set()
+
+        threading.Thread(target=run, name=f'profile-{kind}', daemon=True).start()
+        return capture.info()
+
+    def running(self):
+        with self.lock:
+            return [capture.info() for capture in self.active.values() if not capture.done.is_set()]
+
+    def stop_all(self, timeout=5):
+        """提前结束所有采集并写出结果，worker 退出时调用"""
+        with self.lock:
+            captures = list(self.active.values())
+        for capture in captures:
+            capture.done.set()
+        for thread in threading.enumerate():
+            if thread.name.startswith('profile-'):
+                thread.join(timeout)
+
+    def _request_path(self, pid):
+        return os.path.join(self.directory, 'requests', f'{pid}.json')
+
+    def signal_worker(self, pid, kind, seconds, interval=DEFAULT_INTERVAL):
+        """让同一 gunicorn 主进程下的另一个 worker 开始采集：写入请求文件后发送信号"""
+        if PROFILE_SIGNAL is None:
+            raise ValueError('当前平台不支持向其他 worker 发送采集请求')
+        if pid not in sibling_workers():
+            raise ValueError(f'{pid} 不是当前服务的 worker 进程')
+        path = self._request_path(pid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'kind': kind, 'seconds': seconds, 'interval': interval}, f)
+        os.replace(path + '.tmp', path)
+        os.kill(pid, PROFILE_SIGNAL)
+
+    def _handle_signal(self, signum, frame):
+        path = self._request_path(os.getpid())
+        try:
+            with open(path, encoding='utf-8') as f:
+                params = json.load(f)
+            os.remove(path)
+        except (OSError, ValueError):
+            return
+        if params.get('kind') in KINDS:
+            self.start(params['kind'], params.get('seconds', 30), params.get('interval', DEFAULT_INTERVAL))
+
+    def captures(self):
+        """目录中已写出的采集结果"""
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(KINDS) and not name.endswith('.tmp') and os.path.isfile(path):
+                st = os.stat(path)
+                result.append({'name': name, 'size': st.st_size,
+                               'modified_at': datetime.utcfromtimestamp(st.st_mtime).isoformat()})
+        return sorted(result, key=lambda item: item['modified_at'], reverse=True)
+
+
+def sibling_workers():
+    """与当前进程同属一个 gunicorn 主进程的 worker（含自身），非 Linux 或直接运行时只有自身"""
+    ppid = os.getppid()
+    try:
+        with open(f'/proc/{ppid}/task/{ppid}/children', encoding='ascii') as f:
+            pids = {int(pid) for pid in f.read().split()}
+    except (OSError, ValueError):
+        pids = set()
+    return pids | {os.getpid()}
+
+
+_profiler = None
+
+
+def get_profiler():
+    return _profiler
+
+
+def init_profiling(app):
+    """按需采集 CPU 和内存，结果写入 PROFILE_DIR；默认关闭（PROFILING_ENABLED）"""
+    global _profiler
+    if not app.config.get('PROFILING_ENABLED', False):
+        return
+    _profiler = Profiler(app, app.config.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'profiles'))
+
+
+def install_signal_handler():
+    """在 worker 进程中安装采集信号处理函数，由 gunicorn post_worker_init 调用"""
+    if _profiler is not None and PROFILE_SIGNAL is not None:
+        signal.signal(PROFILE_SIGNAL, _profiler._handle_signal)
+
+
+def stop_profiling():
+    """worker 退出前写出进行中的采集，由 gunicorn worker_exit 调用"""
+    if _profiler is not None:
+        _profiler.stop_all()
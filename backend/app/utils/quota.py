@@ -0,0 +1,127 @@
+from functools import wraps
+from collections import defaultdict
+from flask import request, jsonify
+from flask_login import current_user
+from app.models import User, File, db
+from app.utils.permissions import PermissionManager
+
+# multipart 请求中表单字段和分隔符的开销，预检时从 Content-Length 中扣除
+MULTIPART_ALLOWANCE = 64 * 1024
+
+QUOTA_EXCEEDED = '存储空间不足'
+
+
+class QuotaManager:
+    """存储配额管理"""
+
+    @staticmethod
+    def get_quota(user):
+        """用户的存储配额（字节），None 表示不限；多个角色时取最大值"""
+        if user.is_admin:
+            return None
+        if user.storage_quota is not None:
+            return user.storage_quota
+
+        quotas = [PermissionManager.ROLE_QUOTAS[r.name] for r in user.roles
+                  if r.name in PermissionManager.ROLE_QUOTAS]
+        if not quotas:
+            return PermissionManager.ROLE_QUOTAS['user']
+        if any(q is None for q in quotas):
+            return None
+        return max(quotas)
+
+    @staticmethod
+    def usage(user):
+        """配额使用情况"""
+        quota = QuotaManager.get_quota(user)
+        return {
+            'used': user.storage_used,
+            'quota': quota,
+            'remaining': None if quota is None else max(0, quota - user.storage_used)
+        }
+
+    @staticmethod
+    def has_room(user, size):
+        """是否还能存放 size 字节（不加锁，仅用于预检）"""
+        quota = QuotaManager.get_quota(user)
+        return quota is None or user.storage_used + max(0, size) <= quota
+
+    @staticmethod
+    def reserve(user, size):
+        """在当前事务中增加用量，超出配额时不修改并返回False，由调用方提交或回滚"""
+        quota = QuotaManager.get_quota(user)
+        stmt = db.update(User).where(User.id == user.id)
+        if quota is not None:
+            # 条件更新，并发上传不会越过配额
+            stmt = stmt.where(User.storage_used + size <= quota)
+        result = db.session.execute(
+            stmt.values(storage_used=User.storage_used + size),
+            execution_options={'synchronize_session': False}
+        )
+        return result.rowcount == 1
+
+    @staticmethod
+    def apply_deltas(rows, sign):
+        """按 (uploaded_by, file_size) 行汇总后在当前事务中调整用量，sign 为 1 或 -1"""
+        deltas = defaultdict(int)
+        for row in rows:
+            deltas[row.uploaded_by] += sign * (row.file_size or 0)
+
+        params = [{'b_id': uid, 'b_delta': delta} for uid, delta in deltas.items() if delta]
+        if not params:
+            return
+
+        table = User.__table__
+        new_value = table.c.storage_used + db.bindparam('b_delta')
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('b_id')).values(
+                storage_used=db.case((new_value > 0, new_value), else_=0)
+            ),
+            params
+        )
+
+    @staticmethod
+    def reconcile(user_ids=None, fix=False):
+        """按文件记录重新计算用量，返回 [(user_id, 记录值, 实际值)]，fix 时修正偏差"""
+        actual = db.session.query(
+            File.uploaded_by,
+            db.func.coalesce(db.func.sum(File.file_size), 0)
+        ).filter(File.deleted_at.is_(None))
+        users = db.session.query(User.id, User.storage_used)
+        if user_ids is not None:
+            actual = actual.filter(File.uploaded_by.in_(user_ids))
+            users = users.filter(User.id.in_(user_ids))
+        totals = dict(actual.group_by(File.uploaded_by).all())
+
+        drift = [(uid, used, int(totals.get(uid, 0))) for uid, used in users
+                 if used != int(totals.get(uid, 0))]
+
+        if fix and drift:
+            # 用关联子查询在数据库中重算，避免覆盖统计期间发生的上传和删除
+            table = User.__table__
+            files = File.__table__
+            recount = db.select(db.func.coalesce(db.func.sum(files.c.file_size), 0)).where(
+                files.c.uploaded_by == table.c.id,
+                files.c.deleted_at.is_(None)
+            ).scalar_subquery()
+            try:
+                db.session.execute(table.update().where(
+                    table.c.id.in_([uid for uid, _, _ in drift])
+                ).values(storage_used=recount))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        return drift
+
+
+def require_storage_quota(f):
+    """根据 Content-Length 预检配额，超出时在读取请求体之前拒绝"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method == 'POST' and request.content_length:
+            if not QuotaManager.has_room(current_user, request.content_length - MULTIPART_ALLOWANCE):
+                return jsonify({'error': QUOTA_EXCEEDED, **QuotaManager.usage(current_user)}), 413
+        return f(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,201 @@
+import os
+import math
+import mmap
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+from functools import wraps
+from flask import request, jsonify, session, current_app
+from app.utils.security import SecurityManager
+from app.utils.metrics import RATE_LIMITED
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境退化为进程内限流
+    fcntl = None
+
+# 规则名: [(维度, 桶容量, 从空到满所需秒数)]
+# 维度 ip - 客户端IP，user - 登录用户（未登录时按IP），username - 登录请求中提交的用户名
+RATE_LIMITS = {
+    'login': [('ip', 20, 60), ('username', 10, 300)],
+    'register': [('ip', 5, 3600)],
+    'upload': [('user', 30, 60), ('ip', 60, 60)],
+    'download': [('user', 120, 60), ('ip', 300, 60)],
+    'archive': [('user', 10, 60)],
+    'bulk': [('user', 60, 60)],
+    # 版本分块上传，一个新版本可能需要上传数百个分块
+    'chunk': [('user', 600, 60)],
+}
+
+
+def _bucket_hash(key):
+    value = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value or 1
+
+
+class MemoryBucketStore:
+    """进程内令牌桶，仅用于单进程开发环境"""
+
+    def __init__(self, max_keys=65536):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, take=True):
+        """取一个令牌，返回 (是否允许, 需等待秒数)；take=False 时只检查不取"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed and take:
+                tokens -= 1
+            if len(self.buckets) >= self.max_keys and key not in self.buckets:
+                self.buckets.clear()
+            self.buckets[key] = (tokens, now)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class SharedBucketStore:
+    """共享内存中的定长令牌桶表，同一台机器上的所有 worker 进程共用
+
+    表按 stripes 分段，每段由一个 fcntl 字节锁保护；键哈希后在段内线性探测，
+    探测窗口满时复用最久未更新的桶（已补满的桶与新桶等价）
+    """
+
+    SLOT = struct.Struct('<Qdd')  # 键哈希, 剩余令牌, 更新时间
+
+    def __init__(self, path, slots=65536, stripes=64, probe=8):
+        self.stripes = stripes
+        self.stripe_slots = slots // stripes
+        self.probe = min(probe, self.stripe_slots)
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+        size = self.stripe_slots * stripes * self.SLOT.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size != size:
+            os.ftruncate(self.fd, 0)
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+
+    def consume(self, key, capacity, rate, take=True):
+        """取一个令牌，返回 (是否允许, 需等待秒数)；take=False 时只检查不取"""
+        h = _bucket_hash(key)
+        stripe = h % self.stripes
+        start = (h // self.stripes) % self.stripe_slots
+        base = stripe * self.stripe_slots
+        # CLOCK_MONOTONIC 在同一台机器的各进程间一致
+        now = time.monotonic()
+
+        with self.locks[stripe]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                target = None
+                stalest = None
+                for i in range(self.probe):
+                    offset = (base + (start + i) % self.stripe_slots) * self.SLOT.size
+                    slot_key, tokens, updated = self.SLOT.unpack_from(self.map, offset)
+                    if slot_key == h:
+                        target = (offset, tokens, updated)
+                        break
+                    if slot_key == 0:
+                        target = (offset, capacity, now)
+                        break
+                    if stalest is None or updated < stalest[2]:
+                        stalest = (offset, capacity, updated)
+
+                if target is None:
+                    target = (stalest[0], capacity, now)
+
+                offset, tokens, updated = target
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                allowed = tokens >= 1
+                if allowed and take:
+                    tokens -= 1
+                self.SLOT.pack_into(self.map, offset, h, tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+_store = None
+
+
+def _default_shm_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'resource-sharing-ratelimit')
+
+
+def init_rate_limit(app):
+    """创建限流存储；preload_app 时在主进程中映射，fork 出的 worker 共用同一块内存"""
+    global _store
+    if not app.config.get('RATELIMIT_ENABLED', True):
+        return
+
+    if app.config.get('RATELIMIT_STORAGE', 'shm') == 'shm' and fcntl is not None:
+        _store = SharedBucketStore(app.config.get('RATELIMIT_SHM_PATH') or _default_shm_path())
+    else:
+        _store = MemoryBucketStore()
+
+
+def _identity(scope):
+    """限流维度对应的标识，只读取请求头和会话，不访问数据库"""
+    ip = SecurityManager.get_client_ip()
+    if scope == 'ip':
+        return ip
+    if scope == 'user':
+        user_id = session.get('_user_id')
+        return f'u{user_id}' if user_id else f'ip{ip}'
+    if scope == 'username':
+        data = request.get_json(silent=True) or {}
+        username = data.get('username') if isinstance(data, dict) else None
+        return username.strip().lower() if isinstance(username, str) and username.strip() else None
+    raise ValueError(f'未知的限流维度: {scope}')
+
+
+def check_rate_limit(rule):
+    """先检查规则的所有维度，全部未超限时才各取一个令牌；返回需等待的秒数，未超限时返回0
+
+    被拒绝的请求不消耗任何维度的令牌，避免被限流的客户端继续耗尽其他维度（如目标用户名）的桶
+    """
+    global _store
+    if _store is None:
+        _store = MemoryBucketStore()
+
+    buckets = []
+    for scope, capacity, period in RATE_LIMITS[rule]:
+        ident = _identity(scope)
+        if ident is not None:
+            buckets.append((scope, f'{rule}:{scope}:{ident}', capacity, capacity / period))
+
+    retry_after = 0
+    for take in (False, True):
+        for scope, key, capacity, rate in buckets:
+            allowed, wait = _store.consume(key, capacity, rate, take)
+            if not allowed:
+                RATE_LIMITED.labels(rule, scope).inc()
+                retry_after = max(retry_after, wait)
+        if retry_after:
+            break
+    return retry_after
+
+
+def rate_limit(rule, methods=None):
+    """限流装饰器，需放在 login_required 之前，使超限请求不触发用户加载等数据库查询"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if (current_app.config.get('RATELIMIT_ENABLED', True)
+                    and (methods is None or request.method in methods)):
+                retry_after = check_rate_limit(rule)
+                if retry_after:
+                    response = jsonify({'error': '请求过于频繁，请稍后再试'})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                    return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -1,11 +1,13 @@
 import os
 import re
+import json
 import hashlib
 import secrets
 from functools import wraps
 from datetime import datetime
 from flask import request, jsonify
 from app.models import AccessLog, db
+from app.utils.metrics import elapsed_ms
 
 class SecurityManager:
     """安全管理器 - 防SQL注入和日志记录"""
@@ -94,6 +96,12 @@ class SecurityManager:
         ip_address = SecurityManager.get_client_ip()
         user_agent = request.headers.get('User-Agent', '')
         
+        if response_time is None:
+            response_time = elapsed_ms()
+        
+        if isinstance(details, dict):
+            details = json.dumps(details, ensure_ascii=False)
+        
         AccessLog.log_access(
             user_id=user_id,
             ip_address=ip_address,
@@ -0,0 +1,96 @@
+import os
+import re
+import hmac
+import time
+import base64
+import hashlib
+import logging
+from urllib.parse import quote, urlencode
+from flask import current_app
+
+# /dl/<file_id>/<相对路径> 或绑定用户的 /dl/u/<user_id>/<file_id>/<相对路径>
+LINK_PATTERN = re.compile(r'^/dl/(?:u/(?P<user_id>\d+)/)?(?P<file_id>\d+)/(?P<rel_path>.+)$')
+
+_accounting_logger = None
+
+
+class DownloadLinks:
+    """签名下载链接
+
+    签名与 Nginx secure_link_md5 "$secure_link_expires$uri$arg_n$download_bound_ip $download_link_secret"
+    的计算方式一致，Nginx 和 Flask 都可以在不查询数据库的情况下校验；下载文件名 n 按URL编码后的形式参与签名
+    """
+
+    @staticmethod
+    def secret():
+        return current_app.config.get('DOWNLOAD_LINK_SECRET')
+
+    @staticmethod
+    def signature(expires, uri, bound_ip='', filename=None):
+        encoded_name = quote(filename, safe='') if filename else ''
+        raw = f"{expires}{uri}{encoded_name}{bound_ip} {DownloadLinks.secret()}".encode('utf-8')
+        return base64.urlsafe_b64encode(hashlib.md5(raw).digest()).rstrip(b'=').decode('ascii')
+
+    @staticmethod
+    def create(file_record, ttl, filename=None, bind_ip=None, bind_user_id=None):
+        """生成签名链接，返回 (相对URL, 过期时间戳)"""
+        from app.utils.file_utils import FileUtils
+
+        root = os.path.abspath(FileUtils.storage_root())
+        path = os.path.abspath(FileUtils.resolve_path(file_record))
+        if not path.startswith(root + os.sep):
+            raise ValueError('文件不在上传目录中')
+        rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+
+        prefix = f'/dl/u/{bind_user_id}' if bind_user_id else '/dl'
+        uri = f'{prefix}/{file_record.id}/{rel_path}'
+        expires = int(time.time() + ttl)
+
+        params = {'e': expires, 's': DownloadLinks.signature(expires, uri, bind_ip or '', filename)}
+        if bind_ip:
+            params['ip'] = 1
+        if filename:
+            params['n'] = filename
+        return f"{quote(uri)}?{urlencode(params, quote_via=quote)}", expires
+
+    @staticmethod
+    def parse(uri):
+        """解析链接路径，返回 (user_id, file_id, rel_path)，格式不符时返回None"""
+        match = LINK_PATTERN.match(uri)
+        if not match:
+            return None
+        user_id = match.group('user_id')
+        return int(user_id) if user_id else None, int(match.group('file_id')), match.group('rel_path')
+
+    @staticmethod
+    def verify(uri, expires, signature, client_ip=None, filename=None):
+        """校验签名，返回 'ok'、'expired' 或 'invalid'"""
+        if not DownloadLinks.secret() or not signature or not expires or not expires.isdigit():
+            return 'invalid'
+        bound_ip = client_ip or ''
+        if not hmac.compare_digest(DownloadLinks.signature(expires, uri, bound_ip, filename), signature):
+            return 'invalid'
+        if int(expires) < time.time():
+            return 'expired'
+        return 'ok'
+
+    @staticmethod
+    def record_download(status, file_id, user_id, ip, range_header, body_bytes):
+        """写一行与 Nginx download_accounting 格式相同的记录，由 import_download_log.py 异步入库"""
+        global _accounting_logger
+        if _accounting_logger is None:
+            path = current_app.config.get('DOWNLOAD_ACCOUNTING_LOG')
+            if not path:
+                return
+            logger = logging.getLogger('download_accounting')
+            logger.propagate = False
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            _accounting_logger = logger
+
+        _accounting_logger.info(
+            f'{time.time():.3f} {status} {file_id} {user_id or "-"} {ip} '
+            f'"{range_header or "-"}" {body_bytes if body_bytes is not None else "-"}'
+        )
@@ -0,0 +1,352 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_THRESHOLD_MS = 200
+DEFAULT_MAX_ENTRIES = 200
+# 堆栈摘录保留的应用内调用帧数
+STACK_DEPTH = 6
+# 归一化后的SQL最多保留的字符数
+MAX_SQL_LENGTH = 4000
+# 记录目录中保存最近一次清空时间的文件，各 worker 据此丢弃清空前的记录
+RESET_MARKER = 'reset-at'
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SKIP_FRAMES = (os.path.abspath(__file__),)
+
+# 只对这些语句执行 EXPLAIN（MySQL 和 SQLite 的 EXPLAIN 都不会真正执行语句）
+_EXPLAINABLE = re.compile(r'^\s*(select|with|update|delete)\b', re.IGNORECASE)
+
+_NORMALIZE_RULES = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),  # 字符串字面量
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # 数字字面量
+    (re.compile(r'%\([^)]+\)s|%s|:\w+|\?'), '?'),  # 各驱动的占位符
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?+)'),  # IN 列表展开后的多个占位符
+    (re.compile(r'\(\?\+?\)(?:\s*,\s*\(\?\+?\))+'), '(?+), ...'),  # 多行 VALUES
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize(statement):
+    """去掉字面量和参数后的SQL，参数不同的同一查询得到相同结果"""
+    text = statement.strip()
+    for pattern, replacement in _NORMALIZE_RULES:
+        text = pattern.sub(replacement, text)
+    return text[:MAX_SQL_LENGTH]
+
+
+def fingerprint(normalized):
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _stack_excerpt():
+    """调用方在应用代码中的最近几帧，跳过 SQLAlchemy、Flask 等库内部"""
+    frames = []
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename in _SKIP_FRAMES or not filename.startswith(_APP_ROOT):
+            continue
+        frames.append(f'{os.path.relpath(filename, _APP_ROOT)}:{frame.lineno} in {frame.name}')
+        if len(frames) >= STACK_DEPTH:
+            break
+    return frames
+
+
+def _route():
+    if has_request_context():
+        return f'{request.method} {request.endpoint or "<unmatched>"}'
+    return f'<script:{os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"}>'
+
+
+def _plain(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', 'replace')
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+class SlowQueryLog:
+    """进程内按指纹去重的慢查询记录，超出容量时淘汰最久未出现的指纹
+
+    新指纹由后台线程用独立连接执行 EXPLAIN（SQLite 为 EXPLAIN QUERY PLAN），不阻塞请求；
+    后台线程同时把当前记录写到 directory 下以进程ID命名的文件，/admin/slow-queries 合并所有 worker 的文件。
+    只保存归一化的SQL，参数仅在内存中保留到 EXPLAIN 完成
+    """
+
+    def __init__(self, threshold_ms=DEFAULT_THRESHOLD_MS, max_entries=DEFAULT_MAX_ENTRIES,
+                 explain=True, directory=None):
+        self.threshold = threshold_ms / 1000
+        self.max_entries = max_entries
+        self.explain = explain
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = queue.Queue(maxsize=1000)
+        self.local = threading.local()
+        self.thread = None
+        self.pid = os.getpid()
+        self.reset_seen = ''
+
+    def _after_fork(self):
+        # fork 后的子进程不继承父进程的记录、队列和后台线程
+        if self.pid != os.getpid():
+            self.entries = OrderedDict()
+            self.lock = threading.Lock()
+            self.pending = queue.Queue(maxsize=1000)
+            self.thread = None
+            self.pid = os.getpid()
+
+    def observe(self, conn, statement, parameters, elapsed, executemany):
+        if elapsed < self.threshold or getattr(self.local, 'explaining', False):
+            return
+        self._after_fork()
+        normalized = normalize(statement)
+        key = fingerprint(normalized)
+        ms = round(elapsed * 1000, 2)
+        route = _route()
+        now = datetime.utcnow().isoformat()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            new = entry is None
+            if new:
+                entry = {
+                    'fingerprint': key,
+                    'sql': normalized,
+                    'dialect': conn.dialect.name,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'first_seen': now,
+                    'routes': {},
+                    'explain': None,
+                    'explain_error': None,
+                }
+                self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(key)
+            entry['count'] += 1
+            entry['total_ms'] = round(entry['total_ms'] + ms, 2)
+            entry['last_seen'] = now
+            if route in entry['routes'] or len(entry['routes']) < 10:
+                entry['routes'][route] = entry['routes'].get(route, 0) + 1
+            if ms >= entry['max_ms']:
+                # 保留最慢一次的调用位置
+                entry['max_ms'] = ms
+                entry['sample'] = {'ms': ms, 'route': route, 'at': now, 'stack': _stack_excerpt()}
+
+        explain = new and self.explain and not executemany and _EXPLAINABLE.match(statement)
+        task = (key, conn.engine, statement, parameters) if explain else None
+        self._submit(task)
+
+    def _submit(self, task):
+        """交给后台线程：task 为需要 EXPLAIN 的查询，为None时只写出记录"""
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, name='slow-query-explain', daemon=True)
+                    self.thread.start()
+        try:
+            self.pending.put_nowait(task)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            tasks = [self.pending.get()]
+            while True:
+                try:
+                    tasks.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            for task in tasks:
+                if task is not None:
+                    self._explain(*task)
+            self._dump()
+
+    def _explain(self, key, engine, statement, parameters):
+        prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+        self.local.explaining = True
+        try:
+            with engine.connect() as conn:
+                result = conn.exec_driver_sql(prefix + statement, parameters or ())
+                plan = [{k: _plain(v) for k, v in row.items()} for row in result.mappings()]
+                conn.rollback()
+            error = None
+        except Exception as e:
+            plan, error = None, str(e)[:500]
+        finally:
+            self.local.explaining = False
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['explain'] = plan
+                entry['explain_error'] = error
+
+    def _reset_marker(self):
+        """最近一次清空的时间（ISO格式），没有清空过时返回空字符串"""
+        if not self.directory:
+            return ''
+        try:
+            with open(os.path.join(self.directory, RESET_MARKER), encoding='utf-8') as f:
+                return f.read().strip()
+        except OSError:
+            return ''
+
+    def _apply_reset(self):
+        # 其他 worker 清空记录后，丢弃本进程中此后没有再出现的指纹
+        marker = self._reset_marker()
+        if marker > self.reset_seen:
+            with self.lock:
+                for key in [key for key, entry in self.entries.items() if entry['last_seen'] < marker]:
+                    del self.entries[key]
+            self.reset_seen = marker
+        return marker
+
+    def snapshot(self):
+        self._after_fork()
+        self._apply_reset()
+        with self.lock:
+            return json.loads(json.dumps(list(self.entries.values())))
+
+    def _path(self, pid=None):
+        return os.path.join(self.directory, f'slow-queries-{pid or os.getpid()}.json')
+
+    def _dump(self):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path()
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def collect(self):
+        """合并所有 worker 写出的记录和本进程的当前记录"""
+        files = {}
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.startswith('slow-queries-') and name.endswith('.json'):
+                    try:
+                        with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                            files[name] = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+        # 本进程的记录以内存为准，文件可能还没写出最新内容
+        files[os.path.basename(self._path())] = self.snapshot()
+        marker = self._reset_marker()
+
+        merged = {}
+        for entries in files.values():
+            for entry in entries:
+                if entry['last_seen'] < marker:
+                    continue  # 与清空同时写出的旧记录
+                current = merged.get(entry['fingerprint'])
+                if current is None:
+                    merged[entry['fingerprint']] = entry
+                    continue
+                current['count'] += entry['count']
+                current['total_ms'] = round(current['total_ms'] + entry['total_ms'], 2)
+                current['first_seen'] = min(current['first_seen'], entry['first_seen'])
+                current['last_seen'] = max(current['last_seen'], entry['last_seen'])
+                for route, count in entry['routes'].items():
+                    current['routes'][route] = current['routes'].get(route, 0) + count
+                if entry['max_ms'] > current['max_ms']:
+                    current['max_ms'] = entry['max_ms']
+                    current['sample'] = entry.get('sample')
+                if current['explain'] is None and entry['explain'] is not None:
+                    current['explain'] = entry['explain']
+                    current['explain_error'] = None
+        for entry in merged.values():
+            entry['avg_ms'] = round(entry['total_ms'] / entry['count'], 2) if entry['count'] else 0.0
+        return list(merged.values())
+
+    def reset(self):
+        """清空所有 worker 的记录：写入清空时间，各 worker 写出记录前据此丢弃旧记录"""
+        marker = datetime.utcnow().isoformat()
+        with self.lock:
+            self.entries.clear()
+        self.reset_seen = marker
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, RESET_MARKER)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(marker)
+            os.replace(path + '.tmp', path)
+            for name in os.listdir(self.directory):
+                if name.startswith('slow-queries-'):
+                    os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+
+_log = None
+
+
+def _default_directory():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'resource-sharing-slow-queries')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._slow_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_slow_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if _log is not None:
+        _log.observe(conn, statement, parameters, elapsed, executemany)
+
+
+def get_slow_query_log():
+    """未启用时返回None"""
+    return _log
+
+
+def init_slow_queries(app):
+    """记录超过阈值的SQL语句，默认关闭（SLOW_QUERY_ENABLED）"""
+    global _log
+    if not app.config.get('SLOW_QUERY_ENABLED', False):
+        return
+
+    _log = SlowQueryLog(
+        threshold_ms=float(app.config.get('SLOW_QUERY_THRESHOLD_MS', DEFAULT_THRESHOLD_MS)),
+        max_entries=int(app.config.get('SLOW_QUERY_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        explain=app.config.get('SLOW_QUERY_EXPLAIN', True),
+        directory=app.config.get('SLOW_QUERY_DIR') or _default_directory(),
+    )
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def reset_slow_queries():
+    """gunicorn 主进程启动时清除上次运行的记录"""
+    if _log is not None:
+        _log.reset()
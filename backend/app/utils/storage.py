@@ -0,0 +1,337 @@
+import os
+import uuid
+import shutil
+import threading
+import unicodedata
+from datetime import datetime
+from collections import deque, namedtuple
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import current_app, has_app_context
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # 只使用本地存储时不需要
+    boto3 = None
+
+StoredObject = namedtuple('StoredObject', 'size modified etag')
+
+CHUNK_SIZE = 1024 * 1024
+
+# S3 分片上传要求除最后一片外每片至少 5MB
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def _setting(name, default):
+    if has_app_context():
+        value = current_app.config.get(name)
+        if value is not None:
+            return value
+    return os.getenv(name, default)
+
+
+class StorageBackend:
+    """文件存储后端；key 为相对路径，如 <user_id>/ab/cd/<filename>"""
+
+    name = None
+
+    def put_stream(self, key, stream, content_type=None):
+        """从可读流写入对象，返回写入的字节数"""
+        raise NotImplementedError
+
+    def get_range_stream(self, key, start=0, length=None):
+        """按块读取 [start, start+length) 的内容，length 为空时读到末尾"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """删除对象，对象不存在视为成功"""
+        raise NotImplementedError
+
+    def stat(self, key):
+        """返回 StoredObject，对象不存在时返回None"""
+        raise NotImplementedError
+
+    def presign(self, key, expires, filename=None):
+        """生成可直接下载的临时URL，不支持时返回None"""
+        return None
+
+    def local_path(self, key):
+        """对象在本机磁盘上的路径，不在本机时返回None"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """本地磁盘（或共享卷）存储"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f'非法的存储路径: {key}')
+        return path
+
+    def put_stream(self, key, stream, content_type=None):
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return os.path.getsize(path)
+
+    def get_range_stream(self, key, start=0, length=None):
+        with open(self.local_path(key), 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def stat(self, key):
+        try:
+            st = os.stat(self.local_path(key))
+        except FileNotFoundError:
+            return None
+        return StoredObject(st.st_size, datetime.utcfromtimestamp(st.st_mtime), None)
+
+
+class S3Storage(StorageBackend):
+    """S3 兼容存储（AWS S3、MinIO 等）
+
+    大文件分片并行上传，按范围并行下载；同时在途的分片数不超过 concurrency，
+    单个请求的内存占用约为 concurrency * part_size
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 part_size=16 * 1024 * 1024, concurrency=4):
+        if boto3 is None:
+            raise RuntimeError('使用S3存储需要安装 boto3')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url or None
+        self.region = region or None
+        self.part_size = max(int(part_size), S3_MIN_PART_SIZE)
+        self.concurrency = max(int(concurrency), 1)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._executor = None
+
+    def _resources(self):
+        # boto3 客户端可在线程间共享，但不能跨 fork 使用
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._client = boto3.client(
+                        's3', endpoint_url=self.endpoint_url, region_name=self.region,
+                        config=BotoConfig(max_pool_connections=self.concurrency * 4,
+                                          retries={'max_attempts': 5, 'mode': 'standard'})
+                    )
+                    self._executor = ThreadPoolExecutor(max_workers=self.concurrency * 2,
+                                                        thread_name_prefix='s3')
+                    self._pid = os.getpid()
+        return self._client, self._executor
+
+    @property
+    def client(self):
+        return self._resources()[0]
+
+    def _key(self, key):
+        return self.prefix + key
+
+    @staticmethod
+    def _read_part(stream, size):
+        """读满一个分片（流的一次 read 可能返回不足的数据）"""
+        parts = []
+        remaining = size
+        while remaining > 0:
+            data = stream.read(min(remaining, CHUNK_SIZE))
+            if not data:
+                break
+            parts.append(data)
+            remaining -= len(data)
+        return b''.join(parts)
+
+    def put_stream(self, key, stream, content_type=None):
+        client, executor = self._resources()
+        extra = {'ContentType': content_type} if content_type else {}
+
+        first = self._read_part(stream, self.part_size)
+        if len(first) < self.part_size:
+            client.put_object(Bucket=self.bucket, Key=self._key(key), Body=first, **extra)
+            return len(first)
+
+        upload_id = client.create_multipart_upload(Bucket=self.bucket, Key=self._key(key), **extra)['UploadId']
+
+        def upload(number, data):
+            result = client.upload_part(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                                        PartNumber=number, Body=data)
+            return {'PartNumber': number, 'ETag': result['ETag']}
+
+        parts, pending = [], set()
+        total, number, data = 0, 1, first
+        try:
+            while data:
+                # 在途分片达到上限时等待，限制内存占用
+                while len(pending) >= self.concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    parts.extend(f.result() for f in done)
+                pending.add(executor.submit(upload, number, data))
+                total += len(data)
+                number += 1
+                data = self._read_part(stream, self.part_size)
+            parts.extend(f.result() for f in pending)
+            parts.sort(key=lambda p: p['PartNumber'])
+            client.complete_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                                             MultipartUpload={'Parts': parts})
+        except Exception:
+            for f in pending:
+                f.cancel()
+            client.abort_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id)
+            raise
+        return total
+
+    def _get_range(self, key, start, length):
+        result = self.client.get_object(Bucket=self.bucket, Key=self._key(key),
+                                        Range=f'bytes={start}-{start + length - 1}')
+        return result['Body'].read()
+
+    def get_range_stream(self, key, start=0, length=None):
+        if length is None:
+            info = self.stat(key)
+            if info is None:
+                raise FileNotFoundError(key)
+            length = max(info.size - start, 0)
+        if length <= 0:
+            return
+
+        if length <= self.part_size:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._key(key),
+                                          Range=f'bytes={start}-{start + length - 1}')['Body']
+            try:
+                for chunk in body.iter_chunks(CHUNK_SIZE):
+                    yield chunk
+            finally:
+                body.close()
+            return
+
+        # 按分片大小并行预取，按顺序输出
+        _, executor = self._resources()
+        end = start + length
+        offsets = iter(range(start, end, self.part_size))
+        queue = deque()
+        try:
+            for offset in offsets:
+                queue.append(executor.submit(self._get_range, key, offset, min(self.part_size, end - offset)))
+                if len(queue) >= self.concurrency:
+                    break
+            while queue:
+                data = queue.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    queue.append(executor.submit(self._get_range, key, offset, min(self.part_size, end - offset)))
+                for i in range(0, len(data), CHUNK_SIZE):
+                    yield data[i:i + CHUNK_SIZE]
+        finally:
+            # 客户端中途断开时取消尚未开始的预取
+            for f in queue:
+                f.cancel()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def stat(self, key):
+        try:
+            result = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return StoredObject(result['ContentLength'], result['LastModified'], result['ETag'].strip('"'))
+
+    def presign(self, key, expires, filename=None):
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if filename:
+            params['ResponseContentDisposition'] = content_disposition(filename)
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=int(expires))
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def content_disposition(filename):
+    """按 RFC 5987 构造附件的 Content-Disposition：ASCII 回退名 + UTF-8 编码的 filename*"""
+    fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    fallback = fallback.replace('\\', '_').replace('"', '_').strip() or 'download'
+    if fallback == filename:
+        return f'attachment; filename="{filename}"'
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(filename, safe="")}'
+
+
+def default_backend_name():
+    """新上传文件使用的存储后端"""
+    return _setting('STORAGE_BACKEND', 'local')
+
+
+def presign_ttl():
+    """对象存储下载重定向到预签名URL时的有效期（秒），为0时由应用转发内容"""
+    return int(_setting('S3_PRESIGN_TTL', 300))
+
+
+def get_backend(name=None):
+    """按名称获取存储后端（按配置缓存）"""
+    from app.utils.file_utils import FileUtils
+
+    name = name or default_backend_name()
+    if name == 'local':
+        cache_key = ('local', FileUtils.storage_root())
+    elif name == 's3':
+        cache_key = ('s3', _setting('S3_BUCKET', None), _setting('S3_PREFIX', ''),
+                     _setting('S3_ENDPOINT_URL', None))
+    else:
+        raise ValueError(f'未知的存储后端: {name}')
+
+    backend = _backends.get(cache_key)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(cache_key)
+            if backend is None:
+                if name == 'local':
+                    backend = LocalStorage(cache_key[1])
+                else:
+                    backend = S3Storage(
+                        bucket=cache_key[1],
+                        prefix=cache_key[2],
+                        endpoint_url=cache_key[3],
+                        region=_setting('S3_REGION', None),
+                        part_size=int(_setting('S3_PART_SIZE', 16 * 1024 * 1024)),
+                        concurrency=int(_setting('S3_CONCURRENCY', 4)),
+                    )
+                _backends[cache_key] = backend
+    return backend
@@ -0,0 +1,124 @@
+import math
+from datetime import datetime, timedelta
+from flask import current_app
+from app.models import File, AccessEntityRollup, db
+
+# 分数的时间原点，修改后需要重建分数
+EPOCH = datetime(2024, 1, 1)
+DEFAULT_HALF_LIFE_HOURS = 72
+
+
+class Trending:
+    """按下载时间指数衰减的热度分数
+
+    一次 t 时刻的下载在 now 时的权重为 2^(-(now - t) / 半衰期)。File.trend_score 保存
+    ln(Σ e^(λ(t - EPOCH)))（前向衰减的对数形式）：所有文件的衰减因子相同，按该列排序即为按当前热度排序，
+    可以直接走索引；新的下载只需在原值上做一次 log-sum-exp，无需重算历史。对数形式不会随时间溢出。
+    没有下载过的文件为NULL
+    """
+
+    @staticmethod
+    def rate():
+        """衰减率 λ（每秒）"""
+        hours = float(current_app.config.get('TRENDING_HALF_LIFE_HOURS', DEFAULT_HALF_LIFE_HOURS))
+        return math.log(2) / (hours * 3600)
+
+    @staticmethod
+    def weight(at=None, count=1):
+        """count 次 at 时刻的下载对应的分数增量（对数形式）"""
+        at = at or datetime.utcnow()
+        return math.log(count) + Trending.rate() * (at - EPOCH).total_seconds()
+
+    @staticmethod
+    def combine(weights):
+        """多个对数形式分数之和，即 ln(Σ e^w)"""
+        top = max(weights)
+        return top + math.log(sum(math.exp(w - top) for w in weights))
+
+    @staticmethod
+    def current(score, now=None):
+        """分数在 now 时的值，约等于衰减后的下载次数"""
+        if score is None:
+            return 0.0
+        now = now or datetime.utcnow()
+        return math.exp(score - Trending.rate() * (now - EPOCH).total_seconds())
+
+    @staticmethod
+    def _add_expression(column, value):
+        """column 与 value 的 log-sum-exp：max + ln(1 + e^(-|差|))，指数部分不大于0"""
+        if db.session.get_bind().dialect.name == 'sqlite':
+            greatest = db.func.max(column, value)
+        else:
+            greatest = db.func.greatest(column, value)
+        combined = greatest + db.func.ln(1 + db.func.exp(-db.func.abs(column - value)))
+        return db.case((column.is_(None), value), else_=combined)
+
+    @staticmethod
+    def record(events):
+        """累加下载事件 [(文件ID, 时间或None)]，在调用方的事务中执行，由调用方提交"""
+        weights = {}
+        for file_id, at in events:
+            weights.setdefault(file_id, []).append(Trending.weight(at))
+        if not weights:
+            return 0
+
+        table = File.__table__
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('b_id')).values(
+                trend_score=Trending._add_expression(table.c.trend_score, db.bindparam('b_score'))
+            ),
+            [{'b_id': file_id, 'b_score': Trending.combine(w)} for file_id, w in weights.items()]
+        )
+        return len(weights)
+
+    @staticmethod
+    def top(projection, names, limit=20, file_type=None):
+        """热度最高的公开文件，返回 (字典列表, 当前分数列表)；带 file_type 时走 ix_file_public_type_trend"""
+        filters = [File.is_public.is_(True), File.deleted_at.is_(None), File.trend_score.isnot(None)]
+        if file_type:
+            filters.append(File.file_type == file_type)
+        files, rows = projection.fetch(names, filters, [File.trend_score.desc(), File.id.desc()], limit,
+                                       extra=[File.trend_score])
+        now = datetime.utcnow()
+        return files, [Trending.current(row[-1], now) for row in rows]
+
+    @staticmethod
+    def rebuild(horizon_days=None, batch_size=5000):
+        """按天汇总表（access_entity_rollup）重算所有分数，修改半衰期或 EPOCH 后使用，不读取原始访问日志
+
+        只统计最近 horizon_days 天（默认10个半衰期，更早的下载权重已不足千分之一），
+        每天的下载按当天中午计；返回有分数的文件数
+        """
+        if horizon_days is None:
+            hours = float(current_app.config.get('TRENDING_HALF_LIFE_HOURS', DEFAULT_HALF_LIFE_HOURS))
+            horizon_days = math.ceil(hours * 10 / 24)
+        since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=horizon_days)
+
+        rows = db.session.query(
+            AccessEntityRollup.entity_id, AccessEntityRollup.bucket, AccessEntityRollup.count
+        ).filter(
+            AccessEntityRollup.kind == 'file',
+            AccessEntityRollup.action == 'download',
+            AccessEntityRollup.resolution == 'd',
+            AccessEntityRollup.bucket >= since,
+            AccessEntityRollup.count > 0
+        ).all()
+
+        weights = {}
+        for file_id, bucket, count in rows:
+            weights.setdefault(file_id, []).append(Trending.weight(bucket + timedelta(hours=12), count))
+        scores = [{'b_id': file_id, 'b_score': Trending.combine(w)} for file_id, w in weights.items()]
+
+        table = File.__table__
+        try:
+            db.session.execute(table.update().where(table.c.trend_score.isnot(None)).values(trend_score=None))
+            statement = table.update().where(table.c.id == db.bindparam('b_id')).values(
+                trend_score=db.bindparam('b_score')
+            )
+            for i in range(0, len(scores), batch_size):
+                db.session.execute(statement, scores[i:i + batch_size])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(scores)
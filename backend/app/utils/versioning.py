@@ -0,0 +1,397 @@
+import io
+import re
+import hashlib
+import logging
+from collections import Counter, namedtuple
+from datetime import datetime
+from app.models import File, FileChunk, FileChunkUpload, FileVersion, FileVersionChunk, User, db
+from app.utils.storage import get_backend, default_backend_name
+from app.utils.facets import FacetCounter
+
+try:
+    import numpy as np
+except ImportError:  # 未安装时逐字节计算，结果相同但慢很多
+    np = None
+
+# 内容分块参数，客户端必须使用相同的参数和算法才能复用已有分块（见 chunking_params）
+CHUNK_MIN = 32 * 1024
+CHUNK_MAX = 1024 * 1024
+# 32位 gear 哈希的高17位全为0时切分，最小长度之后平均约128KB出现一次
+CHUNK_MASK = 0xFFFF8000
+WINDOW = 32
+SCAN_STEP = 64 * 1024
+
+GEAR = [int.from_bytes(hashlib.sha256(b'gear' + bytes([i])).digest()[:4], 'little') for i in range(256)]
+_GEAR_NP = np.array(GEAR, dtype=np.uint32) if np is not None else None
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# 一次请求中允许的分块数
+MAX_CHUNKS_PER_REQUEST = 50000
+
+_Usage = namedtuple('_Usage', 'uploaded_by file_size')
+
+
+def chunking_params():
+    """客户端分块需要的参数"""
+    return {
+        'algorithm': 'gear32',
+        'gear': 'GEAR[i] = uint32_le(sha256(b"gear" + bytes([i]))[:4])',
+        'hash': 'h = ((h << 1) + GEAR[byte]) mod 2^32，每个分块开始时 h = 0',
+        'boundary': f'长度 >= {CHUNK_MIN} 且 (h & 0x{CHUNK_MASK:08X}) == 0 时在当前字节之后切分',
+        'min_size': CHUNK_MIN,
+        'max_size': CHUNK_MAX,
+        'mask': CHUNK_MASK,
+        'digest': 'sha256',
+    }
+
+
+def _first_cut_np(region, offset):
+    g = _GEAR_NP[np.frombuffer(region, dtype=np.uint8)]
+    # h_i = Σ GEAR[b_(i-k)] << k（k < 32），按窗口倍增只需5次向量运算
+    h = g
+    span = 1
+    while span < WINDOW:
+        # 右侧先算出临时数组，原地相加不会读到本轮已更新的值
+        h[span:] += h[:-span] << np.uint32(span)
+        span *= 2
+    hits = np.flatnonzero((h[offset:] & np.uint32(CHUNK_MASK)) == 0)
+    return int(hits[0]) + offset if len(hits) else None
+
+
+def _first_cut_py(region, offset):
+    h = 0
+    for i, byte in enumerate(region):
+        h = ((h << 1) + GEAR[byte]) & 0xFFFFFFFF
+        if i >= offset and not h & CHUNK_MASK:
+            return i
+    return None
+
+
+def find_cut(buf):
+    """buf 从分块起点开始，返回第一个分块的长度"""
+    n = min(len(buf), CHUNK_MAX)
+    if n <= CHUNK_MIN:
+        return n
+    if np is None:
+        # 只需从 CHUNK_MIN 之前 WINDOW 字节开始计算，窗口之外的字节不影响哈希
+        start = CHUNK_MIN - WINDOW
+        index = _first_cut_py(bytes(buf[start:n]), WINDOW - 1)
+        return n if index is None else start + index + 1
+
+    # 分段向量化计算，找到切分点即停止；每段带上前 WINDOW-1 字节作为哈希窗口
+    pos = CHUNK_MIN - 1
+    while pos < n:
+        end = min(pos + SCAN_STEP, n)
+        start = pos - (WINDOW - 1)
+        index = _first_cut_np(bytes(buf[start:end]), WINDOW - 1)
+        if index is not None:
+            return start + index + 1
+        pos = end
+    return n
+
+
+def iter_chunks(blocks):
+    """把按块读取的字节流切分为内容定义的分块，切分位置与读取块大小无关"""
+    pending = bytearray()
+    for block in blocks:
+        pending += block
+        while len(pending) >= CHUNK_MAX:
+            cut = find_cut(pending)
+            yield bytes(pending[:cut])
+            del pending[:cut]
+    while pending:
+        cut = find_cut(pending)
+        yield bytes(pending[:cut])
+        del pending[:cut]
+
+
+def chunk_key(digest):
+    return f'chunks/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def valid_hashes(values):
+    """校验分块哈希列表，返回小写哈希列表，格式不符时返回None"""
+    if not isinstance(values, list) or len(values) > MAX_CHUNKS_PER_REQUEST:
+        return None
+    hashes = [str(v).lower() for v in values]
+    if not all(HASH_PATTERN.match(h) for h in hashes):
+        return None
+    return hashes
+
+
+class VersionStore:
+    """文件版本与分块存储
+
+    上传新版本时客户端按相同算法分块，先查询服务端缺少哪些分块，只上传缺少的分块后提交分块列表。
+    分块按 SHA-256 存放在存储后端的 chunks/ 下，被多个版本共享，引用数为0且超过宽限期的分块由清理任务删除
+    """
+
+    @staticmethod
+    def known_chunks(file_id, user_id, hashes):
+        """hashes 中当前用户可以引用的分块：该文件已有版本中的分块，以及该用户上传过的分块"""
+        known = set()
+        unique = list(set(hashes))
+        for i in range(0, len(unique), 1000):
+            batch = unique[i:i + 1000]
+            known.update(h for (h,) in db.session.query(FileVersionChunk.chunk_hash).join(
+                FileVersion, FileVersion.id == FileVersionChunk.version_id
+            ).filter(FileVersion.file_id == file_id, FileVersionChunk.chunk_hash.in_(batch)).distinct())
+            known.update(h for (h,) in db.session.query(FileChunkUpload.chunk_hash).filter(
+                FileChunkUpload.chunk_hash.in_(batch), FileChunkUpload.user_id == user_id
+            ))
+        return known
+
+    @staticmethod
+    def store_chunk(digest, data, user_id):
+        """校验并保存一个分块，返回是否新写入；内容与哈希不符时抛出 ValueError"""
+        if len(data) > CHUNK_MAX:
+            raise ValueError(f'分块不能超过 {CHUNK_MAX} 字节')
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError('分块内容与哈希不符')
+
+        try:
+            # 锁定分块记录，与清理任务删除同一分块互斥
+            chunk = db.session.query(FileChunk).filter_by(hash=digest).with_for_update().first()
+            now = datetime.utcnow()
+            if chunk is not None:
+                # 已上传过的内容：刷新上传时间，提交前不会被清理任务当作未引用的分块删除
+                chunk.created_at = now
+                created = False
+            else:
+                backend = get_backend(default_backend_name())
+                db.session.add(FileChunk(hash=digest, size=len(data), refcount=0, storage_backend=backend.name,
+                                         created_by=user_id, created_at=now))
+                db.session.flush()
+                backend.put_stream(chunk_key(digest), io.BytesIO(data))
+                created = True
+            # 记为该用户上传，之后可被该用户引用；不影响其他上传过同一内容的用户
+            upload = db.session.get(FileChunkUpload, (digest, user_id))
+            if upload is None:
+                db.session.add(FileChunkUpload(chunk_hash=digest, user_id=user_id, uploaded_at=now))
+            else:
+                upload.uploaded_at = now
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return created
+
+    @staticmethod
+    def _add_version(file_id, version, hashes, sizes, created_by, created_at=None, comment=None):
+        """在当前事务中写入版本和分块列表并增加引用数，返回 FileVersion"""
+        record = FileVersion(file_id=file_id, version=version, size=sum(sizes[h] for h in hashes),
+                             chunk_count=len(hashes), created_by=created_by,
+                             created_at=created_at or datetime.utcnow(), comment=comment)
+        db.session.add(record)
+        db.session.flush()
+
+        rows, offset = [], 0
+        for seq, digest in enumerate(hashes):
+            rows.append({'version_id': record.id, 'seq': seq, 'chunk_hash': digest,
+                         'offset': offset, 'size': sizes[digest]})
+            offset += sizes[digest]
+        if rows:
+            db.session.execute(db.insert(FileVersionChunk), rows)
+            VersionStore._adjust_refcounts(Counter(hashes), 1)
+        return record
+
+    @staticmethod
+    def _adjust_refcounts(counts, sign):
+        table = FileChunk.__table__
+        db.session.execute(
+            table.update().where(table.c.hash == db.bindparam('b_hash')).values(
+                refcount=table.c.refcount + db.bindparam('b_delta')
+            ),
+            [{'b_hash': digest, 'b_delta': sign * n} for digest, n in counts.items()]
+        )
+
+    @staticmethod
+    def _locked_sizes(hashes):
+        """锁定分块记录并返回 {hash: size}，锁定后清理任务不会删除这些分块"""
+        sizes = {}
+        unique = sorted(set(hashes))
+        for i in range(0, len(unique), 1000):
+            sizes.update(db.session.query(FileChunk.hash, FileChunk.size).filter(
+                FileChunk.hash.in_(unique[i:i + 1000])
+            ).with_for_update().all())
+        return sizes
+
+    @staticmethod
+    def ensure_base_version(file_record):
+        """把上传时的单个文件切分为第1版，之后文件内容只从分块读取；已分块的文件直接返回"""
+        from app.utils.file_utils import FileUtils
+
+        if file_record.current_version:
+            return
+        backend = FileUtils.storage_for(file_record)
+        key = FileUtils.storage_key(file_record)
+        info = backend.stat(key)
+        if info is None:
+            raise FileNotFoundError(key)
+
+        hashes = []
+        for data in iter_chunks(backend.get_range_stream(key, 0, info.size)):
+            digest = hashlib.sha256(data).hexdigest()
+            VersionStore.store_chunk(digest, data, file_record.uploaded_by)
+            hashes.append(digest)
+
+        try:
+            locked = File.query.filter_by(id=file_record.id).with_for_update().populate_existing().first()
+            if locked.current_version:
+                # 并发请求已完成转换，本次写入的分块引用数为0，由清理任务回收
+                db.session.rollback()
+                return
+            sizes = VersionStore._locked_sizes(hashes)
+            VersionStore._add_version(locked.id, 1, hashes, sizes, locked.uploaded_by,
+                                      created_at=locked.upload_date, comment='初始版本')
+            locked.current_version = 1
+            locked.compressed_variants = 0
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        # 原文件及其缩略图、压缩副本已不再使用
+        error = FileUtils.remove_file_data(file_record)
+        if error:
+            logging.warning(f"删除已分块文件的原始数据失败 {file_record.id}: {error}")
+
+    @staticmethod
+    def commit_version(file_record, user, hashes, comment=None, max_size=None):
+        """提交新版本，返回 (FileVersion, 错误信息, 缺少的分块)"""
+        from app.utils.quota import QuotaManager, QUOTA_EXCEEDED
+
+        VersionStore.ensure_base_version(file_record)
+
+        missing = set(hashes) - VersionStore.known_chunks(file_record.id, user.id, hashes)
+        if missing:
+            return None, '缺少分块', sorted(missing)
+
+        try:
+            locked = File.query.filter_by(id=file_record.id).with_for_update().populate_existing().first()
+            sizes = VersionStore._locked_sizes(hashes)
+            missing = set(hashes) - set(sizes)
+            if missing:
+                db.session.rollback()
+                return None, '缺少分块', sorted(missing)
+
+            total = sum(sizes[h] for h in hashes)
+            if max_size is not None and total > max_size:
+                db.session.rollback()
+                return None, f'文件不能超过 {max_size} 字节', []
+
+            # 用量按当前版本大小计入上传者
+            delta = total - locked.file_size
+            if delta > 0 and not QuotaManager.reserve(db.session.get(User, locked.uploaded_by), delta):
+                db.session.rollback()
+                return None, QUOTA_EXCEEDED, []
+            if delta < 0:
+                QuotaManager.apply_deltas([_Usage(locked.uploaded_by, -delta)], -1)
+
+            number = (db.session.query(db.func.max(FileVersion.version)).filter(
+                FileVersion.file_id == locked.id
+            ).scalar() or 0) + 1
+            record = VersionStore._add_version(locked.id, number, hashes, sizes, user.id,
+                                               comment=(comment or None) and comment[:255])
+            old_size = locked.file_size
+            locked.current_version = number
+            locked.file_size = total
+            locked.compressed_variants = 0
+            FacetCounter.resize(locked, old_size)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return record, None, []
+
+    @staticmethod
+    def version_hashes(version_id):
+        return [h for (h,) in db.session.query(FileVersionChunk.chunk_hash).filter(
+            FileVersionChunk.version_id == version_id
+        ).order_by(FileVersionChunk.seq)]
+
+    @staticmethod
+    def get(file_id, version=None):
+        """文件的指定版本，version 为空时返回当前版本"""
+        if version is None:
+            version = db.session.query(File.current_version).filter(File.id == file_id).scalar()
+            if version is None:
+                return None
+        return FileVersion.query.filter_by(file_id=file_id, version=version).first()
+
+    @staticmethod
+    def reader(version_record):
+        """返回 read(start, length) -> 字节块迭代器
+
+        分块列表在调用时查询，返回的函数可以在请求上下文之外（流式响应中）使用
+        """
+        rows = db.session.query(
+            FileVersionChunk.chunk_hash, FileVersionChunk.offset, FileVersionChunk.size,
+            FileChunk.storage_backend
+        ).join(FileChunk, FileChunk.hash == FileVersionChunk.chunk_hash).filter(
+            FileVersionChunk.version_id == version_record.id
+        ).order_by(FileVersionChunk.seq).all()
+        backends = {name: get_backend(name) for name in {r.storage_backend for r in rows}}
+        total = version_record.size
+
+        def read(start=0, length=None):
+            end = total if length is None else min(start + length, total)
+            for row in rows:
+                if row.offset + row.size <= start:
+                    continue
+                if row.offset >= end:
+                    break
+                lo = max(start - row.offset, 0)
+                hi = min(end - row.offset, row.size)
+                yield from backends[row.storage_backend].get_range_stream(chunk_key(row.chunk_hash), lo, hi - lo)
+
+        return read
+
+    @staticmethod
+    def release_files(file_ids):
+        """在当前事务中删除这些文件的全部版本并减少分块引用数，由 purge_records 调用"""
+        version_ids = [v for (v,) in db.session.query(FileVersion.id).filter(FileVersion.file_id.in_(file_ids))]
+        if not version_ids:
+            return
+        counts = Counter(dict(db.session.query(
+            FileVersionChunk.chunk_hash, db.func.count()
+        ).filter(FileVersionChunk.version_id.in_(version_ids)).group_by(FileVersionChunk.chunk_hash).all()))
+        if counts:
+            VersionStore._adjust_refcounts(counts, -1)
+        FileVersionChunk.query.filter(FileVersionChunk.version_id.in_(version_ids)).delete(synchronize_session=False)
+        FileVersion.query.filter(FileVersion.id.in_(version_ids)).delete(synchronize_session=False)
+
+    @staticmethod
+    def collect_garbage(cutoff, batch_size=500):
+        """删除引用数为0且在 cutoff 之前上传的分块，返回删除数"""
+        removed = 0
+        last_hash = ''
+        while True:
+            try:
+                rows = FileChunk.query.filter(
+                    FileChunk.refcount <= 0,
+                    FileChunk.created_at < cutoff,
+                    FileChunk.hash > last_hash
+                ).order_by(FileChunk.hash).limit(batch_size).with_for_update().all()
+                if not rows:
+                    db.session.rollback()
+                    return removed
+                last_hash = rows[-1].hash
+
+                deleted = []
+                for row in rows:
+                    try:
+                        get_backend(row.storage_backend).delete(chunk_key(row.hash))
+                        deleted.append(row.hash)
+                    except Exception as e:
+                        logging.error(f"删除分块失败 {row.hash}: {e}")
+                if deleted:
+                    FileChunkUpload.query.filter(FileChunkUpload.chunk_hash.in_(deleted)).delete(
+                        synchronize_session=False)
+                    FileChunk.query.filter(FileChunk.hash.in_(deleted)).delete(synchronize_session=False)
+                db.session.commit()
+                removed += len(deleted)
+            except Exception:
+                db.session.rollback()
+                raise
@@ -0,0 +1,219 @@
+import os
+import zlib
+import struct
+from datetime import datetime
+
+# 已压缩格式直接存储，其余使用deflate
+STORED_EXTENSIONS = {
+    'zip', 'rar', '7z', 'gz', 'bz2', 'tar', 'jpg', 'jpeg', 'png', 'gif', 'webp',
+    'mp3', 'mp4', 'avi', 'pdf', 'docx', 'xlsx', 'pptx'
+}
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+CHUNK_SIZE = 64 * 1024
+
+# 通用标志位：bit 3 使用数据描述符，bit 11 文件名为UTF-8
+_FLAGS = 0x0008 | 0x0800
+_VERSION = 45  # ZIP64
+_ZIP64_LIMIT = 0xFFFFFFFF
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_DATA_DESCRIPTOR = struct.Struct('<IIQQ')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_ZIP64_END = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_LOCATOR = struct.Struct('<IIQI')
+_END = struct.Struct('<IHHHHIIH')
+
+
+def compression_for(filename):
+    """根据扩展名选择压缩方式"""
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return ZIP_STORED if ext in STORED_EXTENSIONS else ZIP_DEFLATED
+
+
+def _dos_datetime(dt):
+    dt = dt or datetime.utcnow()
+    if dt.year < 1980:
+        dt = datetime(1980, 1, 1)
+    dos_time = (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+    dos_date = ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+    return dos_time, dos_date
+
+
+class ZipMember:
+    """归档成员"""
+
+    def __init__(self, path, arcname, size, modified=None, method=None, source=None):
+        self.path = path
+        # 不在本地磁盘上的文件由 source() 返回按块读取的迭代器
+        self.source = source
+        self.arcname = arcname
+        self.name_bytes = arcname.encode('utf-8')
+        self.size = size
+        self.modified = modified
+        self.method = compression_for(arcname) if method is None else method
+        self.crc = 0
+        self.compressed_size = 0
+        self.offset = 0
+
+
+class ZipStream:
+    """边读边生成的ZIP64归档，不落盘，内存占用与归档大小无关"""
+
+    def __init__(self, members, compress_level=6):
+        self.members = members
+        self.compress_level = compress_level
+
+    @staticmethod
+    def unique_names(names):
+        """为重名文件追加序号"""
+        seen = {}
+        result = []
+        for name in names:
+            candidate = name
+            base, dot, ext = name.rpartition('.')
+            if not dot:
+                base, ext = name, ''
+            counter = seen.get(name, 0)
+            while candidate in seen:
+                counter += 1
+                candidate = f'{base} ({counter}).{ext}' if dot else f'{base} ({counter})'
+            seen[name] = counter
+            seen[candidate] = 0
+            result.append(candidate)
+        return result
+
+    def content_length(self):
+        """所有成员均为存储方式时可提前计算归档总长度，否则返回None"""
+        if any(m.method != ZIP_STORED for m in self.members):
+            return None
+        total = 0
+        for m in self.members:
+            name_len = len(m.name_bytes)
+            total += _LOCAL_HEADER.size + name_len + 20 + m.size + _DATA_DESCRIPTOR.size
+            total += _CENTRAL_HEADER.size + name_len + 28
+        return total + _ZIP64_END.size + _ZIP64_LOCATOR.size + _END.size
+
+    def _local_header(self, m):
+        dos_time, dos_date = _dos_datetime(m.modified)
+        # ZIP64扩展字段：实际大小写在数据描述符中
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        return _LOCAL_HEADER.pack(
+            0x04034b50, _VERSION, _FLAGS, m.method, dos_time, dos_date,
+            0, _ZIP64_LIMIT, _ZIP64_LIMIT, len(m.name_bytes), len(extra)
+        ) + m.name_bytes + extra
+
+    def _central_header(self, m):
+        dos_time, dos_date = _dos_datetime(m.modified)
+        extra = struct.pack('<HHQQQ', 0x0001, 24, m.size, m.compressed_size, m.offset)
+        return _CENTRAL_HEADER.pack(
+            0x02014b50, (3 << 8) | _VERSION, _VERSION, _FLAGS, m.method, dos_time, dos_date,
+            m.crc, _ZIP64_LIMIT, _ZIP64_LIMIT, len(m.name_bytes), len(extra), 0, 0, 0,
+            0o100644 << 16, _ZIP64_LIMIT
+        ) + m.name_bytes + extra
+
+    @staticmethod
+    def _read(m):
+        if m.source is not None:
+            yield from m.source()
+            return
+        remaining = m.size
+        with open(m.path, 'rb') as f:
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def _member_data(self, m):
+        compressor = None
+        if m.method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+
+        crc = 0
+        remaining = m.size
+        for chunk in self._read(m):
+            remaining -= len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            m.compressed_size += len(chunk)
+            yield chunk
+        if remaining:
+            raise IOError(f'文件在打包过程中被截断: {m.arcname}')
+
+        if compressor:
+            tail = compressor.flush()
+            m.compressed_size += len(tail)
+            if tail:
+                yield tail
+        m.crc = crc
+
+    def __iter__(self):
+        offset = 0
+        for m in self.members:
+            m.offset = offset
+            m.crc = 0
+            m.compressed_size = 0
+
+            header = self._local_header(m)
+            offset += len(header)
+            yield header
+
+            for chunk in self._member_data(m):
+                offset += len(chunk)
+                yield chunk
+
+            descriptor = _DATA_DESCRIPTOR.pack(0x08074b50, m.crc, m.compressed_size, m.size)
+            offset += len(descriptor)
+            yield descriptor
+
+        central_offset = offset
+        for m in self.members:
+            entry = self._central_header(m)
+            offset += len(entry)
+            yield entry
+
+        count = len(self.members)
+        yield _ZIP64_END.pack(
+            0x06064b50, _ZIP64_END.size - 12, (3 << 8) | _VERSION, _VERSION, 0, 0,
+            count, count, offset - central_offset, central_offset
+        )
+        yield _ZIP64_LOCATOR.pack(0x07064b50, 0, offset, 1)
+        yield _END.pack(0x06054b50, 0, 0, 0xFFFF, 0xFFFF, _ZIP64_LIMIT, _ZIP64_LIMIT, 0)
+
+
+def build_members(files):
+    """由文件记录生成归档成员，按存储中的实际大小计算长度"""
+    from app.utils.file_utils import FileUtils
+
+    from app.utils.versioning import VersionStore
+
+    names = ZipStream.unique_names([f.original_filename for f in files])
+    members = []
+    for file, arcname in zip(files, names):
+        if file.current_version:
+            version = VersionStore.get(file.id, file.current_version)
+            if version is None:
+                raise FileNotFoundError(file.id)
+            members.append(ZipMember(None, arcname, version.size, file.upload_date,
+                                     source=lambda r=VersionStore.reader(version), n=version.size: r(0, n)))
+            continue
+        if (file.storage_backend or 'local') == 'local':
+            path = FileUtils.resolve_path(file)
+            members.append(ZipMember(path, arcname, os.stat(path).st_size, file.upload_date))
+            continue
+        backend = FileUtils.storage_for(file)
+        key = FileUtils.storage_key(file)
+        info = backend.stat(key)
+        if info is None:
+            raise FileNotFoundError(key)
+        size = info.size
+        members.append(ZipMember(key, arcname, size, file.upload_date,
+                                 source=lambda b=backend, k=key, n=size: b.get_range_stream(k, 0, n)))
+    return members
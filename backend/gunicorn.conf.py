@@ -1,3 +1,5 @@
+import os
+import shutil
 import multiprocessing
 
 # Gunicorn 配置 - 用于高并发性能优化
@@ -7,7 +9,8 @@ bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Worker Processes
-workers = multiprocessing.cpu_count() * 2 + 1
+# 应用按同一个环境变量推算各路由类别的并发上限（见 app.utils.admission）
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
 worker_class = "sync"
 worker_connections = 1000
 timeout = 120
@@ -22,6 +25,46 @@ errorlog = "/app/logs/gunicorn_error.log"
 loglevel = "info"
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s'
 
+# Metrics - 多进程指标目录，每个worker写入独立的mmap文件
+metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+def on_starting(server):
+    """主进程启动时清空旧的指标文件、准入控制和密码哈希槽位、慢查询记录"""
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+    from app.utils.admission import reset_admission
+    reset_admission()
+    from app.utils.passwords import PasswordHasher
+    PasswordHasher.reset()
+    from app.utils.slow_queries import reset_slow_queries
+    reset_slow_queries()
+
+def child_exit(server, worker):
+    """worker退出时标记其指标文件失效，并释放它占用的准入控制和密码哈希槽位"""
+    if metrics_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+    from app.utils.admission import release_worker
+    release_worker(worker.pid)
+    from app.utils.passwords import PasswordHasher
+    PasswordHasher.release_worker(worker.pid)
+
+def post_worker_init(worker):
+    """worker可以接收按需采集请求（见 app.utils.profiling）"""
+    from app.utils.profiling import install_signal_handler
+    install_signal_handler()
+
+def worker_exit(server, worker):
+    """worker退出前写出进行中的采集结果"""
+    from app.utils.profiling import stop_profiling
+    stop_profiling()
+
+def pre_request(worker, req):
+    """记录监听队列长度，传输请求占满 worker 时可以看到积压"""
+    from app.utils.admission import sample_listen_queue
+    sample_listen_queue(worker.sockets)
+
 # Process Naming
 proc_name = "resource-sharing-app"
 
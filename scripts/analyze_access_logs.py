@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+访问日志分析工具
+流式读取 gunicorn 和 Nginx 的访问日志（含轮转的 .1 和 .gz 归档，多个文件并行处理），按路由统计
+请求数、状态码分布、发送字节数和响应时间分布（对数分桶，内存占用与日志大小无关）。
+输出文本报告，可保存为 JSON 摘要并与上一次部署的摘要对比；--follow 持续读取新写入的日志
+"""
+
+import os
+import re
+import sys
+import glob
+import gzip
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.utils.access_rollup import LatencySketch
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+DEFAULT_LOGS = {
+    'gunicorn': ['/app/logs/gunicorn_access.log*'],
+    'nginx': ['/var/log/nginx/access.log*'],
+}
+
+# 两种日志都是 combined 格式，末尾可选的耗时字段：
+# gunicorn 为 %(D)s（微秒），Nginx 的 timed 格式为 $request_time（秒）
+LINE_PATTERN = re.compile(
+    r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>[^" ]+)[^"]*" '
+    r'(?P<status>\d{3}) (?P<bytes>\d+|-)'
+    r'(?: "(?:[^"\\]|\\.)*" "(?:[^"\\]|\\.)*")?'
+    r'(?: (?P<latency>\d+(?:\.\d+)?))?'
+)
+LATENCY_TO_MS = {'gunicorn': 0.001, 'nginx': 1000.0}
+
+# 路径归一化为路由，避免ID、文件名使每个URL各成一类
+ROUTE_RULES = [
+    (re.compile(r'^/dl/u/\d+/\d+/.*$'), '/dl/u/<int>/<int>/<path>'),
+    (re.compile(r'^/dl/\d+/.*$'), '/dl/<int>/<path>'),
+    (re.compile(r'^/(uploads|static)/.*$'), r'/\1/<path>'),
+    (re.compile(r'/[0-9a-fA-F]{16,}(?=/|$)'), '/<digest>'),
+    (re.compile(r'/\d+(?=/|$)'), '/<int>'),
+]
+OTHER_ROUTE = '<other>'
+
+MONTHS = {name: i for i, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+
+def parse_log_time(value):
+    """'18/Oct/2026:23:57:48 +0800' 转为 UTC 时间；按固定位置切片，比 strptime 快得多"""
+    try:
+        moment = datetime(int(value[7:11]), MONTHS[value[3:6]], int(value[0:2]),
+                          int(value[12:14]), int(value[15:17]), int(value[18:20]))
+        sign = -1 if value[21] == '-' else 1
+        offset = timedelta(hours=int(value[22:24]), minutes=int(value[24:26]))
+    except (KeyError, ValueError, IndexError):
+        return None
+    return moment - sign * offset
+
+
+def normalize_route(path):
+    path = path.split('?', 1)[0]
+    for pattern, replacement in ROUTE_RULES:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+def status_class(code):
+    return f'{code[0]}xx'
+
+
+class Aggregate:
+    """按 (来源, 方法 路由) 汇总；只保存计数和对数分桶，可以在进程间合并"""
+
+    def __init__(self, max_routes=1000):
+        self.max_routes = max_routes
+        self.routes = {}
+        self.lines = 0
+        self.unparsed = 0
+        self.start = None
+        self.end = None
+
+    def _stats(self, source, key):
+        stats = self.routes.get((source, key))
+        if stats is None:
+            if len(self.routes) >= self.max_routes:
+                key = f'{key.split(" ", 1)[0]} {OTHER_ROUTE}'
+                stats = self.routes.get((source, key))
+            if stats is None:
+                stats = self.routes[(source, key)] = {
+                    'count': 0, 'bytes': 0, 'status': {}, 'bins': {}, 'latency_sum': 0.0,
+                    'latency_min': None, 'latency_max': 0.0,
+                }
+        return stats
+
+    def add_line(self, source, line, since=None, until=None):
+        self.lines += 1
+        match = LINE_PATTERN.match(line)
+        if match is None:
+            self.unparsed += 1
+            return
+        moment = parse_log_time(match.group('time'))
+        if moment is not None:
+            if (since and moment < since) or (until and moment >= until):
+                return
+            if self.start is None or moment < self.start:
+                self.start = moment
+            if self.end is None or moment > self.end:
+                self.end = moment
+
+        stats = self._stats(source, f"{match.group('method')} {normalize_route(match.group('path'))}")
+        stats['count'] += 1
+        status = match.group('status')
+        stats['status'][status] = stats['status'].get(status, 0) + 1
+        if match.group('bytes') != '-':
+            stats['bytes'] += int(match.group('bytes'))
+        latency = match.group('latency')
+        if latency is not None:
+            ms = float(latency) * LATENCY_TO_MS[source]
+            LatencySketch.add(stats['bins'], ms)
+            stats['latency_sum'] += ms
+            stats['latency_min'] = ms if stats['latency_min'] is None else min(stats['latency_min'], ms)
+            stats['latency_max'] = max(stats['latency_max'], ms)
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.unparsed += other.unparsed
+        for bound, pick in (('start', min), ('end', max)):
+            values = [v for v in (getattr(self, bound), getattr(other, bound)) if v is not None]
+            setattr(self, bound, pick(values) if values else None)
+        for (source, key), theirs in other.routes.items():
+            mine = self._stats(source, key)
+            mine['count'] += theirs['count']
+            mine['bytes'] += theirs['bytes']
+            for status, n in theirs['status'].items():
+                mine['status'][status] = mine['status'].get(status, 0) + n
+            LatencySketch.merge(mine['bins'], theirs['bins'])
+            mine['latency_sum'] += theirs['latency_sum']
+            if theirs['latency_min'] is not None:
+                mine['latency_min'] = min(v for v in (mine['latency_min'], theirs['latency_min']) if v is not None)
+            mine['latency_max'] = max(mine['latency_max'], theirs['latency_max'])
+        return self
+
+    def summary(self):
+        """可对比的摘要：每个路由的请求数、状态码、字节数和分位数"""
+        sources = {}
+        for (source, key), stats in sorted(self.routes.items()):
+            timed = sum(stats['bins'].values())
+            # 分桶估计可能越出实际观测范围，夹到 [min, max] 内
+            quantile = lambda q: round(min(max(LatencySketch.quantile(stats['bins'], q), stats['latency_min']),
+                                           stats['latency_max']), 2) if timed else None
+            sources.setdefault(source, {})[key] = {
+                'count': stats['count'],
+                'bytes': stats['bytes'],
+                'status': dict(sorted(stats['status'].items())),
+                'error_rate': round(sum(n for s, n in stats['status'].items() if s >= '500') / stats['count'], 4),
+                'p50_ms': quantile(0.5),
+                'p90_ms': quantile(0.9),
+                'p99_ms': quantile(0.99),
+                'mean_ms': round(stats['latency_sum'] / timed, 2) if timed else None,
+                'max_ms': round(stats['latency_max'], 2) if timed else None,
+            }
+        return {
+            'start': self.start.isoformat() if self.start else None,
+            'end': self.end.isoformat() if self.end else None,
+            'lines': self.lines,
+            'unparsed': self.unparsed,
+            'sources': sources,
+        }
+
+
+def open_log(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def scan_file(path, source, since=None, until=None, max_routes=1000, limit=None):
+    """逐行读取一个日志文件，返回 Aggregate；在进程池中运行
+
+    limit 为只读取的字节数（--follow 时正在写入的文件只扫描到开始跟踪时的位置，之后的行由 Follower 读取）
+    """
+    aggregate = Aggregate(max_routes)
+    offset = 0
+    with open_log(path) as f:
+        for line in f:
+            offset += len(line)
+            if limit is not None and offset > limit:
+                break
+            aggregate.add_line(source, line.decode('utf-8', 'replace'), since, until)
+    return aggregate
+
+
+def expand(patterns):
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else []))
+    return list(dict.fromkeys(paths))
+
+
+def is_live(path):
+    """正在写入的日志（不是 .1、.gz 等轮转后的归档）"""
+    return not re.search(r'\.(\d+|gz)$', path)
+
+
+def scan_all(files, workers, since, until, max_routes, limits=None):
+    """并行扫描 [(路径, 来源)]，每个文件一个任务，按文件大小从大到小提交"""
+    limits = limits or {}
+    total = Aggregate(max_routes)
+    files = sorted(files, key=lambda item: os.path.getsize(item[0]), reverse=True)
+    if workers <= 1 or len(files) <= 1:
+        for path, source in files:
+            total.merge(scan_file(path, source, since, until, max_routes, limits.get(path)))
+        return total
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_file, path, source, since, until, max_routes, limits.get(path))
+                   for path, source in files]
+        for future in futures:
+            total.merge(future.result())
+    return total
+
+
+class Follower:
+    """从开始跟踪时的末尾持续读取正在写入的日志；文件被轮转（inode 改变或被截断）后读完旧文件再打开新文件"""
+
+    def __init__(self, files):
+        self.files = {}
+        for path, source in files:
+            f = open(path, 'rb')
+            f.seek(0, os.SEEK_END)
+            self.files[path] = {'source': source, 'file': f, 'inode': os.fstat(f.fileno()).st_ino, 'partial': b''}
+
+    def offsets(self):
+        return {path: state['file'].tell() for path, state in self.files.items()}
+
+    def _drain(self, state, aggregate, since, until):
+        while True:
+            line = state['file'].readline()
+            if not line:
+                return
+            if not line.endswith(b'\n'):
+                # 写了一半的行留到下次
+                state['partial'] += line
+                return
+            aggregate.add_line(state['source'], (state['partial'] + line).decode('utf-8', 'replace'), since, until)
+            state['partial'] = b''
+
+    def poll(self, aggregate, since=None, until=None):
+        for path, state in self.files.items():
+            self._drain(state, aggregate, since, until)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_ino != state['inode'] or st.st_size < state['file'].tell():
+                state['file'].close()
+                state.update(file=open(path, 'rb'), inode=st.st_ino, partial=b'')
+                self._drain(state, aggregate, since, until)
+
+
+def compare_summaries(current, baseline_path, threshold):
+    """与历史摘要对比，返回变化超过阈值的项"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    changes = []
+    for source, routes in current['sources'].items():
+        previous = baseline.get('sources', {}).get(source, {})
+        for key, stats in routes.items():
+            old = previous.get(key)
+            if not old:
+                continue
+            for metric in ('p50_ms', 'p99_ms'):
+                if old.get(metric) and stats.get(metric) is not None \
+                        and stats[metric] > old[metric] * (1 + threshold):
+                    changes.append(f"{source} {key} {metric}: {old[metric]:.2f} -> {stats[metric]:.2f}")
+            if stats['error_rate'] > old.get('error_rate', 0) + 0.01:
+                changes.append(f"{source} {key} error_rate: {old.get('error_rate', 0):.2%} -> {stats['error_rate']:.2%}")
+    return changes
+
+
+def print_report(summary, top):
+    print(f"时间范围: {summary['start']} - {summary['end']}  行数: {summary['lines']}  无法解析: {summary['unparsed']}")
+    fmt = lambda v: f'{v:.1f}' if v is not None else '-'
+    for source, routes in summary['sources'].items():
+        header = f"{'route':<48}{'req':>9}{'2xx':>7}{'4xx':>7}{'5xx':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>10}{'MB':>10}"
+        print(f'\n[{source}]')
+        print(header)
+        print('-' * len(header))
+        ranked = sorted(routes.items(), key=lambda item: item[1]['count'], reverse=True)[:top]
+        for key, r in ranked:
+            mix = {}
+            for status, n in r['status'].items():
+                mix[status_class(status)] = mix.get(status_class(status), 0) + n
+            share = lambda c: f"{mix.get(c, 0) * 100 / r['count']:.0f}%"
+            print(f"{key[:47]:<48}{r['count']:>9}{share('2xx'):>7}{share('4xx'):>7}{share('5xx'):>7}"
+                  f"{fmt(r['p50_ms']):>9}{fmt(r['p90_ms']):>9}{fmt(r['p99_ms']):>9}{fmt(r['max_ms']):>10}"
+                  f"{r['bytes'] / 1048576:>10.1f}")
+
+
+def write_summary(summary, path, files):
+    report = {'generated_at': datetime.utcnow().isoformat(), 'files': files, **summary}
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析 gunicorn 和 Nginx 访问日志')
+    parser.add_argument('--gunicorn', action='append', help='gunicorn 访问日志（可用通配符，可指定多次）')
+    parser.add_argument('--nginx', action='append', help='Nginx 访问日志（可用通配符，可指定多次）')
+    parser.add_argument('--since', help='只统计该时间（UTC，ISO格式）之后的请求')
+    parser.add_argument('--until', help='只统计该时间（UTC，ISO格式）之前的请求')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行处理文件的进程数')
+    parser.add_argument('--max-routes', type=int, default=1000, help='超过后新路由计入 <other>')
+    parser.add_argument('--top', type=int, default=30, help='报告中每个来源显示的路由数')
+    parser.add_argument('--json', help='保存 JSON 摘要的路径')
+    parser.add_argument('--compare', help='对比的历史 JSON 摘要')
+    parser.add_argument('--threshold', type=float, default=0.2, help='延迟回退判定阈值（比例）')
+    parser.add_argument('--follow', action='store_true', help='扫描完成后持续读取新写入的日志')
+    parser.add_argument('--interval', type=float, default=60, help='--follow 时输出报告的间隔秒数')
+    args = parser.parse_args()
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+    until = datetime.fromisoformat(args.until) if args.until else None
+
+    explicit = args.gunicorn or args.nginx
+    files = [(path, 'gunicorn') for path in expand(args.gunicorn or ([] if explicit else DEFAULT_LOGS['gunicorn']))]
+    files += [(path, 'nginx') for path in expand(args.nginx or ([] if explicit else DEFAULT_LOGS['nginx']))]
+    if not files:
+        logging.error("没有找到日志文件")
+        sys.exit(1)
+
+    started = time.monotonic()
+    # 先打开正在写入的文件并记录末尾位置，扫描只读到这里，之后写入的行由 Follower 读取
+    follower = Follower([item for item in files if is_live(item[0])]) if args.follow else None
+    aggregate = scan_all(files, args.workers, since, until, args.max_routes,
+                         follower.offsets() if follower else None)
+    logging.info(f"已处理 {len(files)} 个文件、{aggregate.lines} 行，耗时 {time.monotonic() - started:.1f} 秒")
+
+    file_names = [path for path, _ in files]
+    try:
+        while True:
+            summary = aggregate.summary()
+            print_report(summary, args.top)
+            if args.json:
+                write_summary(summary, args.json, file_names)
+            if follower is None:
+                break
+            time.sleep(args.interval)
+            follower.poll(aggregate, since, until)
+    except KeyboardInterrupt:
+        pass
+
+    if args.compare:
+        changes = compare_summaries(summary, args.compare, args.threshold)
+        for item in changes:
+            logging.warning(f"性能回退: {item}")
+        if changes:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
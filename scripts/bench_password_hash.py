@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+密码哈希参数基准测试
+在不同并发下通过 PasswordHasher 校验密码，输出每种算法参数的单次耗时分位数、吞吐量和排队超时次数，
+用于选择 PASSWORD_HASH_METHOD 和 PASSWORD_HASH_WORKERS。
+端到端的登录延迟使用 benchmark.py --endpoints '^auth\\.login$' 测量
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from werkzeug.security import generate_password_hash
+from app.utils.passwords import PasswordHasher, PasswordHashingBusy
+from benchmark import percentile
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+PASSWORD = 'benchpass'
+
+
+def run_level(stored_hash, concurrency, requests):
+    """以给定并发执行 requests 次校验，返回统计结果"""
+    def one(_):
+        start = time.perf_counter()
+        try:
+            ok = PasswordHasher.verify(stored_hash, PASSWORD)
+        except PasswordHashingBusy:
+            return None
+        if not ok:
+            raise RuntimeError('密码校验失败')
+        return (time.perf_counter() - start) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(s for s in samples if s is not None)
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'busy': sum(1 for s in samples if s is None),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'throughput_rps': len(latencies) / elapsed if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='密码哈希参数基准测试')
+    parser.add_argument('--methods', default='scrypt:32768:8:1,scrypt:16384:8:1,pbkdf2:sha256:600000',
+                        help='逗号分隔的Werkzeug方法字符串')
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=64, help='每个并发级别的校验次数')
+    parser.add_argument('--output', help='结果JSON文件')
+    args = parser.parse_args()
+
+    results = []
+    for method in [m.strip() for m in args.methods.split(',') if m.strip()]:
+        stored_hash = generate_password_hash(PASSWORD, method)
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            result = {'method': method, **run_level(stored_hash, concurrency, args.requests)}
+            results.append(result)
+            logging.info(f"{method:<24} 并发 {concurrency:>3}: p50 {result['p50_ms'] or 0:.1f}ms "
+                         f"p99 {result['p99_ms'] or 0:.1f}ms 吞吐 {result['throughput_rps'] or 0:.1f}/s "
+                         f"排队超时 {result['busy']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
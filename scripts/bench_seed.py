@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+基准测试数据生成脚本
+按 PermissionManager.ROLES 生成用户、按真实大小分布生成文件，并随机授予 FilePermission
+"""
+
+import os
+import sys
+import random
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+BENCH_PASSWORD = 'benchpass'
+
+# 角色权重：大部分是普通用户
+ROLE_WEIGHTS = {'admin': 1, 'editor': 10, 'user': 70, 'viewer': 19}
+
+# (权重, 最小字节, 最大字节, 扩展名, MIME类型, 文件类型)
+SIZE_MIX = [
+    (45, 1024, 100 * 1024, 'txt', 'text/plain', 'document'),
+    (15, 20 * 1024, 500 * 1024, 'json', 'application/json', 'document'),
+    (20, 100 * 1024, 5 * 1024 * 1024, 'pdf', 'application/pdf', 'document'),
+    (12, 50 * 1024, 8 * 1024 * 1024, 'jpg', 'image/jpeg', 'image'),
+    (6, 5 * 1024 * 1024, 50 * 1024 * 1024, 'zip', 'application/zip', 'document'),
+    (2, 50 * 1024 * 1024, 250 * 1024 * 1024, 'mp4', 'video/mp4', 'other'),
+]
+
+PERMISSION_TYPES = ['read', 'read', 'read', 'write', 'delete']
+
+
+def _pick_size_class(rng):
+    total = sum(c[0] for c in SIZE_MIX)
+    r = rng.uniform(0, total)
+    for entry in SIZE_MIX:
+        r -= entry[0]
+        if r <= 0:
+            return entry
+    return SIZE_MIX[-1]
+
+
+def _write_sparse(path, size):
+    """创建稀疏文件，只占用元数据而不写入真实数据"""
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def seed(users=100, files=1000, grant_ratio=0.2, deletable=0, seed_value=42, write_blobs=True):
+    """生成基准测试数据集，需要在应用上下文中调用"""
+    from app import db
+    from app.models import User, Role, File, FilePermission
+    from app.models.user import user_roles
+    from app.utils.permissions import PermissionManager
+    from app.utils.security import SecurityManager
+    from app.utils.file_utils import FileUtils
+    from app.utils.quota import QuotaManager
+    from app.utils.facets import FacetCounter
+    from app.utils.trending import Trending
+    from app.utils.passwords import PasswordHasher
+
+    rng = random.Random(seed_value)
+
+    if Role.query.count() == 0:
+        PermissionManager.init_permissions()
+    roles = {r.name: r.id for r in Role.query.all()}
+
+    run_tag = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    # 与当前配置的算法一致，避免压测登录时触发重新哈希
+    password_hash = PasswordHasher.hash(BENCH_PASSWORD)
+    role_names = [r for r in PermissionManager.ROLES if r in roles]
+    role_weights = [ROLE_WEIGHTS.get(r, 1) for r in role_names]
+
+    # 每个角色至少一个用户
+    user_role_list = list(role_names)
+    while len(user_role_list) < users:
+        user_role_list.append(rng.choices(role_names, role_weights)[0])
+
+    user_rows = [{
+        'username': f'bench_{run_tag}_{i}',
+        'email': f'bench_{run_tag}_{i}@bench.local',
+        'password_hash': password_hash,
+        'is_active': True,
+        'is_admin': role == 'admin',
+        'created_at': datetime.utcnow(),
+    } for i, role in enumerate(user_role_list)]
+    db.session.execute(db.insert(User), user_rows)
+
+    created = User.query.filter(User.username.like(f'bench_{run_tag}_%')).order_by(User.id).all()
+    dataset_users = {role: [] for role in role_names}
+    role_rows = []
+    for user, role in zip(created, user_role_list):
+        dataset_users[role].append({'id': user.id, 'username': user.username})
+        role_rows.append({'user_id': user.id, 'role_id': roles[role]})
+    db.session.execute(user_roles.insert(), role_rows)
+    db.session.commit()
+    logging.info(f"已生成 {len(created)} 个用户")
+
+    # 只有具备上传权限的角色才拥有文件
+    uploaders = [u for role in role_names if 'files.upload' in PermissionManager.ROLES[role]
+                 for u in dataset_users[role]]
+    all_user_ids = [u.id for u in created]
+
+    def make_file_rows(count):
+        rows = []
+        now = datetime.utcnow()
+        for _ in range(count):
+            owner = rng.choice(uploaders)
+            _, min_size, max_size, ext, mime, file_type = _pick_size_class(rng)
+            size = int(rng.uniform(min_size, max_size))
+            original = f'bench_{rng.randrange(10 ** 8)}.{ext}'
+            safe_name = SecurityManager.hash_filename(original)
+            path = FileUtils.fanout_path(owner['id'], safe_name)
+            if write_blobs:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _write_sparse(path, size)
+            download_count = int(rng.paretovariate(1.2)) - 1
+            rows.append({
+                'original_filename': original,
+                'filename': safe_name,
+                'file_path': path,
+                'file_size': size,
+                'file_type': file_type,
+                'mime_type': mime,
+                'upload_date': now - timedelta(minutes=rng.randrange(60 * 24 * 365)),
+                'uploaded_by': owner['id'],
+                'is_public': rng.random() < 0.3,
+                'download_count': download_count,
+                # 下载次数按最近两周内的随机时间计入热度
+                'trend_score': Trending.weight(now - timedelta(minutes=rng.randrange(60 * 24 * 14)),
+                                               download_count) if download_count > 0 else None,
+                'description': f'benchmark file {original}',
+                'storage_layout': File.LAYOUT_FANOUT,
+            })
+        return rows
+
+    batch_size = 1000
+    for offset in range(0, files + deletable, batch_size):
+        db.session.execute(db.insert(File), make_file_rows(min(batch_size, files + deletable - offset)))
+    db.session.commit()
+
+    owner_ids = {u['id'] for u in uploaders}
+    # 批量插入绕过了上传流程，按记录重算用量和分面计数
+    QuotaManager.reconcile(list(owner_ids), fix=True)
+    FacetCounter.rebuild()
+    file_rows = db.session.query(File.id, File.uploaded_by, File.is_public).filter(
+        File.uploaded_by.in_(owner_ids)
+    ).order_by(File.id).all()
+
+    # 最后 deletable 个文件留作删除场景使用
+    deletable_ids = [r.id for r in file_rows[-deletable:]] if deletable else []
+    kept = file_rows[:-deletable] if deletable else file_rows
+
+    files_by_owner = {}
+    public_ids = []
+    for row in kept:
+        files_by_owner.setdefault(row.uploaded_by, []).append(row.id)
+        if row.is_public:
+            public_ids.append(row.id)
+
+    grant_rows = []
+    for row in kept:
+        if rng.random() >= grant_ratio:
+            continue
+        for grantee in rng.sample(all_user_ids, min(3, len(all_user_ids))):
+            if grantee == row.uploaded_by:
+                continue
+            grant_rows.append({
+                'file_id': row.id,
+                'user_id': grantee,
+                'permission_type': rng.choice(PERMISSION_TYPES),
+                'granted_by': row.uploaded_by,
+                'granted_at': datetime.utcnow(),
+            })
+    if grant_rows:
+        db.session.execute(db.insert(FilePermission), grant_rows)
+    db.session.commit()
+    logging.info(f"已生成 {len(kept)} 个文件、{len(grant_rows)} 条文件授权")
+
+    return {
+        'password': BENCH_PASSWORD,
+        'users': dataset_users,
+        'files_by_owner': files_by_owner,
+        'public_files': public_ids,
+        'deletable_files': deletable_ids,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成基准测试数据')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--grant-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-blobs', action='store_true', help='只写数据库，不在磁盘上创建文件')
+    args = parser.parse_args()
+
+    from app import create_app, db
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed(args.users, args.files, args.grant_ratio, seed_value=args.seed,
+             write_blobs=not args.no_blobs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+预压缩副本生成任务
+为文本类文件生成 .gz/.br 副本（compressed_variants 为空的记录），下载时按 Accept-Encoding
+直接发送副本，Nginx 使用 gzip_static 发送 .gz 副本。--all 用于回填已有文件或调整压缩参数后重新生成
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.models import File
+from app.utils.file_utils import FileUtils
+from app.utils.compression import CompressedVariants, COMPRESSIBLE_EXTENSIONS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+class VariantBuilder:
+    def __init__(self, batch_size=200, regenerate=False):
+        self.batch_size = batch_size
+        self.regenerate = regenerate
+
+    def _query(self, last_id):
+        query = File.query.with_entities(
+            File.id, File.file_path, File.filename, File.uploaded_by, File.storage_layout
+        ).filter(
+            File.deleted_at.is_(None),
+            File.storage_backend == 'local',
+            File.current_version.is_(None),
+            File.id > last_id
+        )
+
+        if self.regenerate:
+            query = query.filter(db.or_(*[File.filename.like(f'%.{ext}') for ext in COMPRESSIBLE_EXTENSIONS]))
+        else:
+            query = query.filter(File.compressed_variants.is_(None))
+        return query.order_by(File.id).limit(self.batch_size)
+
+    def build_once(self):
+        """处理一轮，返回 (已处理数, 生成的副本数)"""
+        processed = built = 0
+        last_id = 0
+
+        while True:
+            rows = self._query(last_id).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            updates = []
+            for row in rows:
+                path = FileUtils.resolve_path(row)
+                try:
+                    flags = CompressedVariants.build(path) if os.path.exists(path) else 0
+                except Exception as e:
+                    # 记为 0，不阻塞后续文件；可用 --all 重新生成
+                    logging.error(f"文件 {row.id} 生成压缩副本失败: {str(e)}")
+                    flags = 0
+                updates.append({'id': row.id, 'compressed_variants': flags})
+                built += bin(flags).count('1')
+
+            try:
+                db.session.execute(db.update(File), updates)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            processed += len(rows)
+            db.session.expire_all()
+
+        return processed, built
+
+    def run(self, interval=None):
+        while True:
+            try:
+                processed, built = self.build_once()
+                if processed:
+                    logging.info(f"压缩副本生成完成: 处理 {processed} 个文件，生成 {built} 个副本")
+            except Exception as e:
+                logging.error(f"压缩副本生成失败: {str(e)}")
+                db.session.rollback()
+                if interval is None:
+                    sys.exit(1)
+
+            if interval is None:
+                return
+            # 回填只需要运行一次
+            self.regenerate = False
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成预压缩副本')
+    parser.add_argument('--all', action='store_true', help='重新生成所有文本类文件的副本')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--interval', type=float, help='循环运行的间隔秒数，不指定时只运行一次')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        VariantBuilder(args.batch_size, args.all).run(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+签名链接下载记录导入
+读取 Nginx（以及后端回退实现）写入的 download_accounting 日志，按文件汇总后批量更新
+download_count 和下载热度并写入 AccessLog。读取位置保存在状态文件中，支持日志轮转（file.log -> file.log.1）
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.models import File, User, AccessLog
+from app.utils.trending import Trending
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# <msec> <status> <file_id> <user_id|-> <ip> "<range>" <bytes>
+LINE_PATTERN = re.compile(
+    r'^(?P<ts>\d+(?:\.\d+)?) (?P<status>\d{3}) (?P<file_id>\d+) (?P<user_id>\d+|-) '
+    r'(?P<ip>\S+) "(?P<range>[^"]*)" (?P<bytes>\d+|-)$'
+)
+
+
+def is_download(status, range_header):
+    """完整下载或从头开始的分段下载计为一次下载，续传的分段不重复计数"""
+    if status == 200:
+        return True
+    return status == 206 and range_header.replace(' ', '').startswith('bytes=0-')
+
+
+def parse_line(line):
+    match = LINE_PATTERN.match(line.strip())
+    if not match:
+        return None
+    status = int(match.group('status'))
+    if not is_download(status, match.group('range')):
+        return None
+    return {
+        'created_at': datetime.utcfromtimestamp(float(match.group('ts'))),
+        'status': status,
+        'file_id': int(match.group('file_id')),
+        'user_id': None if match.group('user_id') == '-' else int(match.group('user_id')),
+        'ip': match.group('ip')[:45],
+        'bytes': None if match.group('bytes') == '-' else int(match.group('bytes')),
+    }
+
+
+class LogReader:
+    """按状态文件中记录的 inode 和偏移量增量读取日志"""
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path, encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def save(self):
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    @staticmethod
+    def _read_from(path, offset, max_lines):
+        """从偏移量读取完整的行，返回 (行列表, 新偏移量)"""
+        lines = []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while len(lines) < max_lines:
+                line = f.readline()
+                if not line or not line.endswith(b'\n'):
+                    break  # 写了一半的行留到下次
+                offset += len(line)
+                lines.append(line.decode('utf-8', 'replace'))
+        return lines, offset
+
+    def read(self, path, max_lines):
+        """返回 (行列表, 提交后需要保存的状态)"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return [], None
+
+        saved = self.state.get(path, {})
+        inode, offset = saved.get('inode'), saved.get('offset', 0)
+
+        if inode is not None and inode != st.st_ino:
+            # 日志已轮转：先读完旧文件剩余部分
+            rotated = path + '.1'
+            if os.path.exists(rotated) and os.stat(rotated).st_ino == inode:
+                lines, new_offset = self._read_from(rotated, offset, max_lines)
+                if lines:
+                    return lines, {'inode': inode, 'offset': new_offset}
+            offset = 0
+        elif offset > st.st_size:
+            # 被截断
+            offset = 0
+
+        lines, new_offset = self._read_from(path, offset, max_lines)
+        return lines, {'inode': st.st_ino, 'offset': new_offset}
+
+
+def apply_batch(records):
+    """在一个事务中累加下载次数并写入访问日志，返回写入的记录数"""
+    if not records:
+        return 0
+
+    file_ids = {r['file_id'] for r in records}
+    user_ids = {r['user_id'] for r in records if r['user_id']}
+    # 已彻底删除的文件和用户的记录丢弃，避免外键错误
+    known_files = {row.id for row in File.query.with_entities(File.id).filter(File.id.in_(file_ids))}
+    known_users = {row.id for row in User.query.with_entities(User.id).filter(User.id.in_(user_ids))} \
+        if user_ids else set()
+
+    counts = {}
+    events = []
+    log_rows = []
+    for r in records:
+        if r['file_id'] not in known_files:
+            continue
+        counts[r['file_id']] = counts.get(r['file_id'], 0) + 1
+        events.append((r['file_id'], r['created_at']))
+        log_rows.append({
+            'user_id': r['user_id'] if r['user_id'] in known_users else None,
+            'ip_address': r['ip'],
+            'endpoint': 'links.download',
+            'method': 'GET',
+            'status_code': r['status'],
+            'created_at': r['created_at'],
+            'file_id': r['file_id'],
+            'action': 'download',
+            'details': json.dumps({'via': 'signed_link', 'bytes': r['bytes']}),
+        })
+
+    if not log_rows:
+        return 0
+
+    table = File.__table__
+    try:
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('b_id')).values(
+                download_count=table.c.download_count + db.bindparam('b_count')
+            ),
+            [{'b_id': fid, 'b_count': n} for fid, n in counts.items()]
+        )
+        # 热度按日志中的下载时间累加
+        Trending.record(events)
+        db.session.execute(db.insert(AccessLog), log_rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(log_rows)
+
+
+def import_once(paths, reader, batch_size):
+    imported = 0
+    for path in paths:
+        while True:
+            lines, new_state = reader.read(path, batch_size)
+            if new_state is None:
+                break
+            records = [r for r in (parse_line(line) for line in lines) if r]
+            imported += apply_batch(records)
+            # 入库成功后再保存读取位置；保存前中断会在下次重复导入这一批
+            reader.state[path] = new_state
+            reader.save()
+            if not lines:
+                break
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入签名链接下载记录')
+    parser.add_argument('--log', action='append',
+                        help='日志文件，可指定多次；默认读取Nginx日志和后端回退实现的日志')
+    parser.add_argument('--state', default='/app/logs/download_accounting.state.json')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--interval', type=float, help='循环运行的间隔秒数，不指定时只运行一次')
+    args = parser.parse_args()
+
+    paths = args.log or [
+        '/var/log/nginx/download_accounting.log',
+        os.getenv('DOWNLOAD_ACCOUNTING_LOG', '/app/logs/download_accounting.log'),
+    ]
+
+    app = create_app()
+    with app.app_context():
+        reader = LogReader(args.state)
+        while True:
+            try:
+                imported = import_once(paths, reader, args.batch_size)
+                if imported:
+                    logging.info(f"已导入 {imported} 条下载记录")
+            except Exception as e:
+                logging.error(f"导入下载记录失败: {str(e)}")
+                db.session.rollback()
+                if args.interval is None:
+                    sys.exit(1)
+
+            if args.interval is None:
+                return
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
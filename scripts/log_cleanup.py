@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 日志清理脚本
-清理超过90天的日志文件和数据库记录
+清理超过90天的日志文件和数据库记录；数据库记录先归档到 LOG_ARCHIVE_DIR（Parquet）再删除，
+LOG_ARCHIVE_DIR 为空时直接删除
 """
 
 import os
@@ -12,9 +13,12 @@ import sys
 
 # 添加到Python路径
 sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
 
 from app import create_app, db
 from app.models import AccessLog
+from app.utils.access_rollup import AccessRollup
+from app.utils.log_archive import LogArchiver, pq
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,16 +34,35 @@ def cleanup_old_logs():
             # 计算90天前的日期
             cutoff_date = datetime.utcnow() - timedelta(days=90)
             
-            # 清理数据库中的访问日志
-            old_logs = AccessLog.query.filter(
-                AccessLog.created_at < cutoff_date
-            ).all()
+            # 清理数据库中的访问日志，只删除已汇总到报表的记录
+            rolled_up_id = AccessRollup.rolled_up_id()
+            pending = AccessLog.query.filter(
+                AccessLog.created_at < cutoff_date,
+                AccessLog.id > rolled_up_id
+            ).count()
+            if pending:
+                logging.warning(f"{pending} 条过期日志尚未汇总，暂不删除（检查 rollup_access_logs.py 是否在运行）")
             
-            old_log_count = len(old_logs)
-            for log in old_logs:
-                db.session.delete(log)
+            old_log_count = 0
+            archive_dir = os.getenv('LOG_ARCHIVE_DIR', '/app/archive')
+            if archive_dir and pq is None:
+                # 要求保留历史记录，无法归档时不删除
+                logging.error("未安装 pyarrow，无法归档访问日志，跳过数据库日志清理")
+            elif archive_dir:
+                # 先写入归档再删除
+                old_log_count = LogArchiver(archive_dir).archive(cutoff_date, rolled_up_id)
+            else:
+                while True:
+                    ids = [row.id for row in AccessLog.query.with_entities(AccessLog.id).filter(
+                        AccessLog.created_at < cutoff_date,
+                        AccessLog.id <= rolled_up_id
+                    ).order_by(AccessLog.id).limit(5000)]
+                    if not ids:
+                        break
+                    AccessLog.query.filter(AccessLog.id.in_(ids)).delete(synchronize_session=False)
+                    db.session.commit()
+                    old_log_count += len(ids)
             
-            db.session.commit()
             logging.info(f"已删除 {old_log_count} 条访问日志记录")
             
             # 清理文件系统日志文件
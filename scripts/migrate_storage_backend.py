@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+存储后端迁移脚本
+将文件分批复制到另一个存储后端（如本地磁盘 -> S3），迁移期间服务可正常下载：
+
+1. 从原后端流式读取并写入目标后端，写入后核对大小
+2. 在一个事务中更新该批记录的 storage_backend 和 file_path
+3. 延迟一段时间后再删除原后端中的数据，保证已读到旧记录的请求仍能读到文件
+
+旧的平铺布局文件需要先用 migrate_upload_layout.py 迁移；多版本文件的分块不迁移
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import deque
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.models import File
+from app.utils.file_utils import FileUtils
+from app.utils.storage import get_backend
+from app.utils.compression import is_compressible, MIN_SIZE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+class _StreamReader:
+    """把按块产生的迭代器包装成 put_stream 需要的可读对象"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer.extend(chunk)
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class BackendMigrator:
+    def __init__(self, target, batch_size=50, sleep=0.5, delete_delay=10.0, dry_run=False, user_id=None):
+        self.target = get_backend(target)
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.delete_delay = delete_delay
+        self.dry_run = dry_run
+        self.user_id = user_id
+        self.pending_deletes = deque()
+        self.stats = {'migrated': 0, 'missing': 0, 'failed': 0}
+
+    def _flush_deletes(self, force=False):
+        now = time.monotonic()
+        while self.pending_deletes and (force or self.pending_deletes[0][0] <= now):
+            _, rows = self.pending_deletes.popleft()
+            for row in rows:
+                error = FileUtils.remove_file_data(row)
+                if error:
+                    logging.error(f"删除原存储数据失败 {row.id}: {error}")
+
+    def _next_batch(self, last_id):
+        query = File.query.with_entities(
+            File.id, File.file_path, File.filename, File.uploaded_by, File.file_size,
+            File.mime_type, File.storage_layout, File.storage_backend
+        ).filter(
+            File.storage_backend != self.target.name,
+            File.storage_layout == File.LAYOUT_FANOUT,
+            File.deleted_at.is_(None),
+            File.current_version.is_(None),
+            File.id > last_id
+        )
+        if self.user_id:
+            query = query.filter(File.uploaded_by == self.user_id)
+        return query.order_by(File.id).limit(self.batch_size).all()
+
+    def _copy(self, row):
+        """复制一个文件，返回写入的字节数；原文件不存在时返回None"""
+        source = FileUtils.storage_for(row)
+        key = FileUtils.storage_key(row)
+        info = source.stat(key)
+        if info is None:
+            return None
+        size = self.target.put_stream(key, _StreamReader(iter(source.get_range_stream(key, 0, info.size))),
+                                      row.mime_type)
+        if size != info.size:
+            self.target.delete(key)
+            raise IOError(f'写入大小不一致: {size} != {info.size}')
+        return size
+
+    def migrate_batch(self, rows):
+        updates = []
+        migrated_rows = []
+        for row in rows:
+            if self.dry_run:
+                updates.append({'id': row.id})
+                continue
+
+            try:
+                size = self._copy(row)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logging.error(f"迁移文件失败 {row.id}: {e}")
+                continue
+            if size is None:
+                self.stats['missing'] += 1
+                logging.warning(f"文件不存在，跳过: {row.id} {FileUtils.storage_key(row)}")
+                continue
+
+            key = FileUtils.storage_key(row)
+            # 迁回本地时重新生成压缩副本，对象存储不保存压缩副本
+            needs_variants = self.target.name == 'local' and is_compressible(row.filename) and size >= MIN_SIZE
+            updates.append({
+                'id': row.id,
+                'storage_backend': self.target.name,
+                'file_path': self.target.local_path(key) or key,
+                'compressed_variants': None if needs_variants else 0
+            })
+            migrated_rows.append(row)
+
+        if self.dry_run:
+            self.stats['migrated'] += len(updates)
+            return
+
+        if updates:
+            try:
+                db.session.execute(db.update(File), updates)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # 记录未更新，目标后端中的副本会在下次运行时被覆盖
+                raise
+            self.stats['migrated'] += len(updates)
+            self.pending_deletes.append((time.monotonic() + self.delete_delay, migrated_rows))
+
+    def run(self, limit=None):
+        last_id = 0
+        while True:
+            rows = self._next_batch(last_id)
+            if not rows:
+                break
+            if limit is not None:
+                rows = rows[:max(0, limit - self.stats['migrated'])]
+                if not rows:
+                    break
+            last_id = rows[-1].id
+
+            self.migrate_batch(rows)
+            db.session.expire_all()
+            self._flush_deletes()
+            logging.info(f"进度: 已迁移 {self.stats['migrated']}，缺失 {self.stats['missing']}，"
+                         f"失败 {self.stats['failed']}，当前ID {last_id}")
+
+            time.sleep(self.sleep)
+
+        if self.pending_deletes:
+            time.sleep(max(0.0, self.pending_deletes[-1][0] - time.monotonic()))
+            self._flush_deletes(force=True)
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='存储后端迁移')
+    parser.add_argument('--to', required=True, choices=('local', 's3'), help='目标存储后端')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--sleep', type=float, default=0.5, help='每批之间的暂停秒数')
+    parser.add_argument('--delete-delay', type=float, default=10.0, help='删除原存储数据前的等待秒数')
+    parser.add_argument('--limit', type=int, help='本次最多迁移的文件数')
+    parser.add_argument('--user-id', type=int, help='只迁移指定用户的文件')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        migrator = BackendMigrator(args.to, args.batch_size, args.sleep, args.delete_delay,
+                                   args.dry_run, args.user_id)
+        try:
+            stats = migrator.run(args.limit)
+        except Exception as e:
+            logging.error(f"迁移任务失败: {str(e)}")
+            sys.exit(1)
+        logging.info(f"迁移完成: {stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+上传目录布局在线迁移脚本
+将旧的平铺布局 UPLOAD_FOLDER/<user_id>/<filename> 分批迁移到两级哈希目录
+UPLOAD_FOLDER/<user_id>/ab/cd/<filename>，迁移期间服务可正常读取文件：
+
+1. 先以硬链接（跨设备时复制）在新位置创建文件，新旧路径同时有效
+2. 在一个事务中更新该批记录的 storage_layout 和 file_path
+3. 延迟一段时间后再删除旧路径，保证已读到旧记录的请求仍能打开文件
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+from collections import deque
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.models import File
+from app.utils.file_utils import FileUtils
+from app.utils.compression import CompressedVariants
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def _place(src, dst):
+    """在新位置创建文件，已存在且大小一致时视为上次中断后的残留"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        if os.path.getsize(src) != os.path.getsize(dst):
+            os.remove(dst)
+            os.link(src, dst)
+    except OSError:
+        # 跨设备或文件系统不支持硬链接
+        tmp = dst + '.migrating'
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+
+
+def _unlink_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.error(f"删除旧文件失败 {path}: {e}")
+
+
+class LayoutMigrator:
+    def __init__(self, batch_size=200, sleep=0.5, unlink_delay=10.0, dry_run=False, user_id=None):
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.unlink_delay = unlink_delay
+        self.dry_run = dry_run
+        self.user_id = user_id
+        self.pending_unlinks = deque()
+        self.stats = {'migrated': 0, 'missing': 0, 'failed': 0}
+
+    def _flush_unlinks(self, force=False):
+        now = time.monotonic()
+        while self.pending_unlinks and (force or self.pending_unlinks[0][0] <= now):
+            _, paths = self.pending_unlinks.popleft()
+            for path in paths:
+                _unlink_quietly(path)
+
+    def _next_batch(self, last_id):
+        query = File.query.with_entities(
+            File.id, File.file_path, File.filename, File.uploaded_by
+        ).filter(
+            File.storage_layout == File.LAYOUT_FLAT,
+            File.current_version.is_(None),
+            File.id > last_id
+        )
+        if self.user_id:
+            query = query.filter(File.uploaded_by == self.user_id)
+        return query.order_by(File.id).limit(self.batch_size).all()
+
+    def migrate_batch(self, rows):
+        updates = []
+        old_paths = []
+        for row in rows:
+            new_path = FileUtils.fanout_path(row.uploaded_by, row.filename)
+            if not os.path.exists(row.file_path):
+                if os.path.exists(new_path):
+                    updates.append({'id': row.id, 'file_path': new_path, 'storage_layout': File.LAYOUT_FANOUT})
+                else:
+                    self.stats['missing'] += 1
+                    logging.warning(f"文件不存在，跳过: {row.id} {row.file_path}")
+                continue
+
+            if self.dry_run:
+                updates.append({'id': row.id})
+                continue
+
+            try:
+                _place(row.file_path, new_path)
+                # 缩略图和压缩副本随原文件一起迁移
+                derived = [(FileUtils.get_thumbnail_path(row.file_path), FileUtils.get_thumbnail_path(new_path))]
+                derived += zip(CompressedVariants.paths(row.file_path), CompressedVariants.paths(new_path))
+                for old_derived, new_derived in derived:
+                    if os.path.exists(old_derived):
+                        _place(old_derived, new_derived)
+                        old_paths.append(old_derived)
+            except OSError as e:
+                self.stats['failed'] += 1
+                logging.error(f"迁移文件失败 {row.id}: {e}")
+                continue
+
+            updates.append({'id': row.id, 'file_path': new_path, 'storage_layout': File.LAYOUT_FANOUT})
+            if row.file_path != new_path:
+                old_paths.append(row.file_path)
+
+        if self.dry_run:
+            self.stats['migrated'] += len(updates)
+            return
+
+        if updates:
+            try:
+                db.session.execute(db.update(File), updates)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # 记录未更新，新位置的链接保留即可，下次运行会复用
+                raise
+            self.stats['migrated'] += len(updates)
+            self.pending_unlinks.append((time.monotonic() + self.unlink_delay, old_paths))
+
+    def run(self, limit=None):
+        last_id = 0
+        while True:
+            rows = self._next_batch(last_id)
+            if not rows:
+                break
+            if limit is not None:
+                rows = rows[:max(0, limit - self.stats['migrated'])]
+                if not rows:
+                    break
+            last_id = rows[-1].id
+
+            self.migrate_batch(rows)
+            db.session.expire_all()
+            self._flush_unlinks()
+            logging.info(f"进度: 已迁移 {self.stats['migrated']}，缺失 {self.stats['missing']}，"
+                         f"失败 {self.stats['failed']}，当前ID {last_id}")
+
+            # 限速，避免与线上请求争抢磁盘I/O
+            time.sleep(self.sleep)
+
+        if self.pending_unlinks:
+            time.sleep(max(0.0, self.pending_unlinks[-1][0] - time.monotonic()))
+            self._flush_unlinks(force=True)
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上传目录布局在线迁移')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--sleep', type=float, default=0.5, help='每批之间的暂停秒数')
+    parser.add_argument('--unlink-delay', type=float, default=10.0, help='删除旧路径前的等待秒数')
+    parser.add_argument('--limit', type=int, help='本次最多迁移的文件数')
+    parser.add_argument('--user-id', type=int, help='只迁移指定用户的文件')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        migrator = LayoutMigrator(args.batch_size, args.sleep, args.unlink_delay, args.dry_run, args.user_id)
+        try:
+            stats = migrator.run(args.limit)
+        except Exception as e:
+            logging.error(f"迁移任务失败: {str(e)}")
+            sys.exit(1)
+        logging.info(f"迁移完成: {stats}")
+
+
+if __name__ == '__main__':
+    main()
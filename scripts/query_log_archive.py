@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+访问日志归档查询工具
+直接读取 log_cleanup.py 写入的 Parquet 归档（不需要数据库），按用户、文件、动作、时间范围过滤，
+按列分组统计。过滤条件下推到 Parquet 的分区和行组统计信息，统计按批在列上向量化计算
+"""
+
+import os
+import sys
+import csv
+import json
+import glob
+import argparse
+from datetime import datetime, timedelta
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from app.utils.log_archive import archive_schema, table_path, COLUMNS
+
+GROUP_KEYS = ('date', 'hour', 'user_id', 'file_id', 'action', 'endpoint', 'method',
+              'status_code', 'ip_address')
+
+# (输出列名, 源列, 部分聚合, 合并聚合)
+AGGREGATES = (
+    ('count', 'id', 'count', 'sum'),
+    ('latency_count', 'response_time', 'count', 'sum'),
+    ('latency_sum', 'response_time', 'sum', 'sum'),
+    ('latency_max', 'response_time', 'max', 'max'),
+)
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def open_dataset(root):
+    # 只读取已完成的文件，跳过归档过程中的 .pending 文件
+    files = sorted(glob.glob(os.path.join(table_path(root), 'date=*', '*.parquet')))
+    partitioning = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+    return ds.dataset(files, schema=archive_schema().append(pa.field('date', pa.string())),
+                      format='parquet', partitioning=partitioning,
+                      partition_base_dir=table_path(root))
+
+
+def build_filter(args):
+    conditions = []
+    if args.start:
+        # 分区列先过滤，整天不在范围内的文件不会被打开
+        conditions.append(ds.field('date') >= args.start.date().isoformat())
+        conditions.append(ds.field('created_at') >= pa.scalar(args.start, pa.timestamp('ms')))
+    if args.end:
+        conditions.append(ds.field('date') <= args.end.date().isoformat())
+        conditions.append(ds.field('created_at') < pa.scalar(args.end, pa.timestamp('ms')))
+    if args.user_id:
+        conditions.append(ds.field('user_id').isin(args.user_id))
+    if args.file_id:
+        conditions.append(ds.field('file_id').isin(args.file_id))
+    if args.action:
+        conditions.append(ds.field('action').isin(args.action))
+    if args.endpoint:
+        conditions.append(ds.field('endpoint').isin(args.endpoint))
+    if args.ip:
+        conditions.append(ds.field('ip_address') == args.ip)
+    if args.status:
+        if args.status.lower().endswith('xx'):
+            base = int(args.status[0]) * 100
+            conditions.append((ds.field('status_code') >= base) & (ds.field('status_code') < base + 100))
+        else:
+            conditions.append(ds.field('status_code') == int(args.status))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def aggregate(dataset, expression, keys, batch_size):
+    """逐批分组做部分聚合，最后再合并，内存只与分组数有关"""
+    source_keys = ['created_at' if k == 'hour' else k for k in keys]
+    columns = list(dict.fromkeys(source_keys + ['id', 'response_time']))
+    partials = []
+
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+        if not batch.num_rows:
+            continue
+        table = pa.Table.from_batches([batch])
+        if 'hour' in keys:
+            table = table.append_column('hour', pc.floor_temporal(table['created_at'], unit='hour'))
+        partial = table.group_by(keys).aggregate([(src, fn) for _, src, fn, _ in AGGREGATES])
+        partials.append(partial.select(keys + [f'{src}_{fn}' for _, src, fn, _ in AGGREGATES])
+                        .rename_columns(keys + [name for name, _, _, _ in AGGREGATES]))
+
+    if not partials:
+        return None
+
+    merged = pa.concat_tables(partials).group_by(keys).aggregate(
+        [(name, fn) for name, _, _, fn in AGGREGATES]
+    )
+    merged = merged.select(keys + [f'{name}_{fn}' for name, _, _, fn in AGGREGATES]) \
+        .rename_columns(keys + [name for name, _, _, _ in AGGREGATES])
+    latency_avg = pc.divide(merged['latency_sum'], pc.cast(merged['latency_count'], pa.float64()))
+    merged = merged.append_column('latency_avg', pc.round(latency_avg, 2))
+    return merged.drop_columns(['latency_sum'])
+
+
+def select_rows(dataset, expression, columns, limit, batch_size):
+    """返回满足条件的原始记录"""
+    tables = []
+    remaining = limit
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+        if not batch.num_rows:
+            continue
+        batch = batch.slice(0, remaining)
+        tables.append(pa.Table.from_batches([batch]))
+        remaining -= batch.num_rows
+        if remaining <= 0:
+            break
+    return pa.concat_tables(tables) if tables else None
+
+
+def output(table, fmt):
+    if table is None or not table.num_rows:
+        print('没有匹配的记录', file=sys.stderr)
+        return
+
+    rows = table.to_pylist()
+    names = table.column_names
+    if fmt == 'json':
+        for row in rows:
+            print(json.dumps(row, ensure_ascii=False, default=str))
+    elif fmt == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=names)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        cells = [[str(name) for name in names]] + [
+            ['' if row[n] is None else str(row[n]) for n in names] for row in rows
+        ]
+        widths = [max(len(r[i]) for r in cells) for i in range(len(names))]
+        for r in cells:
+            print('  '.join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查询访问日志归档')
+    parser.add_argument('--archive-dir', default=os.getenv('LOG_ARCHIVE_DIR', '/app/archive'))
+    parser.add_argument('--start', type=parse_time, help='开始时间（含），ISO格式，UTC')
+    parser.add_argument('--end', type=parse_time, help='结束时间（不含），ISO格式，UTC')
+    parser.add_argument('--days', type=int, help='最近N天，与 --start 二选一')
+    parser.add_argument('--user-id', type=int, action='append')
+    parser.add_argument('--file-id', type=int, action='append')
+    parser.add_argument('--action', action='append')
+    parser.add_argument('--endpoint', action='append')
+    parser.add_argument('--status', help='状态码或类别，如 404、5xx')
+    parser.add_argument('--ip')
+    parser.add_argument('--group-by', help=f'逗号分隔的分组列：{",".join(GROUP_KEYS)}；不指定时列出记录')
+    parser.add_argument('--columns', help='列出记录时输出的列，逗号分隔')
+    parser.add_argument('--sort', default='count', help='分组统计的排序列，默认按次数降序')
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=65536)
+    parser.add_argument('--format', choices=('table', 'csv', 'json'), default='table')
+    args = parser.parse_args()
+
+    if args.days:
+        args.start = datetime.utcnow() - timedelta(days=args.days)
+
+    dataset = open_dataset(args.archive_dir)
+    expression = build_filter(args)
+
+    if args.group_by:
+        keys = [k.strip() for k in args.group_by.split(',') if k.strip()]
+        unknown = [k for k in keys if k not in GROUP_KEYS]
+        if unknown:
+            parser.error(f"不支持的分组列: {', '.join(unknown)}")
+        table = aggregate(dataset, expression, keys, args.batch_size)
+        if table is not None:
+            order = 'ascending' if args.sort in keys else 'descending'
+            table = table.sort_by([(args.sort, order)]).slice(0, args.limit)
+    else:
+        columns = [c.strip() for c in args.columns.split(',')] if args.columns else list(COLUMNS)
+        table = select_rows(dataset, expression, columns, args.limit, args.batch_size)
+
+    output(table, args.format)
+
+
+if __name__ == '__main__':
+    main()
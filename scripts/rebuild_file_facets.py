@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+重建文件分面计数
+按未删除的文件记录重新计算 file_facet_count 表。计数表由上传、删除、恢复、公开状态变更和提交新版本
+时增量维护，首次部署或直接修改数据库后需要运行一次；重建期间并发的修改可能造成少量偏差，宜在低峰期运行
+"""
+
+import os
+import sys
+import logging
+import argparse
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.utils.facets import FacetCounter
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重建文件分面计数')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        try:
+            total = FacetCounter.rebuild(args.batch_size)
+        except Exception as e:
+            logging.error(f"重建分面计数失败: {str(e)}")
+            db.session.rollback()
+            sys.exit(1)
+        logging.info(f"重建完成: 统计了 {total} 个文件")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+重建文件下载热度
+按 access_entity_rollup 中的按天下载汇总重新计算 file.trend_score，不读取原始访问日志。
+热度由每次下载增量更新，只在修改 TRENDING_HALF_LIFE_HOURS 后或首次部署时需要运行；
+汇总表只包含写入访问日志的下载，重建后 API 下载接口的历史下载不计入热度
+"""
+
+import os
+import sys
+import logging
+import argparse
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.utils.trending import Trending
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重建文件下载热度')
+    parser.add_argument('--days', type=int, help='统计最近的天数，默认为10个半衰期')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        try:
+            total = Trending.rebuild(args.days, args.batch_size)
+        except Exception as e:
+            logging.error(f"重建下载热度失败: {str(e)}")
+            db.session.rollback()
+            sys.exit(1)
+        logging.info(f"重建完成: {total} 个文件有热度分数")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+存储用量对账
+按未删除的文件记录重新计算每个用户的 storage_used，报告并可修正计数偏差
+（直接修改数据库、fsck 修复等绕过上传/删除流程的操作都会造成偏差）
+"""
+
+import os
+import sys
+import logging
+import argparse
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.models import User
+from app.utils.quota import QuotaManager
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def reconcile_all(batch_size=1000, fix=False, user_id=None):
+    """按用户ID分批对账，返回存在偏差的用户数"""
+    if user_id:
+        batches = [[user_id]]
+    else:
+        batches = _id_batches(batch_size)
+
+    drifted = 0
+    for ids in batches:
+        for uid, recorded, actual in QuotaManager.reconcile(ids, fix=fix):
+            drifted += 1
+            logging.warning(f"用户 {uid} 用量偏差: 记录 {recorded}，实际 {actual}，差值 {recorded - actual}")
+        db.session.expire_all()
+    return drifted
+
+
+def _id_batches(batch_size):
+    last_id = 0
+    while True:
+        ids = [row.id for row in User.query.with_entities(User.id).filter(
+            User.id > last_id
+        ).order_by(User.id).limit(batch_size)]
+        if not ids:
+            return
+        last_id = ids[-1]
+        yield ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='存储用量对账')
+    parser.add_argument('--fix', action='store_true', help='修正存在偏差的用户用量')
+    parser.add_argument('--user-id', type=int, help='只检查指定用户')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        try:
+            drifted = reconcile_all(args.batch_size, args.fix, args.user_id)
+        except Exception as e:
+            logging.error(f"用量对账失败: {str(e)}")
+            db.session.rollback()
+            sys.exit(1)
+
+        action = '已修正' if args.fix else '发现'
+        logging.info(f"用量对账完成: {action} {drifted} 个用户存在偏差")
+        if drifted and not args.fix:
+            sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
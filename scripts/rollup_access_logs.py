@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+访问日志汇总任务
+把新写入的 AccessLog 增量累加到小时/天/月汇总表（access_log_rollup、access_entity_rollup），
+供 /admin/reports 查询。汇总表不随 log_cleanup.py 清理原始日志而删除
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.utils.access_rollup import AccessRollup
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def rollup_once(batch_size, settle_seconds):
+    """汇总到当前为止的所有稳定日志，返回处理的日志数"""
+    total = 0
+    while True:
+        processed = AccessRollup.run_batch(batch_size, settle_seconds)
+        total += processed
+        if processed < batch_size:
+            return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='汇总访问日志')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--settle-seconds', type=int, default=60,
+                        help='只汇总写入超过该秒数的日志')
+    parser.add_argument('--hourly-retention-days', type=int, default=400,
+                        help='小时汇总保留天数，天和月汇总永久保留；0 表示不清理')
+    parser.add_argument('--interval', type=float, help='循环运行的间隔秒数，不指定时只运行一次')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        while True:
+            try:
+                processed = rollup_once(args.batch_size, args.settle_seconds)
+                if processed:
+                    logging.info(f"已汇总 {processed} 条访问日志")
+                if args.hourly_retention_days:
+                    before = datetime.utcnow() - timedelta(days=args.hourly_retention_days)
+                    pruned = AccessRollup.prune_hourly(before)
+                    if pruned:
+                        logging.info(f"已删除 {pruned} 条过期的小时汇总")
+            except Exception as e:
+                logging.error(f"访问日志汇总失败: {str(e)}")
+                db.session.rollback()
+                if args.interval is None:
+                    sys.exit(1)
+
+            if args.interval is None:
+                return
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
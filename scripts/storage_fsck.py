@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+上传目录与数据库一致性检查
+并行扫描 UPLOAD_FOLDER，外部排序后与按文件名顺序流式读取的 File 记录做归并比对，报告：
+  missing  - 记录存在但磁盘文件缺失
+  orphan   - 磁盘文件没有对应记录（或是迁移遗留的旧副本）
+  size     - 磁盘文件大小与记录不一致
+内存占用只与 --sort-buffer 有关，与文件总数无关；可选修复
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import queue
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from flask import current_app
+from app import create_app, db
+from app.models import File
+from app.utils.file_utils import FileUtils
+from app.utils.compression import is_variant
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# 不参与比对的顶层目录（派生文件、版本分块）和临时文件后缀；压缩副本由 is_variant 识别
+SKIP_TOP_LEVEL = {'thumbnails', 'chunks'}
+SKIP_SUFFIXES = ('.migrating', '.tmp')
+
+_DONE = object()
+
+
+class DiskScanner:
+    """多线程扫描上传目录，结果经外部排序后按文件名顺序输出"""
+
+    def __init__(self, root, workers=8, sort_buffer=200000):
+        self.root = root
+        self.workers = workers
+        self.sort_buffer = sort_buffer
+        self.entries = queue.Queue(maxsize=10000)
+        self.skipped = 0
+
+    def _walk(self, path):
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            if entry.name.endswith(SKIP_SUFFIXES) or is_variant(entry.name):
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                            self.entries.put((entry.name, entry.path, st.st_size, st.st_mtime))
+            except OSError as e:
+                logging.error(f"扫描目录失败 {current}: {e}")
+
+    def _produce(self):
+        top_dirs = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_TOP_LEVEL:
+                        top_dirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    self.entries.put((entry.name, entry.path, st.st_size, st.st_mtime))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(self._walk, top_dirs))
+        self.entries.put(_DONE)
+
+    def _spill(self, buffer, tmpdir):
+        buffer.sort()
+        fd, path = tempfile.mkstemp(dir=tmpdir, suffix='.run')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for name, full_path, size, mtime in buffer:
+                f.write(f'{name}\t{full_path}\t{size}\t{mtime}\n')
+        return path
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                name, full_path, size, mtime = line.rstrip('\n').split('\t')
+                yield name, full_path, int(size), float(mtime)
+
+    def sorted_entries(self, tmpdir):
+        """按文件名排序的 (name, path, size, mtime) 流"""
+        producer = threading.Thread(target=self._produce, daemon=True)
+        producer.start()
+
+        runs = []
+        buffer = []
+        while True:
+            item = self.entries.get()
+            if item is _DONE:
+                break
+            if '\t' in item[1] or '\n' in item[1]:
+                self.skipped += 1
+                logging.warning(f"跳过包含特殊字符的路径: {item[1]!r}")
+                continue
+            buffer.append(item)
+            if len(buffer) >= self.sort_buffer:
+                runs.append(self._spill(buffer, tmpdir))
+                buffer = []
+        producer.join()
+
+        buffer.sort()
+        return heapq.merge(buffer, *[self._read_run(run) for run in runs])
+
+
+def db_rows():
+    """按文件名顺序流式读取本地存储、未分块的文件记录（服务端游标）"""
+    order_column = File.filename
+    if db.engine.dialect.name == 'mysql':
+        # 与Python字符串比较保持一致的二进制排序
+        order_column = File.filename.collate('utf8mb4_bin')
+
+    stmt = db.select(
+        File.id, File.filename, File.file_path, File.file_size,
+        File.uploaded_by, File.storage_layout, File.deleted_at
+    ).where(
+        File.storage_backend == 'local',
+        File.current_version.is_(None)
+    ).order_by(order_column).execution_options(stream_results=True, yield_per=2000)
+    for row in db.session.execute(stmt):
+        yield row
+
+
+def merge(disk_iter, row_iter):
+    """归并两个按文件名排序的流，输出 (filename, 记录或None, [磁盘条目])"""
+    disk_entry = next(disk_iter, None)
+    row = next(row_iter, None)
+    while disk_entry is not None or row is not None:
+        if row is None or (disk_entry is not None and disk_entry[0] < row.filename):
+            name, current_row = disk_entry[0], None
+        else:
+            name, current_row = row.filename, row
+            row = next(row_iter, None)
+
+        entries = []
+        while disk_entry is not None and disk_entry[0] == name:
+            entries.append(disk_entry)
+            disk_entry = next(disk_iter, None)
+        yield name, current_row, entries
+
+
+class StorageChecker:
+    def __init__(self, report=None, repair=(), orphan_min_age=3600):
+        self.report = report
+        self.repair = set(repair)
+        self.orphan_min_age = orphan_min_age
+        self.stats = {'checked_rows': 0, 'disk_files': 0, 'missing': 0, 'orphan': 0, 'size': 0,
+                      'repaired': 0}
+        self._missing_ids = []
+        self._size_fixes = {}
+
+    def _issue(self, kind, **fields):
+        self.stats[kind] += 1
+        if self.report:
+            self.report.write(json.dumps({'issue': kind, **fields}, ensure_ascii=False) + '\n')
+
+    def _remove_orphan(self, path, mtime):
+        # 上传时先写文件再提交记录，太新的文件可能属于正在进行的上传
+        if time.time() - mtime < self.orphan_min_age:
+            return
+        try:
+            os.remove(path)
+            self.stats['repaired'] += 1
+        except OSError as e:
+            logging.error(f"删除孤立文件失败 {path}: {e}")
+
+    def _flush_repairs(self, force=False):
+        # 读取记录的服务端游标占用会话连接；新的应用上下文有独立的会话和连接，
+        # 修复与页面上的删除一样同时调整用量和分面计数
+        if self._missing_ids and (force or len(self._missing_ids) >= 1000):
+            with current_app.app_context():
+                self.stats['repaired'] += FileUtils.mark_deleted(self._missing_ids)
+            self._missing_ids = []
+        if self._size_fixes and (force or len(self._size_fixes) >= 1000):
+            with current_app.app_context():
+                self.stats['repaired'] += FileUtils.correct_sizes(self._size_fixes)
+            self._size_fixes = {}
+
+    def check(self, merged):
+        for name, row, entries in merged:
+            self.stats['disk_files'] += len(entries)
+            expected = None
+            if row is not None:
+                self.stats['checked_rows'] += 1
+                expected = FileUtils.resolve_path(row)
+                found = next((e for e in entries if e[1] == expected), None)
+
+                if found is None and row.deleted_at is None:
+                    self._issue('missing', id=row.id, path=expected)
+                    if 'missing' in self.repair:
+                        self._missing_ids.append(row.id)
+                elif found is not None and found[2] != row.file_size and row.deleted_at is None:
+                    self._issue('size', id=row.id, path=expected, recorded=row.file_size, actual=found[2])
+                    if 'size' in self.repair:
+                        self._size_fixes[row.id] = found[2]
+
+            for entry in entries:
+                if entry[1] == expected:
+                    continue
+                self._issue('orphan', path=entry[1], size=entry[2], id=row.id if row else None)
+                if 'orphan' in self.repair:
+                    self._remove_orphan(entry[1], entry[3])
+
+            if self.repair:
+                self._flush_repairs()
+
+        if self.repair:
+            self._flush_repairs(force=True)
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上传目录与数据库一致性检查')
+    parser.add_argument('--root', default=os.getenv('UPLOAD_FOLDER', '/app/uploads'))
+    parser.add_argument('--workers', type=int, default=8, help='扫描线程数')
+    parser.add_argument('--sort-buffer', type=int, default=200000, help='内存中排序的最大条目数')
+    parser.add_argument('--report', help='问题明细输出文件（JSON Lines）')
+    parser.add_argument('--repair', default='', help='修复项，逗号分隔：orphan,missing,size')
+    parser.add_argument('--orphan-min-age', type=float, default=3600,
+                        help='孤立文件至少存在多少秒才删除')
+    args = parser.parse_args()
+
+    repair = [r.strip() for r in args.repair.split(',') if r.strip()]
+    unknown = set(repair) - {'orphan', 'missing', 'size'}
+    if unknown:
+        parser.error(f"未知的修复项: {', '.join(sorted(unknown))}")
+
+    app = create_app()
+    with app.app_context():
+        report = open(args.report, 'w', encoding='utf-8') if args.report else None
+        started = time.time()
+        try:
+            with tempfile.TemporaryDirectory(prefix='fsck-') as tmpdir:
+                scanner = DiskScanner(args.root, args.workers, args.sort_buffer)
+                checker = StorageChecker(report, repair, args.orphan_min_age)
+                stats = checker.check(merge(iter(scanner.sorted_entries(tmpdir)), iter(db_rows())))
+        except Exception as e:
+            logging.error(f"一致性检查失败: {str(e)}")
+            db.session.rollback()
+            sys.exit(1)
+        finally:
+            if report:
+                report.close()
+
+        stats['skipped'] = scanner.skipped
+        stats['elapsed_seconds'] = round(time.time() - started, 1)
+        logging.info(f"一致性检查完成: {json.dumps(stats, ensure_ascii=False)}")
+        if stats['missing'] or stats['orphan'] or stats['size']:
+            sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+存储清理任务
+批量删除超过宽限期的已删除文件的存储数据（原文件、缩略图和压缩副本，或对象存储中的对象），成功后彻底删除数据库记录，
+失败的文件记录错误并在下次运行时重试；同时删除不再被任何版本引用的分块
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app import create_app, db
+from app.models import File
+from app.utils.file_utils import FileUtils
+from app.utils.versioning import VersionStore
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+class StorageSweeper:
+    def __init__(self, grace_hours=None, batch_size=500, max_attempts=10):
+        if grace_hours is None:
+            grace_hours = float(os.getenv('DELETE_GRACE_HOURS', 24))
+        self.grace = timedelta(hours=grace_hours)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+    def sweep_once(self):
+        """清理一轮，返回 (已清理数, 失败数)"""
+        cutoff = datetime.utcnow() - self.grace
+        purged = failed = 0
+        last_id = 0
+
+        while True:
+            rows = File.query.with_entities(
+                File.id, File.file_path, File.filename, File.uploaded_by,
+                File.storage_layout, File.storage_backend, File.purge_attempts
+            ).filter(
+                File.deleted_at.isnot(None),
+                File.deleted_at <= cutoff,
+                File.purge_attempts < self.max_attempts,
+                File.id > last_id
+            ).order_by(File.id).limit(self.batch_size).all()
+
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            purge_ids = []
+            failures = []
+            for row in rows:
+                error = FileUtils.remove_file_data(row)
+                if error:
+                    failures.append({
+                        'id': row.id,
+                        'purge_attempts': row.purge_attempts + 1,
+                        'purge_error': error[:255]
+                    })
+                    if row.purge_attempts + 1 >= self.max_attempts:
+                        logging.error(f"文件 {row.id} 清理失败次数已达上限: {error}")
+                else:
+                    purge_ids.append(row.id)
+
+            # 磁盘文件已删除的记录一次性彻底删除
+            purged += FileUtils.purge_records(purge_ids)
+
+            if failures:
+                try:
+                    db.session.execute(db.update(File), failures)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+                failed += len(failures)
+
+            db.session.expire_all()
+
+        # 没有版本引用的分块（文件已彻底删除或上传后未提交）同样在宽限期后删除
+        chunks = VersionStore.collect_garbage(cutoff, self.batch_size)
+        if chunks:
+            logging.info(f"已删除 {chunks} 个未被引用的版本分块")
+
+        return purged, failed
+
+    def run(self, interval=None):
+        while True:
+            try:
+                purged, failed = self.sweep_once()
+                if purged or failed:
+                    logging.info(f"存储清理完成: 清理 {purged} 个文件，失败 {failed} 个")
+            except Exception as e:
+                logging.error(f"存储清理失败: {str(e)}")
+                db.session.rollback()
+                if interval is None:
+                    sys.exit(1)
+
+            if interval is None:
+                return
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='清理已删除文件')
+    parser.add_argument('--grace-hours', type=float, help='删除后保留的小时数，默认读取 DELETE_GRACE_HOURS')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-attempts', type=int, default=10)
+    parser.add_argument('--interval', type=float, help='循环运行的间隔秒数，不指定时只运行一次')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        StorageSweeper(args.grace_hours, args.batch_size, args.max_attempts).run(args.interval)
+
+
+if __name__ == '__main__':
+    main()
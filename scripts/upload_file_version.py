@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+增量上传文件新版本
+按服务端相同的算法把本地文件切分为内容定义的分块，先查询服务端缺少哪些分块，只上传缺少的分块，
+再提交分块列表生成新版本。未修改的部分不会重复上传
+
+用法示例：
+    python scripts/upload_file_version.py --url http://localhost:5000 --username alice --file-id 42 report.xlsx
+"""
+
+import os
+import sys
+import json
+import getpass
+import hashlib
+import logging
+import argparse
+import urllib.request
+import urllib.error
+from http.cookiejar import CookieJar
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加到Python路径
+sys.path.append('/app')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.utils.versioning import iter_chunks
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+READ_SIZE = 1024 * 1024
+
+
+class VersionUploader:
+    def __init__(self, base_url, workers=4):
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, json_body=None, data=None, content_type=None):
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            content_type = 'application/json'
+        if content_type:
+            headers['Content-Type'] = content_type
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(req, timeout=120) as response:
+                return response.status, json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            try:
+                return e.code, json.loads(body)
+            except ValueError:
+                return e.code, {'error': body.decode('utf-8', 'replace')}
+
+    def login(self, username, password):
+        status, body = self.request('POST', '/auth/login', {'username': username, 'password': password})
+        if status != 200:
+            raise RuntimeError(f"登录失败: {body.get('error', status)}")
+
+    @staticmethod
+    def scan(path):
+        """返回 [(sha256, offset, size)]"""
+        chunks, offset = [], 0
+        with open(path, 'rb') as f:
+            for data in iter_chunks(iter(lambda: f.read(READ_SIZE), b'')):
+                chunks.append((hashlib.sha256(data).hexdigest(), offset, len(data)))
+                offset += len(data)
+        return chunks
+
+    def _put_chunk(self, path, file_id, digest, offset, size):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size)
+        status, body = self.request('PUT', f'/api/files/{file_id}/versions/chunks/{digest}',
+                                    data=data, content_type='application/octet-stream')
+        if status not in (200, 201):
+            raise RuntimeError(f"上传分块失败 {digest}: {body.get('error', status)}")
+        return size
+
+    def upload(self, path, file_id, comment=None):
+        chunks = self.scan(path)
+        hashes = [digest for digest, _, _ in chunks]
+        total = sum(size for _, _, size in chunks)
+
+        status, body = self.request('POST', f'/api/files/{file_id}/versions/check', {'chunks': hashes})
+        if status != 200:
+            raise RuntimeError(f"查询分块失败: {body.get('error', status)}")
+        missing = set(body['missing'])
+
+        # 同一内容的分块只上传一次
+        todo = {}
+        for digest, offset, size in chunks:
+            if digest in missing and digest not in todo:
+                todo[digest] = (offset, size)
+        logging.info(f"共 {len(chunks)} 个分块（{total} 字节），需上传 {len(todo)} 个")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            sent = sum(pool.map(lambda item: self._put_chunk(path, file_id, item[0], *item[1]), todo.items()))
+
+        status, body = self.request('POST', f'/api/files/{file_id}/versions', {'chunks': hashes, 'comment': comment})
+        if status != 201:
+            raise RuntimeError(f"提交版本失败: {body.get('error', status)}")
+        logging.info(f"已提交第 {body['version']} 版，上传 {sent} 字节（{sent * 100 / max(total, 1):.1f}%）")
+        return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description='增量上传文件新版本')
+    parser.add_argument('path', help='本地文件')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', help='不指定时从 APP_PASSWORD 读取或交互输入')
+    parser.add_argument('--file-id', type=int, required=True)
+    parser.add_argument('--comment')
+    parser.add_argument('--workers', type=int, default=4, help='并行上传分块数')
+    args = parser.parse_args()
+
+    uploader = VersionUploader(args.url, args.workers)
+    try:
+        uploader.login(args.username, args.password or os.getenv('APP_PASSWORD') or getpass.getpass())
+        uploader.upload(args.path, args.file_id, args.comment)
+    except Exception as e:
+        logging.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()